@@ -1,9 +1,12 @@
-from collections import Counter
+import copy
+from collections import deque
 import numpy as np
 import cv2
-import datetime
-import copy
 from Utils import *
+from Deadline import Deadline
+from BitRow import BitRow
+from RunLengthIndex import RunLengthIndex
+from RowScheduler import RowScheduler, PROCESS_SCHEDULER
 
 
 class AlgorithmicRowDecoder:
@@ -15,11 +18,22 @@ class AlgorithmicRowDecoder:
         if a three wide unit is included before the rack starts.
     """
 
-    def __init__(self, grouped_matrix, bits_count, start_time, timeout):
+    def __init__(self, grouped_matrix, bits_count, deadline=None, workers=1, progress=None):
+        """
+            workers: number of processes which decode the rows,
+                     0 uses one per CPU (see RowScheduler)
+            progress: optional function which receives the number of
+                      decoded rows and the number of all rows
+        """
         self.grouped_matrix = grouped_matrix
         self.bits_count = bits_count
-        self.start_time = start_time
-        self.timeout = timeout
+        self.deadline = deadline if deadline is not None else Deadline()
+        # The row decoding is pure Python, so the rows are
+        # decoded by processes
+        self.scheduler = RowScheduler(workers, PROCESS_SCHEDULER)
+        self.progress = progress
+        # Number of sub-rows explored by bfs_find
+        self.bfs_nodes = 0
 
     def decode_rows(self):
         return self.reduce_grouped_matrix(self.grouped_matrix)
@@ -30,17 +44,32 @@ class AlgorithmicRowDecoder:
             They are reduced to a single pixel lines (decoded)
         """
         new_pixel_matrix = []
-        for index, row in enumerate(matrix):
-            if len(row) > 0:
-                now = datetime.datetime.now().replace(microsecond=0)
-                difference = now - self.start_time
-                if (difference.seconds // 60) > self.timeout:
-                    return []
-                new_row = self.apply_decoding_strategies(row)
+        rows = [row for row in matrix if len(row) > 0]
+        results = self.scheduler.map(self.decode_row, rows, self.deadline.check)
+        try:
+            for index, (new_row, bfs_nodes) in enumerate(results):
+                self.deadline.check()
+                self.bfs_nodes += bfs_nodes
                 if new_row is not None:
                     new_pixel_matrix.append(new_row)
+                if self.progress is not None:
+                    self.progress(index + 1, len(rows))
+        finally:
+            # Terminates the worker processes on a timeout or a cancellation
+            results.close()
         return new_pixel_matrix
 
+    def decode_row(self, row):
+        """
+            Decodes a single row with a copy of the decoder, so rows which
+            are decoded at the same time don't share the counters.
+            Returns the valid rows and the number of explored BFS nodes
+        """
+        self.deadline.check()
+        decoder = copy.copy(self)
+        decoder.bfs_nodes = 0
+        return decoder.apply_decoding_strategies(row), decoder.bfs_nodes
+
     def apply_decoding_strategies(self, row):
         """
             Applies a combination of dilation and row splitting
@@ -49,16 +78,16 @@ class AlgorithmicRowDecoder:
         valid_rows = set()
         if len(new_row) != self.bits_count or not parity_check(new_row):
             valid_rows |= self.bfs_find(row)
-            if len(list(valid_rows)) == 0:
+            if len(valid_rows) == 0:
                 row = self.apply_dilation(row)
                 valid_rows |= self.bfs_find(row)
-                if len(list(valid_rows)) == 0:
+                if len(valid_rows) == 0:
                     print('ERROR ERROR')
         else:
             valid_rows.add(new_row)
         return list(valid_rows)
 
-    def reduce_row(self, row):
+    def reduce_row(self, row, column_colors=None):
         """
             Performs the row decoding:
             - Determine color area sizes
@@ -66,18 +95,22 @@ class AlgorithmicRowDecoder:
             - Determine areas which are two units wide
             - Check for three unit wide area
             - Return new decoded row
+            column_colors can be passed if the column colors of the
+            row are already known (see bfs_find)
         """
-        sizes = self.determine_color_area_sizes(row)
+        if column_colors is None:
+            column_colors = self.determine_column_colors(self.create_row_matrix(row))
+        sizes = self.determine_color_area_sizes(column_colors)
         sorted_sizes = sorted(sizes, key=lambda k: k['size'])
         while sorted_sizes[0]['size'] == 1:
             row = self.apply_dilation(row)
-            sizes = self.determine_color_area_sizes(row)
+            sizes = self.determine_color_area_sizes(self.determine_column_colors(self.create_row_matrix(row)))
             sorted_sizes = sorted(sizes, key=lambda k: k['size'])
 
         double_units = int(self.bits_count - len(sorted_sizes))
         epsilon, triple_white = self.get_epsilon(row, double_units, sorted_sizes)
         if epsilon is None and triple_white is None:
-            return ''
+            return BitRow()
         return self.create_new_row(sizes, epsilon, row, triple_white)
 
     def apply_dilation(self, row):
@@ -105,77 +138,85 @@ class AlgorithmicRowDecoder:
             Converts a row to a numpy array and use a three dimensional
             vector to represent the color.
         """
-        img_row = np.zeros((len(row), len(row[0]['row']), 3), np.uint8)
-        for row_index, row2 in enumerate(row):
-            for col_index, col in enumerate(row2['row']):
-                if col == 1:
-                    img_row[row_index, col_index] = (0, 0, 0)
-                elif col == 0:
-                    img_row[row_index, col_index] = (255, 255, 255)
-        return img_row
+        matrix = self.create_row_matrix(row)
+        img_row = np.where(matrix == 1, 0, 255).astype(np.uint8)
+        return cv2.cvtColor(img_row, cv2.COLOR_GRAY2BGR)
 
     def create_binary_row(self, binary_img, row):
         """
             Converts a row with three dimensional color values
             to a binary row  (only black/white)
         """
-        rows, columns, _ = binary_img.shape
-        pixel = 0
-        new_rows = []
-        new_row = []
-        for i in range(rows):
-            for j in range(columns):
-                pixel = binary_img[i, j]
-                if pixel[0] == 0:
-                    new_row.append(1)
-                elif pixel[0] == 255:
-                    new_row.append(0)
-            new_rows.append(new_row)
-            new_row = []
-        dilated_row = copy.deepcopy(row)
-        for i in range(len(new_rows)):
-            dilated_row[i]['row'] = new_rows[i]
+        new_rows = (binary_img[:, :, 0] == 0).astype(np.uint8)
+        dilated_row = []
+        for i, single_row in enumerate(row):
+            dilated_row.append(dict(single_row, row=new_rows[i]))
         return dilated_row
 
-    def determine_color_area_sizes(self, row):
+    def determine_color_area_sizes(self, column_colors):
+        """
+            Run-length encodes the column colors. The first area is
+            always black, if the row starts white it has the size 0.
+        """
+        _, run_sizes, values = RunLengthIndex.from_matrix(column_colors).line_runs(0)
         sizes = []
-        size = 0
-        last_value = 1
-        pos = 0
-        for i in range(len(row[0]['row'])):
-            value = self.determine_column_color(row, i)
-            if value == last_value:
-                size += 1
-            else:
-                sizes.append({'pos': pos, 'size': size, 'value': last_value})
-                size = 1
-                pos += 1
-            last_value = value
-        sizes.append({'pos': pos, 'size':size, 'value': last_value})
+        if values[0] != 1:
+            sizes.append({'pos': 0, 'size': 0, 'value': 1})
+        for size, value in zip(run_sizes.tolist(), values.tolist()):
+            sizes.append({'pos': len(sizes), 'size': size, 'value': value})
         return sizes
 
-    def determine_column_color(self, row, index):
+    def create_row_matrix(self, row):
         """
-            Most common pixel color determines the column color
+            Converts the pixel lines of a row to a 2-D array.
+            The rack of white-black lines is extended.
         """
-        pixels = []
-        for single_row in row:
-            if single_row['pattern'] == WHITE_BLACK_PATTERN:
-                single_row = self.extend_rack(single_row)
-            pixels.append(single_row['row'][index])
-        counter = Counter(pixels)
-        return counter.most_common(1)[0][0]
+        matrix = np.array([single_row['row'] for single_row in row], np.uint8)
+        white_black = np.array([single_row['pattern'] == WHITE_BLACK_PATTERN for single_row in row])
+        if white_black.any():
+            self.extend_racks(matrix, white_black)
+        return matrix
 
-    def extend_rack(self, row):
+    def create_column_votes(self, matrix):
         """
-            Scans row from right to left and replaces all white pixels
-            with black pixels until a black pixel is found
+            votes[i] contains the number of black pixels per column
+            in the pixel lines 0..i-1, so the votes of any range of
+            pixel lines are votes[end] - votes[start]
         """
-        for j in range(len(row['row'])):
-            if row['row'][len(row['row']) - j - 1] == 0:
-                row['row'][len(row['row']) - j - 1] = 1
-            else:
-                return row
+        votes = np.zeros((len(matrix) + 1, matrix.shape[1]), np.int32)
+        np.cumsum(matrix, axis=0, out=votes[1:])
+        return votes
+
+    def determine_column_colors(self, matrix, votes=None, start=0, end=None):
+        """
+            Most common pixel color determines the column color,
+            on a tie the color of the first pixel line is used.
+            If votes (see create_column_votes) are passed, only the
+            pixel lines start..end-1 are considered.
+        """
+        if end is None:
+            end = len(matrix)
+        if votes is None:
+            black = np.count_nonzero(matrix[start:end], axis=0)
+        else:
+            black = votes[end] - votes[start]
+        lines = end - start
+        colors = matrix[start].copy()
+        colors[black * 2 > lines] = 1
+        colors[black * 2 < lines] = 0
+        return colors
+
+    def extend_racks(self, matrix, lines):
+        """
+            Replaces all white pixels after the last black pixel
+            with black pixels in the selected pixel lines
+        """
+        width = matrix.shape[1]
+        reversed_lines = matrix[lines, ::-1] != 0
+        # Lines without a black pixel become completely black
+        last_black = np.where(reversed_lines.any(axis=1), width - 1 - reversed_lines.argmax(axis=1), -1)
+        rack = np.arange(width) > last_black[:, None]
+        matrix[lines] |= rack.astype(np.uint8)
 
     def get_epsilon(self, row, double_units, sorted_sizes):
         triple_unit = False
@@ -202,45 +243,51 @@ class AlgorithmicRowDecoder:
         return sorted_sizes[-1*double_units - offset]['size'], triple_unit
 
     def create_new_row(self, sizes, epsilon, row, triple_white):
-        new_row = ''
+        value = 0
+        length = 0
         for k, item in enumerate(sizes):
             if item['size'] < epsilon:
-                new_row += str(item['value'])
+                units = 1
             elif row[0]['pattern'] == WHITE_BLACK_PATTERN and k == len(sizes) - 1:
-                new_row += str(item['value'])
-                new_row += str(item['value'])
-                new_row += str(item['value'])
+                units = 3
             elif row[0]['pattern'] == WHITE_BLACK_PATTERN and triple_white and k == (len(sizes) - 1 - 1):
-                new_row += str(item['value'])
-                new_row += str(item['value'])
-                new_row += str(item['value'])
+                units = 3
             elif row[0]['pattern'] == BLACK_WHITE_PATTERN and triple_white and k == (len(sizes) - 1 - 2):
-                new_row += str(item['value'])
-                new_row += str(item['value'])
-                new_row += str(item['value'])
+                units = 3
             else:
-                new_row += str(item['value'])
-                new_row += str(item['value'])
-        return new_row
+                units = 2
+            value <<= units
+            if item['value'] == 1:
+                value |= (1 << units) - 1
+            length += units
+        return BitRow(value, length)
 
-    def bfs_find(self, row, valid_rows=set()):
+    def bfs_find(self, row):
         """
-            Rows are split with a BFS search.
+            Rows are split with a BFS search. The nodes are (start, end)
+            ranges of pixel lines, their column colors are computed from
+            the column votes of the whole row.
             All valid rows are returned
         """
-        explored = []
-        queue = [row]
+        valid_rows = set()
+        matrix = self.create_row_matrix(row)
+        votes = self.create_column_votes(matrix)
+        explored = set()
+        queue = deque([(0, len(row))])
 
         while queue:
-            node = queue.pop(0)
+            self.deadline.check()
+            node = queue.popleft()
             if node not in explored:
-                explored.append(node)
-                if len(node) > 0:
-                    reduced = self.reduce_row(node)
+                explored.add(node)
+                start, end = node
+                if end - start > 0:
+                    self.bfs_nodes += 1
+                    column_colors = self.determine_column_colors(matrix, votes, start, end)
+                    reduced = self.reduce_row(row[start:end], column_colors)
                     if len(reduced) == self.bits_count and parity_check(reduced):
                         valid_rows.add(reduced)
-                    top = node[0:round(len(node)/2)]
-                    bottom = node[round(len(node)/2):]
-                    queue.append(top)
-                    queue.append(bottom)
+                    split = start + round((end - start) / 2)
+                    queue.append((start, split))
+                    queue.append((split, end))
         return valid_rows
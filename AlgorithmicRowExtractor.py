@@ -1,4 +1,6 @@
+import numpy as np
 from Utils import *
+from Deadline import Deadline
 SEGMENT_SIZE = 75
 MIN_OCCURENCE = 6
 
@@ -9,15 +11,22 @@ class AlgorithmicRowExtractor:
         all rows in a Cauzin Softstrip.
     """
 
-    def __init__(self, softstrip_matrix, bits_per_row):
+    def __init__(self, softstrip_matrix, bits_per_row, deadline=None):
         self.softstrip_matrix = softstrip_matrix
         self.bits_per_row = bits_per_row
+        self.deadline = deadline if deadline is not None else Deadline()
 
     def extract_rows(self):
         boundaries = self.determine_matrix_boundaries()
         pattern_pixel_matrix = self.determine_pattern_per_line(boundaries)
         return self.group_by_pattern(pattern_pixel_matrix)
 
+    def extract_grouped_rows(self):
+        """
+            Returns the binary and the grayscale rows
+        """
+        return self.extract_rows()
+
     def determine_matrix_boundaries(self):
         """
             Divides the Softstrip into multiple segments and determines for
@@ -29,18 +38,25 @@ class AlgorithmicRowExtractor:
             Instead of determining the min/max values for the whole softstrip,
             it is determined for multiple segments to increase the accuracy.
         """
-        segments = int(len(self.softstrip_matrix.binary_matrix) / SEGMENT_SIZE)
+        lines = len(self.softstrip_matrix.binary_matrix)
+        segments = int(lines / SEGMENT_SIZE)
         start = 0
         boundaries = []
-
-        for index, row in enumerate(self.softstrip_matrix.binary_matrix):
-            if index % segments == 0 and start != index:
-                if (len(self.softstrip_matrix.binary_matrix) - index) <= segments:
-                    boundary = self.determine_segment_boundaries(start, len(self.softstrip_matrix.binary_matrix))
-                else:
-                    boundary = self.determine_segment_boundaries(start, index)
-                boundaries.append(boundary)
-                start = index
+        # Left start of the checkerboard (second white to black transition)
+        # and last black pixel of the rack for each line
+        run_length_index = self.softstrip_matrix.run_length_index
+        self.checkerboard_positions = run_length_index.nth_run_start(1, 2)
+        self.rack_positions = run_length_index.last_run_end(1)
+
+        # A segment has 'segments' lines, the last one is extended to the end
+        for index in range(segments, lines, segments):
+            self.deadline.check()
+            if (lines - index) <= segments:
+                boundary = self.determine_segment_boundaries(start, lines)
+            else:
+                boundary = self.determine_segment_boundaries(start, index)
+            boundaries.append(boundary)
+            start = index
         return boundaries
 
     def determine_segment_boundaries(self, start, end):
@@ -82,28 +98,22 @@ class AlgorithmicRowExtractor:
             start:
                                         start of the segment
         """
-        filtered_checkerboard_boundaries = set()
         # 0.5 * dibit width
         bit_width = (len(self.softstrip_matrix.binary_matrix[start]) / self.bits_per_row)
         # rough window around the checkerboard
         # pixels in checkerboard_boundary must be within this window
         cb_start = bit_width * 2.25
         cb_end = bit_width * 4.25
-        for item in checkerboard_boundaries:
-            if item > cb_start and item < cb_end:
-                if checkerboard_boundaries.count(item) >= MIN_OCCURENCE:
-                    filtered_checkerboard_boundaries.add(item)
-        return list(filtered_checkerboard_boundaries)
+        positions, counts = np.unique(checkerboard_boundaries, return_counts=True)
+        selected = (positions > cb_start) & (positions < cb_end) & (counts >= MIN_OCCURENCE)
+        return positions[selected].tolist()
 
     def filter_rack_outliers(self, rack_boundaries):
         """
            Remove all positions which occur less than MIN_OCCURENCE
         """
-        filtered_rack_boundaries = set()
-        for item in rack_boundaries:
-            if rack_boundaries.count(item) >= MIN_OCCURENCE:
-                filtered_rack_boundaries.add(item)
-        return list(filtered_rack_boundaries)
+        positions, counts = np.unique(rack_boundaries, return_counts=True)
+        return positions[counts >= MIN_OCCURENCE].tolist()
 
     def determine_cb_and_rack_boundaries(self, start, end):
         """
@@ -116,27 +126,10 @@ class AlgorithmicRowExtractor:
             end:
                         end of the segment
         """
-        checkerboard_boundary = []
-        rack_boundary = []
-        for row_index in range(start, end):
-            row = self.softstrip_matrix.binary_matrix[row_index]
-            black_counter = 0
-            last_pixel = 0
-            # Find the left black start of the checkerboard
-            # and store the number of black pixels
-            for column_index, column in enumerate(row):
-                if column == 1 and last_pixel == 0:
-                    black_counter += 1
-                    if black_counter == 2:
-                        checkerboard_boundary.append(column_index)
-                        break
-                last_pixel = column
-            # Find the first black pixel from right-to-left
-            for column_index, column in enumerate(reversed(row)):
-                if column == 1:
-                    rack_boundary.append(len(row) - column_index - 1)
-                    break
-        return checkerboard_boundary, rack_boundary
+        checkerboard_boundary = self.checkerboard_positions[start:end]
+        rack_boundary = self.rack_positions[start:end]
+        # Lines without a checkerboard or rack are -1
+        return checkerboard_boundary[checkerboard_boundary >= 0], rack_boundary[rack_boundary >= 0]
 
     def determine_pattern_per_line(self, boundaries):
         """
@@ -146,25 +139,30 @@ class AlgorithmicRowExtractor:
             Returns a new matrix with the following row structure:
             Pattern | Index | Row
         """
+        matrix = self.softstrip_matrix.binary_matrix
+        lines = np.arange(len(matrix))
+        # Segment of each line
+        ends = [boundary['end'] for boundary in boundaries]
+        segment = np.searchsorted(ends, lines, side='right')
+        # The left square of the checkerboard is interesting, substract -1 to increase the chance of hitting it
+        checkerboards = np.round([boundary['min_left_start'] + (boundary['max_left_end'] - boundary['min_left_start']) * 0.5
+                                  for boundary in boundaries]).astype(np.int64)
+        racks = np.round([boundary['min_right_end'] + (boundary['max_right_end'] - boundary['min_right_end']) * 0.5
+                          for boundary in boundaries]).astype(np.int64)
+        checkerboard = checkerboards[segment]
+        checkerboard_pixel = matrix[lines, checkerboard] == 1
+        before_checkerboard = (matrix[lines, checkerboard - 1] == 1) & (matrix[lines, checkerboard - 2] == 1)
+        rack_pixel = matrix[lines, racks[segment]] == 1
+
+        patterns = np.select([(checkerboard_pixel | before_checkerboard) & ~rack_pixel,
+                              ~checkerboard_pixel & ~rack_pixel,
+                              ~checkerboard_pixel & rack_pixel],
+                             [BLACK_WHITE_PATTERN, WHITE_WHITE_PATTERN, WHITE_BLACK_PATTERN],
+                             BLACK_BLACK_PATTERN)
         pattern_matrix = []
-        boundary = boundaries.pop(0)
-        for index, row in enumerate(self.softstrip_matrix.binary_matrix):
-            if index >= boundary['end']:
-                boundary = boundaries.pop(0)
-            # The left square of the checkerboard is interesting, substract -1 to increase the chance of hitting it
-            checkerboard = round(boundary['min_left_start'] + (boundary['max_left_end'] - boundary['min_left_start']) * 0.5)
-            rack = round(boundary['min_right_end'] + (boundary['max_right_end'] - boundary['min_right_end']) * 0.5)
-
-            if (row[checkerboard] == 1 or (row[checkerboard - 1] == 1 and row[checkerboard - 2] == 1)) and row[rack] == 0:
-                pattern = BLACK_WHITE_PATTERN
-            elif row[checkerboard] == 0 and row[rack] == 0:
-                pattern = WHITE_WHITE_PATTERN
-            elif row[checkerboard] == 0 and row[rack] == 1:
-                pattern = WHITE_BLACK_PATTERN
-            elif row[checkerboard] == 1 and row[rack] == 1:
-                pattern = BLACK_BLACK_PATTERN
-            pattern_matrix.append({'pattern': pattern, 'index': index, 'row': row})
-
+        for index, pattern in enumerate(patterns.tolist()):
+            self.deadline.check()
+            pattern_matrix.append({'pattern': pattern, 'index': index, 'row': matrix[index]})
         return pattern_matrix
     
     def group_by_pattern(self, pattern_pixel_matrix):
@@ -179,6 +177,7 @@ class AlgorithmicRowExtractor:
         grouped_grayscale_matrix = []
         grouped_grayscale_row = []
         for index, row in enumerate(pattern_pixel_matrix):
+            self.deadline.check()
             if row['pattern'] == current_pattern:
                 grouped_binary_row.append(row)
                 grouped_grayscale_row.append(self.softstrip_matrix.grayscale_matrix[index])
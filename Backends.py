@@ -0,0 +1,85 @@
+"""
+    Registry of the row extractors and row decoders keyed by the values
+    of row_extractor/row_decoder in the config. The backends are only
+    imported when they are created, so the algorithmic pipeline runs
+    without TensorFlow/Keras.
+"""
+ALGO_ROW_EXTRACTOR = 0
+CNN_ROW_EXTRACTOR = 1
+CNN_BATCHED_ROW_EXTRACTOR = 2
+ALGO_ROW_DECODER = 0
+CNN_ROW_DECODER = 1
+
+
+def create_algorithmic_row_extractor(softstrip_matrix, bits_count, deadline):
+    from AlgorithmicRowExtractor import AlgorithmicRowExtractor
+    return AlgorithmicRowExtractor(softstrip_matrix, bits_count, deadline)
+
+
+def create_cnn_row_extractor(softstrip_matrix, bits_count, deadline):
+    from CnnRowExtractor import CnnRowExtractor
+    return CnnRowExtractor(softstrip_matrix.grayscale_matrix, softstrip_matrix.binary_matrix, bits_count, deadline)
+
+
+def create_cnn_batched_row_extractor(softstrip_matrix, bits_count, deadline):
+    from CnnRowExtractor import CnnRowExtractor
+    return CnnRowExtractor(softstrip_matrix.grayscale_matrix, softstrip_matrix.binary_matrix, bits_count, deadline,
+                           batched=True)
+
+
+def create_algorithmic_row_decoder(grouped_matrix, gray_grouped_matrix, bits_count, vertical_sync_start, deadline,
+                                   workers=1, progress=None):
+    from AlgorithmicRowDecoder import AlgorithmicRowDecoder
+    return AlgorithmicRowDecoder(grouped_matrix, bits_count, deadline, workers, progress)
+
+
+def create_cnn_row_decoder(grouped_matrix, gray_grouped_matrix, bits_count, vertical_sync_start, deadline,
+                           workers=1, progress=None):
+    from CnnRowDecoder import CnnRowDecoder
+    return CnnRowDecoder(gray_grouped_matrix, bits_count, vertical_sync_start, deadline, workers, progress)
+
+
+# Factories per config value
+ROW_EXTRACTORS = {
+    ALGO_ROW_EXTRACTOR: create_algorithmic_row_extractor,
+    CNN_ROW_EXTRACTOR: create_cnn_row_extractor,
+    CNN_BATCHED_ROW_EXTRACTOR: create_cnn_batched_row_extractor,
+}
+ROW_DECODERS = {
+    ALGO_ROW_DECODER: create_algorithmic_row_decoder,
+    CNN_ROW_DECODER: create_cnn_row_decoder,
+}
+
+
+def register_row_extractor(key, factory):
+    """
+        factory(softstrip_matrix, bits_count, deadline) returns an object
+        whose extract_grouped_rows() returns the binary and the grayscale
+        grouped matrix
+    """
+    ROW_EXTRACTORS[key] = factory
+
+
+def register_row_decoder(key, factory):
+    """
+        factory(grouped_matrix, gray_grouped_matrix, bits_count,
+        vertical_sync_start, deadline, workers=1, progress=None) returns an
+        object whose decode_rows() returns the decoded rows. workers is the
+        number of rows which may be decoded at the same time, progress is
+        an optional function which receives (decoded rows, all rows).
+    """
+    ROW_DECODERS[key] = factory
+
+
+def create_row_extractor(key, softstrip_matrix, bits_count, deadline):
+    if key not in ROW_EXTRACTORS:
+        raise ValueError('Unknown row extractor: ' + str(key))
+    return ROW_EXTRACTORS[key](softstrip_matrix, bits_count, deadline)
+
+
+def create_row_decoder(key, grouped_matrix, gray_grouped_matrix, bits_count, vertical_sync_start, deadline,
+                       workers=1, progress=None):
+    if key not in ROW_DECODERS:
+        raise ValueError('Unknown row decoder: ' + str(key))
+    return ROW_DECODERS[key](grouped_matrix, gray_grouped_matrix, bits_count, vertical_sync_start, deadline,
+                             workers=workers, progress=progress)
@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import multiprocessing
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from SoftstripDecoder import SoftstripDecoder, read_strips
+from Metrics import Metrics
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.npy')
+# Strips of the same file only differ in their trailing sequence number,
+# e.g. qwiksort1.png, qwiksort2.png
+STRIP_NAME = re.compile(r'^(.*?)[ _-]?(\d+)$')
+
+
+class BatchDecoder:
+    """
+        Decodes the strips of many files in parallel. All strips of a
+        file are one job which is decoded by a worker process.
+    """
+    def __init__(self, source, output_dir='', workers=None, metrics=None):
+        """
+            source: directory with strip images or manifest file
+            output_dir: directory for the decoded files
+            workers: number of worker processes
+            metrics: optional Metrics which receives the records of all jobs
+        """
+        self.output_dir = output_dir
+        self.workers = workers
+        self.metrics = metrics
+        if os.path.isdir(source):
+            self.jobs = self.create_jobs_from_directory(source)
+        else:
+            self.jobs = self.create_jobs_from_manifest(source)
+        self.results = []
+        self.cancel_event = None
+
+    def create_jobs_from_directory(self, directory):
+        """
+            Groups all images in the directory by their name without
+            the trailing sequence number. The strips of each group are
+            ordered by their sequence number.
+        """
+        groups = {}
+        for filename in os.listdir(directory):
+            name, extension = os.path.splitext(filename)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            match = STRIP_NAME.match(name)
+            if match:
+                name, seq_no = match.group(1), int(match.group(2))
+            else:
+                seq_no = 0
+            groups.setdefault(name, []).append((seq_no, os.path.join(directory, filename)))
+        jobs = []
+        for name in sorted(groups):
+            jobs.append([path for _, path in sorted(groups[name])])
+        return jobs
+
+    def create_jobs_from_manifest(self, manifest):
+        """
+            Each line of the manifest contains the paths of all strips
+            of one file in the correct order. Relative paths are resolved
+            against the directory of the manifest. Lines starting with #
+            are ignored.
+        """
+        base_dir = os.path.dirname(manifest)
+        jobs = []
+        with open(manifest, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0 or line.startswith('#'):
+                    continue
+                jobs.append([os.path.join(base_dir, path) for path in line.split()])
+        return jobs
+
+    def run(self):
+        """
+            Decodes all jobs and reports the throughput
+        """
+        start_time = time.time()
+        manager = multiprocessing.Manager()
+        self.cancel_event = manager.Event()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                jobs = executor.map(decode_job, self.jobs, repeat(self.output_dir), repeat(self.cancel_event),
+                                    repeat(self.metrics is not None))
+                for result in jobs:
+                    self.results.append(result)
+                    self.print_result(result)
+                    if self.metrics is not None:
+                        self.metrics.add_records(result['metrics'])
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        finally:
+            manager.shutdown()
+        self.print_throughput(time.time() - start_time)
+        return self.results
+
+    def cancel(self):
+        """
+            Aborts all running jobs at their next deadline check
+        """
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+
+    def print_result(self, result):
+        if result['error'] is not None:
+            print('[ERROR] ' + result['paths'][0] + ': ' + result['error'])
+        elif result['timeout'] is not None:
+            print('[TIMEOUT] ' + result['paths'][0] + ': stage ' + result['timeout']['stage'])
+        else:
+            state = 'valid' if result['valid'] else 'INVALID'
+            print('[' + state + '] ' + result['paths'][0] + ' -> ' + str(result['filename']) +
+                  ' (' + str(result['strips']) + ' strips, ' + str(result['bytes']) + ' bytes)')
+
+    def print_throughput(self, elapsed):
+        strips = sum(result['strips'] for result in self.results)
+        data_bytes = sum(result['bytes'] for result in self.results)
+        failed = sum(1 for result in self.results if result['error'] is not None or not result['valid'])
+        elapsed = max(elapsed, 1e-9)
+        print('Decoded ' + str(len(self.results)) + ' files (' + str(failed) + ' failed), ' +
+              str(strips) + ' strips, ' + str(data_bytes) + ' bytes in ' + '%.2f' % elapsed + 's')
+        print('Throughput: ' + '%.2f' % (strips / elapsed) + ' strips/s, ' +
+              '%.2f' % (data_bytes / elapsed) + ' bytes/s')
+
+
+def decode_job(paths, output_dir, cancel_event=None, collect_metrics=False, row_workers=1, progress=None):
+    """
+        Decodes all strips of a single file in a worker process.
+        The CNNs are loaded once per worker (see ModelRegistry).
+        The files are already decoded in parallel, so the rows of a strip
+        are decoded sequentially unless row_workers is set (None uses
+        the config). progress receives the progress events of the strips
+        (see SoftstripDecoder.report).
+    """
+    result = {'paths': paths, 'strips': len(paths), 'bytes': 0, 'filename': None, 'valid': False,
+              'timeout': None, 'error': None, 'metrics': []}
+    metrics = Metrics() if collect_metrics else None
+    try:
+        decoder = SoftstripDecoder(read_strips(paths), output_dir=output_dir, cancel_event=cancel_event,
+                                   metrics=metrics, row_workers=row_workers, progress=progress)
+        result['bytes'] = decoder.data_length
+        result['filename'] = decoder.output_filename
+        result['valid'] = decoder.valid
+        if decoder.timeout is not None:
+            result['timeout'] = {'stage': decoder.timeout.stage, 'budget': decoder.timeout.budget,
+                                 'cancelled': decoder.timeout.cancelled}
+    except Exception as e:
+        result['error'] = str(e)
+    if metrics is not None:
+        result['metrics'] = metrics.records
+    return result
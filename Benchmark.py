@@ -0,0 +1,239 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+
+from SoftstripEncoder import SoftstripEncoder
+from SoftstripDecoder import threshold_strip
+from Binarization import BINARIZATIONS, FIXED_BINARIZATION
+from SoftstripMatrix import SoftstripMatrix
+from HeaderExtractor import HeaderExtractor
+from Backends import *
+from DataExtractor import DataExtractor
+
+SOFTSTRIP_MATRIX_STAGE = 'softstrip_matrix'
+HEADER_STAGE = 'header'
+ALGO_ROW_EXTRACTOR_STAGE = 'algorithmic_row_extractor'
+CNN_ROW_EXTRACTOR_STAGE = 'cnn_row_extractor'
+CNN_BATCHED_ROW_EXTRACTOR_STAGE = 'cnn_batched_row_extractor'
+ALGO_ROW_DECODER_STAGE = 'algorithmic_row_decoder'
+CNN_ROW_DECODER_STAGE = 'cnn_row_decoder'
+ALGO_DATA_EXTRACTOR_STAGE = 'algorithmic_data_extractor'
+CNN_DATA_EXTRACTOR_STAGE = 'cnn_data_extractor'
+STAGES = [SOFTSTRIP_MATRIX_STAGE, HEADER_STAGE, ALGO_ROW_EXTRACTOR_STAGE, CNN_ROW_EXTRACTOR_STAGE,
+          CNN_BATCHED_ROW_EXTRACTOR_STAGE, ALGO_ROW_DECODER_STAGE, CNN_ROW_DECODER_STAGE, ALGO_DATA_EXTRACTOR_STAGE, CNN_DATA_EXTRACTOR_STAGE]
+# Both decoders work on the rows of the algorithmic row extractor, so they
+# are compared on the same input. The CNN row extractors are timed separately.
+PATHS = {
+    'algorithmic': (ALGO_ROW_DECODER_STAGE, ALGO_DATA_EXTRACTOR_STAGE),
+    'cnn': (CNN_ROW_DECODER_STAGE, CNN_DATA_EXTRACTOR_STAGE),
+}
+DEFAULT_CASE = {'payload_size': 512, 'nibbles': 8, 'dpi': 600, 'noise': 0.0, 'skew': 0.0, 'blur': 0.0, 'seed': 0,
+                'binarization': FIXED_BINARIZATION}
+
+
+class Benchmark:
+    """
+        Times every stage of the decoding pipeline on synthetic
+        Softstrips and records the results as JSON
+    """
+    def __init__(self, cases, repeat=3):
+        """
+            cases: list of dicts with the encoder settings
+                   (see DEFAULT_CASE), missing keys use the defaults
+            repeat: number of runs per case
+        """
+        self.cases = [dict(DEFAULT_CASE, **case) for case in cases]
+        self.repeat = repeat
+        self.results = None
+
+    def run(self):
+        self.results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': get_revision(),
+            'python': platform.python_version(),
+            'repeat': self.repeat,
+            'cases': [self.run_case(case) for case in self.cases],
+        }
+        return self.results
+
+    def run_case(self, case):
+        """
+            Encodes the payload of the case and decodes the strips
+            repeat times. The time of a stage is the sum over all strips.
+        """
+        payload = np.random.RandomState(case['seed']).randint(0, 256, case['payload_size']).astype(np.uint8).tobytes()
+        encoder = SoftstripEncoder(case['nibbles'], case['dpi'], case['noise'], case['skew'], case['blur'], case['seed'])
+        strips = [threshold_strip(img, case['binarization']) for img in encoder.encode(payload, 'BENCH.BIN')]
+
+        self.times = {stage: [] for stage in STAGES}
+        self.errors = {}
+        self.executed = set()
+        decoded = {}
+        for _ in range(self.repeat):
+            for stage in STAGES:
+                self.times[stage].append(0.0)
+            decoded = self.decode_strips(strips)
+
+        result = {'case': case, 'strips': len(strips), 'stages': {}, 'decoded': {}}
+        for stage in STAGES:
+            if stage in self.errors:
+                result['stages'][stage] = {'error': self.errors[stage]}
+            elif stage not in self.executed:
+                result['stages'][stage] = {'error': 'skipped, a previous stage failed'}
+            else:
+                result['stages'][stage] = summarize(self.times[stage])
+        for path, data in decoded.items():
+            result['decoded'][path] = data == payload
+        return result
+
+    def decode_strips(self, strips):
+        """
+            Runs all stages on all strips and returns the decoded data of
+            each path (None if a stage of the path failed)
+        """
+        decoded = {path: b'' for path in PATHS}
+        for i, (binary_img, gray_img) in enumerate(strips):
+            softstrip_matrix = self.measure(SOFTSTRIP_MATRIX_STAGE, SoftstripMatrix, binary_img, gray_img)
+            if softstrip_matrix is None:
+                return {path: None for path in PATHS}
+            header_extractor = HeaderExtractor(softstrip_matrix)
+            self.measure(HEADER_STAGE, header_extractor.parse_header)
+            if HEADER_STAGE in self.errors:
+                return {path: None for path in PATHS}
+            bits_count = header_extractor.get_bits_per_row()
+            vertical_sync_start = header_extractor.vertical_sync_start
+
+            # A missing CNN backend (e.g. no Keras installed) is
+            # recorded as error of its stages
+            self.measure(CNN_ROW_EXTRACTOR_STAGE, lambda: create_row_extractor(
+                CNN_ROW_EXTRACTOR, softstrip_matrix, bits_count, None).extract_grouped_rows())
+            self.measure(CNN_BATCHED_ROW_EXTRACTOR_STAGE, lambda: create_row_extractor(
+                CNN_BATCHED_ROW_EXTRACTOR, softstrip_matrix, bits_count, None).extract_grouped_rows())
+            rows = self.measure(ALGO_ROW_EXTRACTOR_STAGE, lambda: create_row_extractor(
+                ALGO_ROW_EXTRACTOR, softstrip_matrix, bits_count, None).extract_grouped_rows())
+            if rows is None:
+                return {path: None for path in PATHS}
+            grouped_matrix, gray_grouped_matrix = rows
+
+            decoders = {
+                'algorithmic': lambda: create_row_decoder(ALGO_ROW_DECODER, grouped_matrix, gray_grouped_matrix,
+                                                          bits_count, vertical_sync_start, None).decode_rows(),
+                'cnn': lambda: create_row_decoder(CNN_ROW_DECODER, grouped_matrix, gray_grouped_matrix,
+                                                  bits_count, vertical_sync_start, None).decode_rows(),
+            }
+            for path, (decoder_stage, data_stage) in PATHS.items():
+                if decoded[path] is None:
+                    continue
+                decoded_rows = self.measure(decoder_stage, decoders[path])
+                if decoded_rows is None or len(decoded_rows) == 0:
+                    decoded[path] = None
+                    continue
+                data_extractor = DataExtractor()
+                self.measure(data_stage, data_extractor.extract_data, decoded_rows, i == 0)
+                if data_stage in self.errors or not data_extractor.valid:
+                    decoded[path] = None
+                else:
+                    decoded[path] += bytes(data_extractor.data)
+        return decoded
+
+    def measure(self, stage, function, *args):
+        """
+            Runs and times a stage. The first failure of a stage is
+            recorded and the stage is skipped afterwards (returns None).
+        """
+        if stage in self.errors:
+            return None
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+        except Exception as e:
+            self.errors[stage] = type(e).__name__ + ': ' + str(e)
+            return None
+        self.times[stage][-1] += time.perf_counter() - start
+        self.executed.add(stage)
+        return result
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.results, f, indent=2)
+
+    def print_results(self, baseline=None):
+        """
+            Prints the median per stage. If a baseline (results of a
+            previous run) is given, the relative change is printed as well.
+        """
+        for i, result in enumerate(self.results['cases']):
+            case = result['case']
+            print('Case ' + str(i + 1) + ': ' + str(case['payload_size']) + ' bytes, ' + str(result['strips']) +
+                  ' strips, ' + str(case['dpi']) + ' dpi, noise ' + str(case['noise']) + ', skew ' +
+                  str(case['skew']) + ', blur ' + str(case['blur']) + ', ' + case['binarization'] + ' binarization ' +
+                  str(result['decoded']))
+            for stage, timing in result['stages'].items():
+                if 'error' in timing:
+                    print('  ' + stage.ljust(28) + timing['error'])
+                    continue
+                line = '  ' + stage.ljust(28) + '%.4fs' % timing['median']
+                previous = find_baseline_timing(baseline, case, stage)
+                if previous is not None and previous > 0:
+                    line += ' (%+.1f%%)' % ((timing['median'] / previous - 1) * 100)
+                print(line)
+
+
+def summarize(times):
+    return {'min': min(times), 'median': float(np.median(times)), 'mean': float(np.mean(times)), 'runs': times}
+
+
+def find_baseline_timing(baseline, case, stage):
+    if baseline is None:
+        return None
+    for result in baseline['cases']:
+        # Cases of older results lack the newer options
+        if dict(DEFAULT_CASE, **result['case']) == case and 'median' in result['stages'].get(stage, {}):
+            return result['stages'][stage]['median']
+    return None
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Softstrip Decoder Benchmark')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON results of a previous run for comparison')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[DEFAULT_CASE['payload_size']],
+                        help='payload sizes in bytes')
+    parser.add_argument('--nibbles', type=int, default=DEFAULT_CASE['nibbles'])
+    parser.add_argument('--dpi', type=int, nargs='+', default=[DEFAULT_CASE['dpi']])
+    parser.add_argument('--noise', type=float, nargs='+', default=[DEFAULT_CASE['noise']])
+    parser.add_argument('--skew', type=float, default=DEFAULT_CASE['skew'])
+    parser.add_argument('--blur', type=float, default=DEFAULT_CASE['blur'])
+    parser.add_argument('--seed', type=int, default=DEFAULT_CASE['seed'])
+    parser.add_argument('--binarization', nargs='+', choices=sorted(BINARIZATIONS),
+                        default=[DEFAULT_CASE['binarization']])
+    args = parser.parse_args()
+
+    cases = []
+    for size in args.sizes:
+        for dpi in args.dpi:
+            for noise in args.noise:
+                for binarization in args.binarization:
+                    cases.append({'payload_size': size, 'nibbles': args.nibbles, 'dpi': dpi, 'noise': noise,
+                                  'skew': args.skew, 'blur': args.blur, 'seed': args.seed,
+                                  'binarization': binarization})
+    benchmark = Benchmark(cases, args.repeat)
+    benchmark.run()
+    benchmark.save(args.output)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    benchmark.print_results(baseline)
+    print('Results saved as ' + args.output)
@@ -0,0 +1,118 @@
+"""
+    Binarization of the grayscale Softstrip images. The methods are
+    selected by the binarization option in the config.
+"""
+import cv2
+import numpy as np
+
+FIXED_BINARIZATION = 'fixed'
+OTSU_BINARIZATION = 'otsu'
+SEGMENTED_BINARIZATION = 'segmented'
+SAUVOLA_BINARIZATION = 'sauvola'
+HEADER_BINARIZATION = 'header'
+
+FIXED_THRESHOLD = 127
+# Sauvola: T = mean * (1 + k * (std / R - 1))
+SAUVOLA_K = 0.2
+SAUVOLA_R = 128
+# The window of the local thresholds covers WINDOW_FRACTION of the strip width
+WINDOW_FRACTION = 0.4
+MIN_WINDOW_SIZE = 15
+# Height of the segments with their own Otsu threshold relative to the strip width
+SEGMENT_FRACTION = 0.5
+MIN_SEGMENT_HEIGHT = 16
+# Height of the horizontal sync header relative to the strip width
+HEADER_FRACTION = 0.1
+
+
+def threshold(gray_img, value):
+    """
+        Pixels brighter than value are white (255), all others black (0)
+    """
+    _, binary_img = cv2.threshold(gray_img, value, 255, cv2.THRESH_BINARY)
+    return binary_img
+
+
+def binarize_fixed(gray_img):
+    return threshold(gray_img, FIXED_THRESHOLD)
+
+
+def binarize_otsu(gray_img):
+    """
+        Global threshold which separates the bars from the
+        background (Otsu's method)
+    """
+    _, binary_img = cv2.threshold(gray_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary_img
+
+
+def binarize_segmented(gray_img):
+    """
+        Otsu threshold per horizontal segment of the strip. Follows
+        lighting and contrast changes along the strip.
+    """
+    gray_img = np.asarray(gray_img)
+    segment_height = max(MIN_SEGMENT_HEIGHT, int(gray_img.shape[1] * SEGMENT_FRACTION))
+    binary_img = np.empty(gray_img.shape, dtype=np.uint8)
+    for start in range(0, len(gray_img), segment_height):
+        segment = np.ascontiguousarray(gray_img[start:start + segment_height])
+        _, binary_img[start:start + segment_height] = cv2.threshold(segment, 0, 255,
+                                                                    cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary_img
+
+
+def binarize_sauvola(gray_img):
+    """
+        Local threshold per pixel from the mean and the standard deviation
+        of its neighbourhood (Sauvola's method). Handles uneven lighting
+        and faded areas, but is sensitive to noise in flat areas.
+    """
+    gray_img = np.asarray(gray_img)
+    window_size = max(MIN_WINDOW_SIZE, int(gray_img.shape[1] * WINDOW_FRACTION) | 1)
+    window = (window_size, window_size)
+    gray = gray_img.astype(np.float32)
+    mean = cv2.boxFilter(gray, -1, window, borderType=cv2.BORDER_REFLECT)
+    squared_mean = cv2.boxFilter(gray * gray, -1, window, borderType=cv2.BORDER_REFLECT)
+    std = np.sqrt(np.maximum(squared_mean - mean * mean, 0))
+    thresholds = mean * (1 + SAUVOLA_K * (std / SAUVOLA_R - 1))
+    return np.where(gray > thresholds, 255, 0).astype(np.uint8)
+
+
+def binarize_header(gray_img):
+    """
+        Global threshold fitted to the horizontal sync header. The header
+        consists of equally sized black and white bars, so Otsu's method
+        on the header separates the bars and the background of the strip.
+    """
+    gray_img = np.asarray(gray_img)
+    value, _ = cv2.threshold(gray_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    dark_lines = np.flatnonzero((gray_img <= value).any(axis=1))
+    if len(dark_lines) == 0:
+        return threshold(gray_img, value)
+    start = dark_lines[0]
+    end = start + max(1, int(gray_img.shape[1] * HEADER_FRACTION))
+    header = np.ascontiguousarray(gray_img[start:end])
+    value, _ = cv2.threshold(header, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return threshold(gray_img, value)
+
+
+BINARIZATIONS = {
+    FIXED_BINARIZATION: binarize_fixed,
+    OTSU_BINARIZATION: binarize_otsu,
+    SEGMENTED_BINARIZATION: binarize_segmented,
+    SAUVOLA_BINARIZATION: binarize_sauvola,
+    HEADER_BINARIZATION: binarize_header,
+}
+
+
+def register_binarization(name, function):
+    """
+        function(gray_img) returns the single-channel binary image (0/255)
+    """
+    BINARIZATIONS[name] = function
+
+
+def binarize(gray_img, method=FIXED_BINARIZATION):
+    if method not in BINARIZATIONS:
+        raise ValueError('Unknown binarization: ' + str(method))
+    return BINARIZATIONS[method](gray_img)
@@ -0,0 +1,127 @@
+def create_dibit_table():
+    """
+        Maps 8 units (4 dibits) to their 4 bits. The first dibit is the
+        most significant one and becomes the least significant bit.
+        01 = 1, 10 = 0 (invalid dibits are read as 0)
+    """
+    table = []
+    for value in range(256):
+        bits = 0
+        for i in range(4):
+            if (value >> (6 - 2 * i)) & 0b11 == 0b01:
+                bits |= 1 << i
+        table.append(bits)
+    return table
+
+
+DIBIT_TABLE = create_dibit_table()
+# Bits with an even/odd index in a bit field (up to 1024 bits)
+EVEN_BITS_MASK = int('01' * 512, 2)
+ODD_BITS_MASK = EVEN_BITS_MASK << 1
+
+
+def popcount(value):
+    return bin(value).count('1')
+
+
+class BitRow:
+    """
+        Compact representation of a decoded row. All units (1 = black,
+        0 = white) are stored in an int bit field, the first unit
+        is the most significant bit.
+    """
+    __slots__ = ('value', 'length')
+
+    def __init__(self, value=0, length=0):
+        self.value = value
+        self.length = length
+
+    @classmethod
+    def from_string(cls, row):
+        """
+            Creates a row from a string, e.g. '1101001...'
+        """
+        if len(row) == 0:
+            return cls()
+        return cls(int(row, 2), len(row))
+
+    def __len__(self):
+        return self.length
+
+    def __eq__(self, other):
+        return isinstance(other, BitRow) and self.value == other.value and self.length == other.length
+
+    def __hash__(self):
+        return hash((self.value, self.length))
+
+    def __str__(self):
+        if self.length == 0:
+            return ''
+        return format(self.value, '0' + str(self.length) + 'b')
+
+    def __repr__(self):
+        return 'BitRow(' + str(self) + ')'
+
+    def strip(self):
+        return self
+
+    def units(self, start, end):
+        """
+            Returns the units start..end (like row[start:end]) as int
+        """
+        start, end, _ = slice(start, end).indices(self.length)
+        if end <= start:
+            return 0
+        return (self.value >> (self.length - end)) & ((1 << (end - start)) - 1)
+
+    def dibit(self, start):
+        """
+            Returns the dibit beginning at unit start as bit
+            (01 = 1, everything else = 0)
+        """
+        return 1 if self.units(start, start + 2) == 0b01 else 0
+
+    def flip_dibit(self, start):
+        """
+            Returns a new row in which the dibit beginning at unit start
+            is flipped: 0x becomes 10, 1x becomes 01
+        """
+        shift = self.length - start - 2
+        if (self.value >> (shift + 1)) & 1:
+            new_dibit = 0b01
+        else:
+            new_dibit = 0b10
+        value = (self.value & ~(0b11 << shift)) | (new_dibit << shift)
+        return BitRow(value, self.length)
+
+    def data_bits(self, start=7, end=-7):
+        """
+            Converts the dibits between start and end to bits.
+            Returns an int bit field (the first dibit is the least
+            significant bit) and the number of bits.
+        """
+        start, end, _ = slice(start, end).indices(self.length)
+        units_count = max(end - start, 0)
+        units = self.units(start, end)
+        # Align to whole bytes, the padding are invalid dibits (= 0)
+        padding = -units_count % 8
+        units <<= padding
+        byte_count = (units_count + padding) // 8
+        bits = 0
+        for i, byte in enumerate(units.to_bytes(byte_count, 'big')):
+            bits |= DIBIT_TABLE[byte] << (4 * i)
+        return bits, units_count // 2
+
+    def parity_check(self):
+        """
+            The left parity dibit covers all odd data bits and
+            the right parity dibit all even data bits
+        """
+        if self.length < 14:
+            return False
+        bits, _ = self.data_bits()
+        computed_left_parity = popcount(bits & ODD_BITS_MASK) % 2
+        computed_right_parity = popcount(bits & EVEN_BITS_MASK) % 2
+        left_parity = self.dibit(5)
+        right_parity = self.dibit(self.length - 7)
+        return computed_left_parity == left_parity and computed_right_parity == right_parity
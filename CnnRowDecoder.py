@@ -1,14 +1,27 @@
-import datetime
+import copy
+import math
 import numpy as np
 import scipy.misc
-import itertools
+from collections import deque
 from Utils import *
+from Deadline import Deadline
+from BitRow import BitRow
+from RowScheduler import RowScheduler, THREAD_SCHEDULER
 
 MODEL_FILENAME = 'nn/models/decoding_simple.json'
 WEIGHT_FILENAME = 'nn/models/decoding_simple.hdf5'
 LABELS_FILENAME = 'nn/models/decoding_simple.dat'
 SHIFT_OFFSETS = [0, 1, -1,  2, -2]
 MIN_CONFIDENCE = 0.9
+# Beam search over the flips of uncertain dibits: at most MAX_FLIPPED_DIBITS
+# dibits are flipped, BEAM_WIDTH combinations are expanded per step
+MAX_FLIPPED_DIBITS = 3
+BEAM_WIDTH = 16
+# Lower bound of the probabilities in the log-likelihood of a row
+MIN_PROBABILITY = 1e-6
+# Start bar, space and checkerboard / space and rack
+ROW_START = BitRow.from_string('11010')
+ROW_END = BitRow.from_string('00110')
 
 
 class CnnRowDecoder:
@@ -16,13 +29,26 @@ class CnnRowDecoder:
         Implementation of a row decoding method with a CNN.
         The dibits in each row are classified with a CNN.
     """
-    def __init__(self, grayscale_grouped_matrix, start_time, bits_count, timeout, vertical_sync_start):
+    def __init__(self, grayscale_grouped_matrix, bits_count, vertical_sync_start, deadline=None, workers=1,
+                 progress=None):
+        """
+            workers: number of threads which decode the rows,
+                     0 uses one per CPU (see RowScheduler)
+            progress: optional function which receives the number of
+                      decoded rows and the number of all rows
+        """
         self.grayscale_grouped_matrix = grayscale_grouped_matrix
-        self.start_time = start_time
         self.bits_count = bits_count
         self.vertical_sync_start = vertical_sync_start
         self.model, self.labels = load_cnn(MODEL_FILENAME, WEIGHT_FILENAME, LABELS_FILENAME)
-        self.timeout = timeout
+        self.deadline = deadline if deadline is not None else Deadline()
+        # Number of classified batches and checked BFS sub-rows
+        self.cnn_calls = 0
+        self.bfs_nodes = 0
+        # The shared model can't be used by other processes, the rows
+        # are decoded by threads while TensorFlow releases the GIL
+        self.scheduler = RowScheduler(workers, THREAD_SCHEDULER)
+        self.progress = progress
 
     def decode_rows(self):
         """
@@ -35,135 +61,222 @@ class CnnRowDecoder:
             Decodes the dibits in all rows of the grayscale_grouped_matrix
         """
         reduced_matrix = []
-        for index, row in enumerate(matrix):
-            # Used for Timeout after X minutes
-            now = datetime.datetime.now().replace(microsecond=0)
-            difference = now - self.start_time
-            if (difference.seconds // 60) > self.timeout:
-                return []
-
-            # Ignore empty rows
-            if len(row) > 0:
-                valid_rows = set()
-                # Row shifting
-                for offset in SHIFT_OFFSETS:
-                    new_rows, first_try = self.apply_decoding_strategies(row, offset, valid_rows)
-                    valid_rows |= new_rows
-                    # Stop if row was succesffuly decoded on first try
-                    if first_try:
-                        break
-
-                valid_rows = list(valid_rows) 
+        self.deadline.check()
+        # Ignore empty rows
+        indices = [index for index, row in enumerate(matrix) if len(row) > 0]
+        results = self.scheduler.map(self.decode_row, [matrix[index] for index in indices], self.deadline.check)
+        try:
+            for done, (index, (valid_rows, cnn_calls, bfs_nodes)) in enumerate(zip(indices, results)):
+                self.deadline.check()
+                self.cnn_calls += cnn_calls
+                self.bfs_nodes += bfs_nodes
+                if self.progress is not None:
+                    self.progress(done + 1, len(indices))
+                valid_rows = list(valid_rows)
                 if len(valid_rows) == 0 and index > self.vertical_sync_start: # Row could not be decoded
                     print("INDEX:" + str(index))
                     print("NO VALID ROW FOUND")
                     return []
                 elif index > 1:
                     reduced_matrix.append(valid_rows)
+        finally:
+            # Cancels the remaining rows after an early abort
+            results.close()
         return reduced_matrix
 
-    def apply_decoding_strategies(self, row, offset, valid_rows):
+    def decode_row(self, row):
+        """
+            Decodes a single row with a copy of the decoder, so rows which
+            are decoded at the same time don't share the counters.
+            Returns the valid rows, the number of classified batches
+            and the number of checked BFS sub-rows
+        """
+        self.deadline.check()
+        decoder = copy.copy(self)
+        decoder.cnn_calls = 0
+        decoder.bfs_nodes = 0
+        return decoder.apply_decoding_strategies(row), decoder.cnn_calls, decoder.bfs_nodes
+
+    def apply_decoding_strategies(self, row):
         """
-            Decodes the dibits in a row. If if failed:
+            Decodes the dibits in a row with all shift offsets. The row is
+            classified for every offset with a single batch and the first
+            offset which yields a valid row stops the row shifting.
+            For all offsets before that:
             - Change dibits with low confidence
             - Split rows with BFS
+            The BFS sub-rows of these offsets are classified in a second batch.
+            Returns the valid rows ordered by their likelihood, the most
+            likely row first.
         """
-        decoded_row, confidences = self.predict_dibits(row, offset)
-        if not parity_check(decoded_row):
-            valid_rows |= self.change_uncertain_dibits(decoded_row, confidences)
-            valid_rows |= self.bfs_find(row, valid_rows, offset)
-            return valid_rows, False
-        else:
-            valid_rows.add(decoded_row)
-            return valid_rows, True
+        np_row = np.array(row)
+        full_row = (0, len(np_row))
+        predictions = self.predict_dibits(np_row, [full_row], SHIFT_OFFSETS)
+        valid_rows = {}
+        failed_offsets = []
+        for offset in SHIFT_OFFSETS:
+            decoded_row, confidences = predictions[(full_row, offset)]
+            # Stop if row was succesffuly decoded on first try
+            if parity_check(decoded_row):
+                self.add_candidate(valid_rows, decoded_row, self.score_row(confidences))
+                break
+            failed_offsets.append(offset)
+
+        if len(failed_offsets) > 0:
+            self.deadline.check()
+            sub_rows = self.determine_bfs_sub_rows(len(np_row))
+            predictions.update(self.predict_dibits(np_row, sub_rows[1:], failed_offsets))
+            for offset in failed_offsets:
+                decoded_row, confidences = predictions[(full_row, offset)]
+                self.merge_candidates(valid_rows, self.change_uncertain_dibits(decoded_row, confidences))
+                self.merge_candidates(valid_rows, self.bfs_find(sub_rows, predictions, offset))
+        return sorted(valid_rows, key=lambda valid_row: -valid_rows[valid_row])
+
+    def score_row(self, confidences, flipped=()):
+        """
+            Log-likelihood of a decoded row: the sum of the log confidences
+            of its dibits, a flipped dibit has the probability 1 - confidence
+        """
+        score = 0.0
+        for index, confidence in enumerate(confidences):
+            if index in flipped:
+                confidence = 1.0 - confidence
+            score += math.log(max(confidence, MIN_PROBABILITY))
+        return score
+
+    def add_candidate(self, candidates, row, score):
+        """
+            Keeps the best score of every candidate row
+        """
+        if row not in candidates or candidates[row] < score:
+            candidates[row] = score
+
+    def merge_candidates(self, candidates, new_candidates):
+        for row, score in new_candidates.items():
+            self.add_candidate(candidates, row, score)
 
     def change_uncertain_dibits(self, row, confidences):
         """
             Changes the dibit values in a row which have a low
             confidence value and checks whether they are valid
             or not.
-            Returns all valid rows which were found.
-        """
-        valid_rows = set()
-        combinations, uncertain = self.determine_dibit_flip_combinations(confidences)
-        for combination in combinations:
-            split_row = list(row)
-            for pos, value in zip(uncertain, combination):
-                if value == 1:
-                    if split_row[pos * 2 + 5] == '0':
-                        split_row[pos * 2 + 5] = '1'
-                        split_row[pos * 2 + 6] = '0'
-                    else:
-                        split_row[pos * 2 + 5] = '0'
-                        split_row[pos * 2 + 6] = '1'
-            joined_row = ''.join(split_row)
-            if parity_check(joined_row):
-                valid_rows.add(joined_row)
+            Returns all valid rows which were found with their scores
+            (see score_row).
+        """
+        valid_rows = {}
+        for flipped, score in self.search_dibit_flips(confidences):
+            flipped_row = row
+            for pos in flipped:
+                flipped_row = flipped_row.flip_dibit(pos * 2 + 5)
+            if parity_check(flipped_row):
+                self.add_candidate(valid_rows, flipped_row, score)
         return valid_rows
 
-    def determine_dibit_flip_combinations(self, confidences):
+    def search_dibit_flips(self, confidences):
         """
-            Determines dibits with a low confidence value (< MIN_CONFIDENCE)
-            and returns all flipping combinations. 
-            The combinations are sorted so that first only a single dibit is
-            changed and later more dibits.
+            Beam search over the combinations of dibits with a low
+            confidence value (< MIN_CONFIDENCE). Every step flips one more
+            dibit, all combinations of a step are yielded with their score
+            (see score_row) and only the BEAM_WIDTH most likely ones are
+            expanded. A single dibit is always tried.
         """
-        uncertain = []
-        combinations = []
-        for index, value in enumerate(confidences):
-            if value < MIN_CONFIDENCE:
-                uncertain.append(index)
-        for i in range(len(uncertain)):
-            combination = [0] * len(uncertain)
-            combination[i] = 1
-            combinations.append(combination)
-        return combinations, uncertain
+        uncertain = [index for index, value in enumerate(confidences) if value < MIN_CONFIDENCE]
+        base_score = self.score_row(confidences)
+        # Change of the score if a dibit is flipped
+        costs = {index: self.score_row([confidences[index]], (0,)) - self.score_row([confidences[index]])
+                 for index in uncertain}
+        beam = [((), base_score)]
+        for _ in range(min(MAX_FLIPPED_DIBITS, len(uncertain))):
+            expanded = []
+            for flipped, score in beam:
+                for index in uncertain:
+                    if len(flipped) == 0 or index > flipped[-1]:
+                        expanded.append((flipped + (index,), score + costs[index]))
+            expanded.sort(key=lambda item: -item[1])
+            for item in expanded:
+                yield item
+            beam = expanded[:BEAM_WIDTH]
 
-    def bfs_find(self, row, valid_rows, offset=0):
+    def determine_bfs_sub_rows(self, height):
         """
-            Rows are split with a BFS search. If the decoding of a split
-            row fails, the dibits with a low confidence value will be changed.
-            Returns all valid rows which were found
+            Rows are split with a BFS search. Returns the (start, end) pixel
+            line ranges of all sub-rows in the order they are visited.
+            The first range is the whole row.
         """
-        explored = []
-        queue = [row]
+        explored = set()
+        sub_rows = []
+        queue = deque([(0, height)])
         while queue:
-            node = queue.pop(0)
+            node = queue.popleft()
             if node not in explored:
-                explored.append(node)
-                if len(node) > 0:
-                    reduced, confidences = self.predict_dibits(node, offset)
-                    if parity_check(reduced):
-                        valid_rows.add(reduced)
-                    else:
-                        confidence_rows = self.change_uncertain_dibits(reduced, confidences)
-                        if len(confidence_rows) > 0:
-                            valid_rows |= confidence_rows
-                    top = node[0:round(len(node)/2)]
-                    bottom = node[round(len(node)/2):]
-                    queue.append(top)
-                    queue.append(bottom)
+                explored.add(node)
+                start, end = node
+                if end - start > 0:
+                    sub_rows.append(node)
+                    split = start + round((end - start) / 2)
+                    queue.append((start, split))
+                    queue.append((split, end))
+        return sub_rows
+
+    def bfs_find(self, sub_rows, predictions, offset=0):
+        """
+            Checks the classified BFS sub-rows. If the decoding of a split
+            row fails, the dibits with a low confidence value will be changed.
+            Returns all valid rows which were found with their scores
+        """
+        valid_rows = {}
+        self.bfs_nodes += len(sub_rows)
+        for sub_row in sub_rows:
+            reduced, confidences = predictions[(sub_row, offset)]
+            if parity_check(reduced):
+                self.add_candidate(valid_rows, reduced, self.score_row(confidences))
+            else:
+                self.merge_candidates(valid_rows, self.change_uncertain_dibits(reduced, confidences))
         return valid_rows
 
-    def predict_dibits(self, row, offset=0):
+    def predict_dibits(self, row, sub_rows, offsets):
         """
-            Classifies each dibit in a row
+            Classifies each dibit of all sub-rows with all offsets in a
+            single batch.
+            Returns a dict (sub-row, offset) -> (decoded row, confidences)
         """
-        new_row = ''
-        np_row = np.array(row)
-        confidences = []
+        dibits_per_row = int((self.bits_count - 10) / 2)
+        keys = []
+        dibits = []
+        for start, end in sub_rows:
+            for offset in offsets:
+                keys.append(((start, end), offset))
+                for i in range(dibits_per_row):
+                    dibits.append(self.cut_dibit(row[start:end], i, offset))
+        if len(keys) == 0:
+            return {}
 
-        for i in range(int((self.bits_count - 10) / 2)):
-            prediction = self.predict_dibit(np_row, i, offset)
-            label = self.labels.inverse_transform(prediction)[0]
-            confidences.append(self.parse_confidence(prediction))
-            new_row += str(label)
+        batch = np.expand_dims(np.array(dibits), axis=3)
+        batch = batch / 255.0
+        predictions = self.model.predict(batch)
+        self.cnn_calls += 1
+        labels = self.labels.inverse_transform(predictions)
 
-        return '11010' + new_row + '00110', confidences
+        decoded_rows = {}
+        for key_index, key in enumerate(keys):
+            first = key_index * dibits_per_row
+            last = first + dibits_per_row
+            value = ROW_START.value
+            length = ROW_START.length
+            for label in labels[first:last]:
+                label = str(label)
+                value = (value << len(label)) | int(label, 2)
+                length += len(label)
+            value = (value << ROW_END.length) | ROW_END.value
+            length += ROW_END.length
+            confidences = [self.parse_confidence(prediction) for prediction in predictions[first:last]]
+            decoded_rows[key] = (BitRow(value, length), confidences)
+        return decoded_rows
 
-    def predict_dibit(self, row, index, offset):
+    def cut_dibit(self, row, index, offset):
         """
-            Classifies a single dibit
+            Cuts a single dibit out of the row and resizes it to
+            the input size of the CNN
         """
         img_height, img_width = row.shape
         block_width = img_width / self.bits_count
@@ -171,14 +284,10 @@ class CnnRowDecoder:
         start = int(round(skipped + index * block_width * 2 + offset))
         end = int(round(start + block_width * 2 + offset))
         dibit = row[0:img_height, start:end]
-        dibit = scipy.misc.imresize(dibit, [20, 20])
-        dibit = np.expand_dims(dibit, axis=2)
-        dibit = np.expand_dims(dibit, axis=0)
-        dibit = dibit / 255.0
-        return self.model.predict(dibit)
+        return scipy.misc.imresize(dibit, [20, 20])
 
     def parse_confidence(self, prediction):
-        value = prediction[0][0]
+        value = prediction[0]
         if value <= 0.5:
             confidence = 1.0 - value
         else:
@@ -2,6 +2,7 @@ import numpy as np
 import scipy.misc
 
 from Utils import load_cnn
+from Deadline import Deadline
 
 MODEL_FILENAME = "nn/models/row_extractor.json"
 WEIGHT_FILENAME = "nn/models/row_extractor.hdf5"
@@ -9,6 +10,15 @@ LABELS_FILENAME = "nn/models/row_extractor.dat"
 
 ROW_HEIGHT = 10
 ROW_WINDOW = [20, 10]
+# Number of windows per CNN prediction in the batched mode
+BATCH_SIZE = 256
+# Lower bound of the split point probabilities, so the log-probabilities
+# of the rows stay finite
+MIN_PROBABILITY = 1e-12
+# The mean log-probability per row is maximized with Dinkelbach's method,
+# which converges after a few dynamic programs
+MAX_NORMALIZATION_ITERATIONS = 20
+NORMALIZATION_TOLERANCE = 1e-9
 
 
 class CnnRowExtractor:
@@ -16,11 +26,17 @@ class CnnRowExtractor:
         Extracts the rows from a Cauzin Softstrip with the help of
         a CNN. A window is slid along the Softstrip and the CNN
         decides the point to split this window into two rows.
+        In the batched mode, the window at every line is classified
+        in batches and the rows are chosen afterwards.
     """
-    def __init__(self, grayscale_matrix, binary_matrix, bits_per_row):
+    def __init__(self, grayscale_matrix, binary_matrix, bits_per_row, deadline=None, batched=False):
         self.grayscale_matrix = grayscale_matrix
         self.binary_matrix = binary_matrix
         self.bits_per_row = bits_per_row
+        self.deadline = deadline if deadline is not None else Deadline()
+        self.batched = batched
+        # Number of CNN predictions
+        self.cnn_calls = 0
         self.model, self.labels = load_cnn(MODEL_FILENAME, WEIGHT_FILENAME, LABELS_FILENAME)
 
     def extract_rows(self):
@@ -28,12 +44,15 @@ class CnnRowExtractor:
             Extracts the rows from a Cauzin Softstrip and returns
             a matrix with grayscale rows and a matrix with binary rows
         """
+        if self.batched:
+            return self.extract_rows_batched()
         binary_rows = []
         grayscale_rows = []
         last_end = 0
         unit_width = len(self.grayscale_matrix[0]) / self.bits_per_row
         start = 0
         while start < len(self.grayscale_matrix):
+            self.deadline.check()
             grayscale_pixel_lines, binary_pixel_lines = self.extract_rows_with_window(start)
             img = self.apply_row_window(grayscale_pixel_lines, unit_width)
             if img.any():
@@ -50,6 +69,136 @@ class CnnRowExtractor:
 
         return grayscale_rows, binary_rows
 
+    def extract_grouped_rows(self):
+        """
+            Returns the binary and the grayscale rows
+            (same order as AlgorithmicRowExtractor)
+        """
+        grayscale_rows, binary_rows = self.extract_rows()
+        return binary_rows, grayscale_rows
+
+    def extract_rows_batched(self):
+        """
+            Predicts the split point of the window at every line and
+            chooses the rows with the most probable segmentation
+        """
+        lines = len(self.grayscale_matrix)
+        unit_width = len(self.grayscale_matrix[0]) / self.bits_per_row
+        window_height = round(ROW_HEIGHT * 2)
+        cb_start = int(round(unit_width * 3))
+        cb_end = int(round(unit_width * 5))
+        band = np.ascontiguousarray(np.asarray(self.grayscale_matrix)[:, cb_start:cb_end])
+        # Window of line i: lines i..end, end = min(i + window_height, lines - 1).
+        # Like the sliding window, a row which starts at an empty (or black)
+        # window ends the strip. The window of the last line is always empty.
+        ends = np.minimum(np.arange(lines) + window_height, lines - 1)
+        nonzero = np.concatenate(([0], np.cumsum(band.any(axis=1))))
+        has_content = nonzero[ends] - nonzero[:lines] > 0
+        log_probabilities = self.predict_split_point_probabilities(band, has_content, window_height)
+        split_points = self.determine_split_points(log_probabilities, has_content)
+
+        binary_rows = []
+        grayscale_rows = []
+        start = 0
+        while start < lines and has_content[start] and split_points[start] > 0:
+            grayscale_pixel_lines, binary_pixel_lines = self.extract_rows_with_window(start)
+            split_point = split_points[start]
+            grayscale_rows.append(grayscale_pixel_lines[0:split_point])
+            binary_rows.append(binary_pixel_lines[0:split_point])
+            start += split_point
+        return grayscale_rows, binary_rows
+
+    def predict_split_point_probabilities(self, band, has_content, window_height):
+        """
+            Classifies the windows of all lines with content in batches and
+            returns the log-probability of each split point per line (zero
+            for the lines without content).
+            Full windows keep their height, so the band is resized once
+            and the windows are cut from it. The shortened windows at
+            the end of the strip are resized separately.
+        """
+        starts = np.flatnonzero(has_content)
+        log_probabilities = np.zeros((len(band), len(self.labels.classes_)))
+        full = len(band) - window_height
+        resized_band = scipy.misc.imresize(band, [len(band), ROW_WINDOW[1]]) if full > 0 and len(starts) > 0 else None
+        for batch_start in range(0, len(starts), BATCH_SIZE):
+            self.deadline.check()
+            batch_starts = starts[batch_start:batch_start + BATCH_SIZE]
+            windows = []
+            for start in batch_starts:
+                if start < full:
+                    windows.append(resized_band[start:start + window_height])
+                else:
+                    end = min(start + window_height, len(band) - 1)
+                    windows.append(scipy.misc.imresize(band[start:end], ROW_WINDOW))
+            batch = np.expand_dims(np.array(windows), axis=3) / 255.0
+            self.cnn_calls += 1
+            probabilities = self.model.predict(batch)
+            if probabilities.shape[1] == 1:
+                # LabelBinarizer uses a single column for two classes
+                probabilities = np.hstack((1 - probabilities, probabilities))
+            log_probabilities[batch_starts] = np.log(np.maximum(probabilities, MIN_PROBABILITY))
+        return log_probabilities
+
+    def determine_split_points(self, log_probabilities, has_content):
+        """
+            Chooses the split point per line so that the rows from line 0
+            to the end of the strip have the highest mean log-probability
+            per row. The sum of the log-probabilities would prefer fewer,
+            merged rows, because every row adds a negative term. The mean
+            is maximized with Dinkelbach's method: the dynamic program
+            subtracts the mean of the previous segmentation from every row
+            until the mean doesn't increase anymore.
+            Returns the chosen split point per line.
+        """
+        split_points, total, rows = self.find_best_segmentation(log_probabilities, has_content, 0.0)
+        for _ in range(MAX_NORMALIZATION_ITERATIONS):
+            if rows == 0:
+                break
+            row_penalty = total / rows
+            new_split_points, total, rows = self.find_best_segmentation(log_probabilities, has_content, row_penalty)
+            if rows == 0 or total / rows <= row_penalty + NORMALIZATION_TOLERANCE:
+                break
+            split_points = new_split_points
+        return split_points
+
+    def find_best_segmentation(self, log_probabilities, has_content, row_penalty):
+        """
+            Dynamic program over the lines: chooses the split point per
+            line with the highest sum of the log-probabilities minus
+            row_penalty per row. A row which starts at a line without
+            content ends the strip.
+            Returns the split point per line and the sum of the
+            log-probabilities and the number of rows on the chosen path.
+        """
+        lines = len(has_content)
+        classes = np.array([int(label) for label in self.labels.classes_])
+        columns = np.flatnonzero(classes > 0)
+        # best[i]: score of the best segmentation from line i, the last
+        # entry ends the strip
+        best = np.zeros(lines + 1)
+        split_points = np.zeros(lines, dtype=int)
+        chosen_columns = np.zeros(lines, dtype=int)
+        for start in range(lines - 1, -1, -1):
+            if start % BATCH_SIZE == 0:
+                self.deadline.check()
+            if not has_content[start] or len(columns) == 0:
+                continue
+            scores = log_probabilities[start, columns] - row_penalty + best[np.minimum(start + classes[columns], lines)]
+            column = int(np.argmax(scores))
+            chosen_columns[start] = columns[column]
+            split_points[start] = classes[columns[column]]
+            best[start] = scores[column]
+
+        total = 0.0
+        rows = 0
+        start = 0
+        while start < lines and has_content[start] and split_points[start] > 0:
+            total += log_probabilities[start, chosen_columns[start]]
+            rows += 1
+            start += split_points[start]
+        return split_points, total, rows
+
     def extract_rows_with_window(self, start):
         """
             Returns the rows which are inside the current
@@ -85,4 +234,5 @@ class CnnRowExtractor:
         resized = np.expand_dims(resized, axis=2)
         resized = np.expand_dims(resized, axis=0)
         resized = resized / 255.0
+        self.cnn_calls += 1
         return self.model.predict(resized)
\ No newline at end of file
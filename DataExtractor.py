@@ -1,22 +1,36 @@
 import itertools
-import datetime
 from Utils import *
+from Deadline import Deadline
+from BitRow import BitRow
 from DataFieldHelper import parse_length
 from FileHeader import FileHeader
 
+# The checksum is a sum with end-around carry, i.e. a sum modulo 255
+CHECKSUM_MODULUS = 255
+# Data sync, expansion bytes, length and checksum field
+CHECKSUM_FIELDS_LENGTH = 6
+# Strip id and sequence number after the checksum field
+STRIP_HEADER_LENGTH = 7
+
 
 class DataExtractor:
     """
         Extracts and parses all file information fields and 
         the data bits.
     """
-    def __init__(self, timeout):
+    def __init__(self, deadline=None):
         self.alternative_rows = []
         self.alternative_indices = []
-        self.bits = []
+        self.alternative_offsets = []
+        # All data bits as bit field, the first bit is the least significant bit
+        self.bits = 0
+        self.bits_length = 0
+        self.data_offset = 0
         self.attributes = {}
         self.valid = False
-        self.timeout = timeout
+        # Number of alternative row combinations verified with the checksum
+        self.combinations_tried = 0
+        self.deadline = deadline if deadline is not None else Deadline()
 
     def set_data(self, data, first_strip):
         data_length = self.file_header.length - 11 # remove checksum, strip id, seq no, strip type and softw. expan
@@ -25,34 +39,39 @@ class DataExtractor:
         self.data = data[0:data_length]
 
     def calculate_checksum(self, data, length):
-        # Source:
-        # https://github.com/FozzTexx/Distripitor/blob/master/Barcode.m#L311-L317
-        c = 0
+        """
+            The checksum is a sum with end-around carry, source:
+            https://github.com/FozzTexx/Distripitor/blob/master/Barcode.m#L311-L317
+            The folded sum is the byte sum modulo 255, only a sum of 0
+            folds to 0 (instead of 255).
+        """
         l = parse_length(length) - 1
 
         if l > len(data):
             return -1
 
-        for i in range(l):
-            byte = data[i]
-            c = ((c & 0xff) + byte + (c >> 8)) & 0x1ff
-        return 0x100 - ((c & 0xff) + (c >> 8))
+        total = sum(data[0:max(l, 0)])
+        if total == 0:
+            return 0x100
+        return 0x100 - ((total - 1) % CHECKSUM_MODULUS + 1)
 
     def convert_bit_row_to_byte(self, row, header_processed):
-        copy = row.copy()
-        row_bytes = []
-
-        while copy:
-            byte = 0
-            bit = 1
-            if len(copy) == 4 and not header_processed:
-                return row_bytes
-            for i in range(8):
-                if copy.pop(0):
-                    byte |= bit
-                bit <<= 1
-            row_bytes.append(byte)
-        return row_bytes
+        """
+            Converts a bit field (bits, length) to bytes. The first bit is
+            the least significant bit of the first byte. A trailing nibble
+            is ignored until the header is processed.
+        """
+        bits, length = row
+        byte_count = length // 8
+        if length % 8 != 0 and header_processed:
+            byte_count += 1
+        bits &= (1 << (byte_count * 8)) - 1
+        return list(bits.to_bytes(byte_count, 'little'))
+
+    def append_bits(self, row):
+        bits, length = row
+        self.bits |= bits << self.bits_length
+        self.bits_length += length
 
     def is_header_processed(self, num_zeros, row):
         """
@@ -72,13 +91,16 @@ class DataExtractor:
         return False, add_last_row, num_zeros
 
     def extract_data_bits_from_row(self, row, index, header_processed):
+        """
+            Returns the data bits of a row as bit field (bits, length)
+        """
         if type(row) is list:
             row = row[0]
-        row = row.strip()
-        line_data_raw = row[7:-7]
-        return convert_dibit_row_to_bit(line_data_raw)
+        if not isinstance(row, BitRow):
+            row = BitRow.from_string(row.strip())
+        return row.data_bits()
 
-    def extract_all_data_bits(self, rows):
+    def extract_all_data_bits(self, rows, collect_alternatives=True):
         """
             Extracts all data bits from all rows
         """
@@ -95,91 +117,239 @@ class DataExtractor:
                 line_bytes = self.convert_bit_row_to_byte(line_data, header_processed)
                 header_processed, add_last_row, num_zeros = self.is_header_processed(num_zeros, line_bytes)
                 if add_last_row == True:
-                    self.bits += last_row
+                    self.append_bits(last_row)
 
             if header_processed is True:
-                self.bits += line_data
-                if len(row) > 1:
+                if len(row) > 1 and collect_alternatives:
                     self.alternative_rows.append(row)
                     self.alternative_indices.append(index)
+                    self.alternative_offsets.append(self.bits_length)
+                self.append_bits(line_data)
 
             last_row = line_data
 
     def parse_up_to_checksum(self):
         """
-            Processes the first data fields up to the checksum field
+            Processes the first data fields up to the checksum field and
+            returns the bytes after the checksum field
         """
-        if len(self.bits) % 8 != 0:
-            self.bits += [0, 0, 0, 0]
-        data = self.convert_bit_row_to_byte(self.bits, True)
-        num_zeros = 0
-        for index, data_byte in enumerate(data):
-            if num_zeros == 3:
-                data = data[index-3:]
-                break
-            if data_byte == 0x00:
-                num_zeros += 1
-            else:
-                num_zeros = 0
+        if self.bits_length % 8 != 0:
+            self.bits_length += 4
+        data = self.convert_bits_to_bytes(self.bits, self.bits_length)
+        sync_start = data.find(b'\x00\x00\x00')
+        # The sync bytes have to be followed by data
+        if sync_start < 0 or sync_start + 3 >= len(data):
+            sync_start = 0
+
+        self.attributes['data_sync'] = data[sync_start]
+        self.attributes['expansion_bytes'] = list(data[sync_start + 1:sync_start + 3])
+        self.attributes['length'] = list(data[sync_start + 3:sync_start + 5])
+        self.attributes['checksum'] = data[sync_start + 5]
+        # Position of the first byte after the checksum in self.bits
+        self.data_offset = (sync_start + 6) * 8
+        return data[sync_start + 6:]
 
-        self.attributes['data_sync'] = pop_multiple_items(data, 0, 1)[0]
-        self.attributes['expansion_bytes'] = pop_multiple_items(data, 0, 2)
-        self.attributes['length'] = pop_multiple_items(data, 0, 2)
-        self.attributes['checksum'] = pop_multiple_items(data, 0, 1)[0]
-        return data
+    def convert_bits_to_bytes(self, bits, length):
+        """
+            Converts a bit field (bits, length) with a multiple of 8 bits
+            to bytes, the first bit is the least significant bit
+        """
+        byte_count = length // 8
+        return (bits & ((1 << (byte_count * 8)) - 1)).to_bytes(byte_count, 'little')
 
     def parse_file_header(self, data, first_strip):
         """
-            Processes all data fields after the checksum field
+            Processes all data fields after the checksum field and
+            returns the remaining bytes
         """
-        self.attributes['strip_id'] = pop_multiple_items(data, 0, 6)
-        self.attributes['seq_no'] = pop_multiple_items(data, 0, 1)[0]
-        self.attributes['strip_type'] = pop_multiple_items(data, 0, 1)[0]
-        self.attributes['software_expansion'] = pop_multiple_items(data, 0, 2)
+        self.attributes['strip_id'] = list(data[0:6])
+        self.attributes['seq_no'] = data[6]
+        self.attributes['strip_type'] = data[7]
+        self.attributes['software_expansion'] = list(data[8:10])
+        position = 10
         if first_strip:
-            self.attributes['os_sys_type'] = pop_multiple_items(data, 0, 1)[0]
-            self.attributes['num_files'] = pop_multiple_items(data, 0, 1)[0]
-            self.attributes['cauzin_type'] = pop_multiple_items(data, 0, 1)[0]
-            self.attributes['os_filetype'] = pop_multiple_items(data, 0, 1)[0]
-            self.attributes['file_length'] = pop_multiple_items(data, 0, 3)
-            self.attributes['filename'] = ''
-            while data[0] != 0x00 and data[0] != 0xFF:
-                self.attributes['filename'] += chr(pop_multiple_items(data, 0, 1)[0])
-            self.attributes['terminator'] = pop_multiple_items(data, 0, 1)[0]
-            self.attributes['block_expand'] = pop_multiple_items(data, 0, 1)[0]
+            self.attributes['os_sys_type'] = data[10]
+            self.attributes['num_files'] = data[11]
+            self.attributes['cauzin_type'] = data[12]
+            self.attributes['os_filetype'] = data[13]
+            self.attributes['file_length'] = list(data[14:17])
+            position = 17
+            while data[position] != 0x00 and data[position] != 0xFF:
+                position += 1
+            self.attributes['filename'] = data[17:position].decode('latin-1')
+            self.attributes['terminator'] = data[position]
+            self.attributes['block_expand'] = data[position + 1]
+            position += 2
 
         self.file_header = FileHeader(self.attributes, first_strip)
-        return data
+        return data[position:]
 
-    def try_alternative_rows(self, raw_data, start_time):
+    def extract_strip_header(self, raw_data):
         """
-            Try all combinations for rows with multiple solutions
+            Parses the strip id and the sequence number from the first
+            rows of a strip. The checksum is not verified.
+            Returns False if the rows don't contain both fields yet,
+            e.g. if they are still inside the vertical sync section.
         """
-        for element in itertools.product(*self.alternative_rows):
-            now = datetime.datetime.now().replace(microsecond=0)
-            difference = now - start_time
-            if (difference.seconds // 60) > self.timeout:
-                self.valid = False
-                break
-            new_raw_data = raw_data.copy()
-            for i, item in enumerate(element):
-                new_raw_data[self.alternative_indices[i]] = item
-                new_raw_data[self.alternative_indices[i]] = item
-            self.bits = []
-            self.extract_all_data_bits(new_raw_data)
-            data = self.parse_up_to_checksum()
-            if self.attributes['checksum'] == self.calculate_checksum(data, self.attributes['length']):
-                self.valid = True
-                break
+        self.bits = 0
+        self.bits_length = 0
+        self.extract_all_data_bits(raw_data, False)
+        # No data bits are collected before the sync bytes
+        if self.bits_length < (CHECKSUM_FIELDS_LENGTH + STRIP_HEADER_LENGTH) * 8:
+            return False
+        data = self.parse_up_to_checksum()
+        sync_found = self.attributes['data_sync'] == 0 and self.attributes['expansion_bytes'] == [0, 0]
+        if not sync_found or len(data) < STRIP_HEADER_LENGTH:
+            return False
+        self.attributes['strip_id'] = list(data[0:6])
+        self.attributes['seq_no'] = data[6]
+        return True
+
+    def try_alternative_rows(self, raw_data):
+        """
+            Searches the combination of rows with multiple solutions which
+            has a valid checksum. Rows which contain the sync, length and
+            checksum fields are tried one by one. The checksum is additive,
+            so the contribution of all other row candidates is computed
+            once and combined with a dynamic program over the checksum
+            residues. The combinations are visited in the same order as
+            itertools.product.
+            Returns the data of the first valid combination or None.
+        """
+        header_rows = [i for i, offset in enumerate(self.alternative_offsets) if offset < self.data_offset]
+        other_rows = [i for i in range(len(self.alternative_rows)) if i not in header_rows]
+        header_candidates = [self.alternative_rows[i] for i in header_rows]
+        for element in itertools.product(*header_candidates):
+            self.deadline.check()
+            choices = dict(zip(header_rows, element))
+            data = self.rebuild_data(raw_data, choices)
+            if any(self.alternative_offsets[i] < self.data_offset for i in other_rows):
+                # The header fields moved into rows which are not tried one by one
+                data = self.try_all_combinations(raw_data, choices, other_rows)
+            else:
+                data = self.search_checksum(raw_data, choices, other_rows, data)
+            if data is not None:
+                return data
+        return None
 
-    def extract_data(self, raw_data, first_strip=False, start_time=None):
+    def search_checksum(self, raw_data, choices, rows, data):
+        """
+            Finds the candidates of the rows whose checksum residues add up
+            to the expected checksum and verifies them with the checksum.
+        """
+        length = parse_length(self.attributes['length']) - 1
+        # A candidate may have corrupted the length field
+        if length < 0 or length > len(data):
+            return None
+        checksum_start = self.data_offset
+        checksum_end = self.data_offset + length * 8
+        residues = []
+        for i in rows:
+            offset = self.alternative_offsets[i]
+            residues.append([self.calculate_residue(candidate, offset, checksum_start, checksum_end)
+                             for candidate in self.alternative_rows[i]])
+
+        # The data was built with the first candidate of each row
+        target = (0x100 - self.attributes['checksum']) % CHECKSUM_MODULUS
+        fixed = (sum(data[0:length]) - sum(residue[0] for residue in residues)) % CHECKSUM_MODULUS
+        reachable = self.determine_reachable_residues(residues)
+        needed = (target - fixed) % CHECKSUM_MODULUS
+        for assignment in self.enumerate_assignments(residues, reachable, 0, needed):
+            self.deadline.check()
+            new_choices = dict(choices)
+            for i, candidate in zip(rows, assignment):
+                new_choices[i] = self.alternative_rows[i][candidate]
+            new_data = self.rebuild_data(raw_data, new_choices)
+            self.combinations_tried += 1
+            if self.is_checksum_valid(new_data):
+                return new_data
+        return None
+
+    def try_all_combinations(self, raw_data, choices, rows):
+        """
+            Tries all combinations of the rows one by one
+        """
+        for element in itertools.product(*[self.alternative_rows[i] for i in rows]):
+            self.deadline.check()
+            new_choices = dict(choices)
+            new_choices.update(zip(rows, element))
+            data = self.rebuild_data(raw_data, new_choices)
+            self.combinations_tried += 1
+            if self.is_checksum_valid(data):
+                return data
+        return None
+
+    def calculate_residue(self, row, offset, checksum_start, checksum_end):
+        """
+            Calculates the contribution of a row candidate to the checksum.
+            The row starts at the bit position offset, only the bits
+            between checksum_start and checksum_end are part of the checksum.
+        """
+        bits, _ = self.extract_data_bits_from_row(row, 0, True)
+        mask = ((1 << (checksum_end - checksum_start)) - 1) << checksum_start
+        # checksum_start is byte aligned and 256 = 1 (mod 255), so the bit
+        # field modulo 255 equals the sum of its bytes modulo 255
+        return ((bits << offset) & mask) % CHECKSUM_MODULUS
+
+    def determine_reachable_residues(self, residues):
+        """
+            reachable[i] is a bit mask of all residues which can be reached
+            by the rows i..n. Rotating the mask adds a residue modulo 255.
+        """
+        full_mask = (1 << CHECKSUM_MODULUS) - 1
+        reachable = [0] * len(residues) + [1]
+        for i in reversed(range(len(residues))):
+            mask = 0
+            following = reachable[i + 1]
+            for residue in set(residues[i]):
+                mask |= ((following << residue) | (following >> (CHECKSUM_MODULUS - residue))) & full_mask
+            reachable[i] = mask
+        return reachable
+
+    def enumerate_assignments(self, residues, reachable, index, needed):
+        """
+            Yields the candidate indices of all rows whose residues
+            add up to needed, in lexicographic order
+        """
+        if index == len(residues):
+            yield []
+            return
+        for candidate, residue in enumerate(residues[index]):
+            rest = (needed - residue) % CHECKSUM_MODULUS
+            if (reachable[index + 1] >> rest) & 1:
+                for assignment in self.enumerate_assignments(residues, reachable, index + 1, rest):
+                    yield [candidate] + assignment
+
+    def rebuild_data(self, raw_data, choices):
+        """
+            Parses the data up to the checksum with the chosen
+            candidates for the alternative rows
+        """
+        new_raw_data = raw_data.copy()
+        for i, item in choices.items():
+            new_raw_data[self.alternative_indices[i]] = item
+        self.bits = 0
+        self.bits_length = 0
+        self.extract_all_data_bits(new_raw_data, False)
+        return self.parse_up_to_checksum()
+
+    def is_checksum_valid(self, data):
+        return self.attributes['checksum'] == self.calculate_checksum(data, self.attributes['length'])
+
+    def extract_data(self, raw_data, first_strip=False):
         self.extract_all_data_bits(raw_data)
         data = self.parse_up_to_checksum()
 
-        if self.attributes['checksum'] != self.calculate_checksum(data, self.attributes['length']):
+        if not self.is_checksum_valid(data):
+            valid_data = None
             if len(self.alternative_rows) > 0:
-                self.try_alternative_rows(raw_data, start_time)
+                valid_data = self.try_alternative_rows(raw_data)
+            if valid_data is not None:
+                data = valid_data
+                self.valid = True
             else:
+                # Restore the fields of the initial rows
+                data = self.rebuild_data(raw_data, {})
                 self.valid = False
                 print('Invalid checksum!')
         else:
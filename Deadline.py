@@ -0,0 +1,102 @@
+import time
+
+HEADER_STAGE = 'header'
+ROW_EXTRACTION_STAGE = 'row_extraction'
+ROW_DECODING_STAGE = 'row_decoding'
+CHECKSUM_SEARCH_STAGE = 'checksum_search'
+STAGES = [HEADER_STAGE, ROW_EXTRACTION_STAGE, ROW_DECODING_STAGE, CHECKSUM_SEARCH_STAGE]
+# Polling a cancel event of another process is expensive,
+# so it is checked at most every X seconds
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class StageTimeout(Exception):
+    """
+        Raised when a stage of the decoding pipeline exceeds its
+        budget or when the decoding is cancelled.
+    """
+    def __init__(self, stage, budget=None, cancelled=False):
+        self.stage = stage
+        self.budget = budget
+        self.cancelled = cancelled
+        if cancelled:
+            message = 'Decoding cancelled during stage ' + str(stage)
+        else:
+            message = 'Stage ' + str(stage) + ' exceeded its budget of ' + str(budget) + 's'
+        super(StageTimeout, self).__init__(message)
+
+    def __reduce__(self):
+        # Keeps the stage when the exception is sent from a worker process
+        return StageTimeout, (self.stage, self.budget, self.cancelled)
+
+
+class Deadline:
+    """
+        Shared deadline and cancellation token which is passed through the
+        decoding pipeline. Each stage has its own budget in seconds.
+    """
+    def __init__(self, budgets=None, cancel_event=None):
+        """
+            budgets: dict stage -> seconds, a number (in minutes) applies
+                     to all stages, None disables the budgets
+            cancel_event: optional threading/multiprocessing Event which
+                          aborts the decoding once it is set
+        """
+        if budgets is None:
+            budgets = {}
+        elif not isinstance(budgets, dict):
+            budgets = {stage: budgets * 60 for stage in STAGES}
+        self.budgets = budgets
+        self.cancel_event = cancel_event
+        self.cancelled = False
+        self.stage = None
+        self.stage_end = None
+        self.next_cancel_poll = 0
+
+    def start_stage(self, stage):
+        """
+            Starts the budget of the next stage
+        """
+        self.check()
+        self.stage = stage
+        budget = self.budgets.get(stage)
+        if budget is None:
+            self.stage_end = None
+        else:
+            self.stage_end = time.monotonic() + budget
+
+    def expired(self):
+        """
+            Returns True if the current stage ran out of time or
+            the decoding was cancelled
+        """
+        try:
+            self.check()
+        except StageTimeout:
+            return True
+        return False
+
+    def check(self):
+        """
+            Raises StageTimeout if the current stage ran out of time
+            or the decoding was cancelled
+        """
+        if self.cancelled:
+            raise StageTimeout(self.stage, cancelled=True)
+        if self.stage_end is None and self.cancel_event is None:
+            return
+        now = time.monotonic()
+        if self.stage_end is not None and now > self.stage_end:
+            raise StageTimeout(self.stage, self.budgets.get(self.stage))
+        if self.cancel_event is not None and now >= self.next_cancel_poll:
+            self.next_cancel_poll = now + CANCEL_POLL_INTERVAL
+            if self.cancel_event.is_set():
+                raise StageTimeout(self.stage, cancelled=True)
+
+    def cancel(self):
+        """
+            Aborts the decoding at the next check
+        """
+        self.cancelled = True
+        if self.cancel_event is not None:
+            self.cancel_event.set()
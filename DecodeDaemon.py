@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+
+DEFAULT_SOCKET = '/tmp/softstrip-decoder.sock'
+BUFFER_SIZE = 65536
+
+
+class DecodeRequestHandler(socketserver.StreamRequestHandler):
+    """
+        Each request is a single JSON line:
+        {"paths": [...], "output": "..."} decodes the strips of one file,
+        {"shutdown": true} stops the daemon.
+        The response is the result of BatchDecoder.decode_job as JSON line.
+    """
+    def handle(self):
+        from BatchDecoder import decode_job
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError as e:
+            self.send({'error': 'Invalid request: ' + str(e)})
+            return
+        error = validate_request(request)
+        if error is not None:
+            self.send({'error': 'Invalid request: ' + error})
+            return
+        if request.get('shutdown'):
+            self.send({'shutdown': True})
+            self.server.shutdown_requested = True
+            return
+        # The requests are handled in threads of the daemon, which must
+        # not fork the process pools of the row scheduler
+        self.send(decode_job(request['paths'], request.get('output', ''), row_workers=1))
+
+    def send(self, response):
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+def validate_request(request):
+    """
+        Returns the error of a malformed request or None
+    """
+    if not isinstance(request, dict):
+        return 'expected a JSON object'
+    if request.get('shutdown'):
+        return None
+    paths = request.get('paths')
+    if not isinstance(paths, list) or len(paths) == 0 or not all(isinstance(path, str) for path in paths):
+        return 'paths has to be a non-empty list of strip paths'
+    if not isinstance(request.get('output', ''), str):
+        return 'output has to be a directory path'
+    return None
+
+
+class DecodeDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+        Long-lived local decoder which listens on a Unix socket. The CNNs
+        are loaded once at startup, so decoding requests skip the
+        TensorFlow/Keras startup and the model loading.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.socket_path = socket_path
+        self.shutdown_requested = False
+        super(DecodeDaemon, self).__init__(socket_path, DecodeRequestHandler)
+
+    def preload_models(self, config):
+        """
+            Loads the CNNs which are selected in the config
+        """
+        from Backends import CNN_ROW_DECODER, CNN_ROW_EXTRACTOR, CNN_BATCHED_ROW_EXTRACTOR
+        from Utils import load_cnn
+        if config['row_decoder'] == CNN_ROW_DECODER:
+            import CnnRowDecoder
+            load_cnn(CnnRowDecoder.MODEL_FILENAME, CnnRowDecoder.WEIGHT_FILENAME, CnnRowDecoder.LABELS_FILENAME)
+        if config['row_extractor'] in (CNN_ROW_EXTRACTOR, CNN_BATCHED_ROW_EXTRACTOR):
+            import CnnRowExtractor
+            load_cnn(CnnRowExtractor.MODEL_FILENAME, CnnRowExtractor.WEIGHT_FILENAME, CnnRowExtractor.LABELS_FILENAME)
+
+    def service_actions(self):
+        if self.shutdown_requested:
+            # shutdown() waits for serve_forever, so it is called by another thread
+            import threading
+            threading.Thread(target=self.shutdown).start()
+            self.shutdown_requested = False
+
+    def server_close(self):
+        super(DecodeDaemon, self).server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def send_request(request, socket_path=DEFAULT_SOCKET):
+    """
+        Sends a request to the daemon and returns its response
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        response = b''
+        while not response.endswith(b'\n'):
+            data = client.recv(BUFFER_SIZE)
+            if not data:
+                break
+            response += data
+    finally:
+        client.close()
+    return json.loads(response.decode('utf-8'))
+
+
+def request_decode(paths, output_dir='', socket_path=DEFAULT_SOCKET):
+    """
+        Lets the daemon decode the strips of a file. Relative paths are
+        resolved against the current working directory of the client.
+    """
+    request = {'paths': [os.path.abspath(path) for path in paths],
+               'output': os.path.abspath(output_dir) if output_dir else os.getcwd()}
+    return send_request(request, socket_path)
+
+
+def print_response(response):
+    if response.get('error') is not None:
+        print('[ERROR] ' + response['error'])
+    elif response.get('timeout') is not None:
+        print('[TIMEOUT] stage ' + response['timeout']['stage'])
+    else:
+        state = 'valid' if response['valid'] else 'INVALID'
+        print('[' + state + '] ' + str(response['filename']) + ' (' + str(response['bytes']) + ' bytes)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Softstrip Decoder Daemon')
+    parser.add_argument('paths', nargs='*', help='strips which are decoded by a running daemon')
+    parser.add_argument('--serve', action='store_true', help='start the daemon')
+    parser.add_argument('--stop', action='store_true', help='stop a running daemon')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--output', default='', help='directory for the decoded files')
+    args = parser.parse_args()
+    if args.serve:
+        import yaml
+        from SoftstripDecoder import CONFIG_FILENAME
+        with open(CONFIG_FILENAME, 'r') as f:
+            config = yaml.load(f)
+        daemon = DecodeDaemon(args.socket)
+        daemon.preload_models(config)
+        print('Listening on ' + args.socket)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.server_close()
+    elif args.stop:
+        send_request({'shutdown': True}, args.socket)
+    elif len(args.paths) > 0:
+        print_response(request_decode(args.paths, args.output, args.socket))
+    else:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
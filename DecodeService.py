@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from BatchDecoder import decode_job
+
+QUEUED_STATE = 'queued'
+RUNNING_STATE = 'running'
+FINISHED_STATE = 'finished'
+CANCELLED_STATE = 'cancelled'
+DEFAULT_WORKERS = 2
+# A rows_decoded event is dropped if more than MAX_QUEUED_PROGRESS_EVENTS
+# events wait in a queue, the other events are always delivered
+MAX_QUEUED_PROGRESS_EVENTS = 50
+
+
+class DecodeJob:
+    """
+        A file (all its strips) which is decoded by the DecodeService.
+        The progress events of the job are put into its events queue,
+        the last event is 'finished'. The rows_decoded events are
+        throttled, so a caller which only waits for the result doesn't
+        collect an event per row.
+    """
+    def __init__(self, job_id, paths, output_dir, loop):
+        self.job_id = job_id
+        self.paths = paths
+        self.output_dir = output_dir
+        self.loop = loop
+        self.state = QUEUED_STATE
+        self.result = None
+        self.cancel_event = threading.Event()
+        self.events = asyncio.Queue()
+        # Further queues which receive the events (see DecodeService.serve)
+        self.listeners = [self.events]
+        self.task = None
+
+    def publish(self, event):
+        event['job'] = self.job_id
+        for listener in self.listeners:
+            if self.is_dropped(event, listener):
+                continue
+            listener.put_nowait(event)
+
+    def is_dropped(self, event, listener):
+        """
+            Drops the rows_decoded events, except for the last row of a
+            strip, while a listener isn't read
+        """
+        if event['event'] != 'rows_decoded' or event['decoded'] == event['rows']:
+            return False
+        return listener.qsize() >= MAX_QUEUED_PROGRESS_EVENTS
+
+    def publish_threadsafe(self, event):
+        """
+            Publishes an event from the decoding thread
+        """
+        self.loop.call_soon_threadsafe(self.publish, event)
+
+    def cancel(self):
+        """
+            A queued job is not started, a running job stops at the next
+            deadline check of its decoder
+        """
+        self.cancel_event.set()
+
+    async def stream(self):
+        """
+            Yields the progress events until the job is finished
+        """
+        while True:
+            event = await self.events.get()
+            yield event
+            if event['event'] == 'finished':
+                return
+
+    async def wait(self):
+        """
+            Waits until the job is finished and returns its result
+            (see BatchDecoder.decode_job, None if it was cancelled
+            before it started)
+        """
+        await self.task
+        return self.result
+
+
+class DecodeService:
+    """
+        Asyncio service which decodes jobs in a thread pool and streams
+        their progress (header parsed, rows extracted, N/M rows decoded,
+        checksum result). The decoders run in threads, so the CNNs are
+        shared by all jobs (see ModelRegistry) and the progress events
+        reach the event loop without inter-process communication.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, row_workers=1):
+        """
+            workers: number of jobs which are decoded at the same time
+            row_workers: number of rows of a strip which are decoded at
+                         the same time, None uses the config
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.row_workers = row_workers
+        self.job_ids = itertools.count(1)
+        self.jobs = {}
+
+    def submit(self, paths, output_dir=''):
+        """
+            Queues the strips of a file for decoding and returns the job.
+            Has to be called from the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        job = DecodeJob(next(self.job_ids), paths, output_dir, loop)
+        self.jobs[job.job_id] = job
+        job.task = loop.create_task(self.run(job))
+        return job
+
+    def cancel(self, job_id):
+        """
+            Returns False if the job is unknown or already finished
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    async def run(self, job):
+        loop = asyncio.get_event_loop()
+        job.result = await loop.run_in_executor(self.executor, self.decode, job)
+        # A job which is cancelled after its last deadline check is finished
+        if job.result is None or (job.result['timeout'] is not None and job.result['timeout']['cancelled']):
+            job.state = CANCELLED_STATE
+        else:
+            job.state = FINISHED_STATE
+        job.publish({'event': 'finished', 'state': job.state, 'result': job.result})
+        del self.jobs[job.job_id]
+
+    def decode(self, job):
+        """
+            Decodes a job in a thread of the executor
+        """
+        if job.cancel_event.is_set():
+            return None
+        job.state = RUNNING_STATE
+        job.publish_threadsafe({'event': 'started', 'paths': job.paths})
+        return decode_job(job.paths, job.output_dir, job.cancel_event, row_workers=self.row_workers,
+                          progress=job.publish_threadsafe)
+
+    async def serve(self, requests, events):
+        """
+            Decodes the requests of an in-process queue. Each request is
+            a dict {'paths': [...], 'output': '...'} (see DecodeDaemon),
+            None stops the service once all jobs are finished. The events
+            of all jobs are put into the events queue.
+        """
+        jobs = []
+        while True:
+            request = await requests.get()
+            if request is None:
+                break
+            job = self.submit(request['paths'], request.get('output', ''))
+            job.listeners.append(events)
+            jobs.append(job)
+        for job in jobs:
+            await job.task
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+async def decode_files(files, output_dir, workers):
+    """
+        Decodes the files (lists of strip paths) and prints the
+        progress events as JSON lines
+    """
+    service = DecodeService(workers)
+    requests = asyncio.Queue()
+    events = asyncio.Queue()
+    for paths in files:
+        requests.put_nowait({'paths': paths, 'output': output_dir})
+    requests.put_nowait(None)
+    serving = asyncio.ensure_future(service.serve(requests, events))
+    finished = 0
+    while finished < len(files):
+        event = await events.get()
+        print(json.dumps(event, default=str))
+        if event['event'] == 'finished':
+            finished += 1
+    await serving
+    service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Softstrip Decode Service')
+    parser.add_argument('files', nargs='+', help='one argument per file with its strips separated by commas')
+    parser.add_argument('--output', default='', help='directory for the decoded files')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='files decoded at the same time')
+    args = parser.parse_args()
+    files = [paths.split(',') for paths in args.files]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(decode_files(files, args.output, args.workers))
+    finally:
+        loop.close()
@@ -1,6 +1,8 @@
 from AbstractHeaderExtractor import AbstractHeaderExtractor
 from RowComponents import RowComponents
 from math import sqrt
+import numpy as np
+from Deadline import Deadline
 
 HORIZONTAL_SYNC_DELTA = 0.1
 HORIZONTAL_SIMILARITY_MINIMUM = 5
@@ -12,15 +14,17 @@ class HeaderExtractor(AbstractHeaderExtractor):
         - Determines the number of bytes in a row
         - Removes the horizontal synchronization section
     """
-    def __init__(self, softstrip_matrix):
+    def __init__(self, softstrip_matrix, deadline=None):
         """
             Constructor
             Parameters
             ----------
             softstrip_matrix: SoftstripMatrix
+            deadline: optional Deadline which is checked for every pixel line
         """
         self.nibbles = 0
         self.softstrip_matrix = softstrip_matrix
+        self.deadline = deadline if deadline is not None else Deadline()
         self.create_components()
 
     def remove_horizontal_header(self):
@@ -37,6 +41,7 @@ class HeaderExtractor(AbstractHeaderExtractor):
         horizontal_sync_extracted = False
         vertical_sync_extracted = False
         for index, row in enumerate(self.components):
+            self.deadline.check()
             if not horizontal_sync_extracted:
                 if self.check_row_similarity(index, HORIZONTAL_SIMILARITY_MINIMUM):
                     self.nibbles = self.decode_nibbles(row)
@@ -44,7 +49,7 @@ class HeaderExtractor(AbstractHeaderExtractor):
                     horizontal_sync_extracted = True
             if horizontal_sync_extracted and not vertical_sync_extracted:
                 self.vertical_sync_start = index
-                count_diff = abs(len(row['components']) - len(horizontal_row['components']))
+                count_diff = abs(len(row['values']) - len(horizontal_row['values']))
                 if count_diff > MINIMUM_BAR_DIFFERENCE:
                     if self.check_row_similarity(index, VERTICAL_SIMILARITY_MINIMUM):
                         vertical_sync_extracted = True
@@ -54,10 +59,11 @@ class HeaderExtractor(AbstractHeaderExtractor):
         """
             Deletes all rows before vertical_sync_start
         """
-        for i in range(self.vertical_sync_start):
-            del self.softstrip_matrix.binary_matrix[0]
-            if self.softstrip_matrix.grayscale_matrix is not None:
-                del self.softstrip_matrix.grayscale_matrix[0]  
+        start = self.vertical_sync_start
+        self.softstrip_matrix.binary_matrix = self.softstrip_matrix.binary_matrix[start:]
+        self.softstrip_matrix.run_length_index = self.softstrip_matrix.run_length_index.slice(start)
+        if self.softstrip_matrix.grayscale_matrix is not None:
+            self.softstrip_matrix.grayscale_matrix = self.softstrip_matrix.grayscale_matrix[start:]
 
     def get_bits_per_row(self):
         """
@@ -116,12 +122,8 @@ class HeaderExtractor(AbstractHeaderExtractor):
             Counts the white to black transitions to decode the
             number of nibbles per row.
         """
-        transitions = 0
-        last_value = -1
-        for component in row['components']:
-            if last_value == 0 and component['value'] == 1:
-                transitions += 1
-            last_value = component['value']
+        values = row['values']
+        transitions = int(np.count_nonzero((values[:-1] == 0) & (values[1:] == 1)))
         nibbles = (transitions + 5) / 2 # 5 because first 0 component is removed
 
         return nibbles
@@ -134,7 +136,7 @@ class HeaderExtractor(AbstractHeaderExtractor):
             - minimum bar width
             - average bar width
             - number of bars
-            - the pixels of each bar
+            - the colors of each bar
         """
-        row_components = RowComponents(self.softstrip_matrix.binary_matrix)
+        row_components = RowComponents(self.softstrip_matrix.run_length_index)
         self.components = row_components.components
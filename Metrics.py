@@ -0,0 +1,127 @@
+import json
+import time
+
+METRICS_PREFIX = 'softstrip_'
+JSON_LINES_FORMAT = 'jsonl'
+PROMETHEUS_FORMAT = 'prometheus'
+FORMATS = [JSON_LINES_FORMAT, PROMETHEUS_FORMAT]
+# Descriptions of the counters which are reported by the pipeline
+COUNTERS = {
+    'rows': 'Rows found by the row extractor',
+    'decoded_rows': 'Rows decoded by the row decoder',
+    'bfs_nodes': 'Sub-rows explored by the BFS row splitting',
+    'cnn_calls': 'Batches classified by a CNN',
+    'alternative_rows': 'Rows with more than one valid solution',
+    'combinations_tried': 'Combinations of alternative rows verified with the checksum',
+    'cache_hits': 'Results (header, decoded rows, data) found in the result cache',
+}
+
+
+class Metrics:
+    """
+        Collects the stage timings and counters of the decoding pipeline.
+        One record is created per strip, the records can be exported as
+        JSON lines or in the Prometheus text format.
+    """
+    def __init__(self, callback=None):
+        """
+            callback: optional function which receives each record
+                      as soon as a strip is finished
+        """
+        self.callback = callback
+        self.records = []
+        self.record = None
+        self.stage = None
+        self.stage_start = None
+
+    def start_strip(self, path):
+        self.record = {'path': path, 'status': None, 'stages': {}, 'counters': {}}
+        self.stage = None
+
+    def start_stage(self, stage):
+        """
+            Stops the timer of the current stage and starts the next one
+        """
+        now = time.perf_counter()
+        self.stop_stage(now)
+        self.stage = stage
+        self.stage_start = now
+
+    def stop_stage(self, now=None):
+        if self.stage is None:
+            return
+        if now is None:
+            now = time.perf_counter()
+        stages = self.record['stages']
+        stages[self.stage] = stages.get(self.stage, 0.0) + now - self.stage_start
+        self.stage = None
+
+    def count(self, name, value=1):
+        counters = self.record['counters']
+        counters[name] = counters.get(name, 0) + value
+
+    def finish_strip(self, status, error=None):
+        """
+            status: 'valid', 'invalid', 'timeout' or 'error'
+            error: message of the exception which stopped the strip
+        """
+        self.stop_stage()
+        self.record['status'] = status
+        if error is not None:
+            self.record['error'] = error
+        self.records.append(self.record)
+        if self.callback is not None:
+            self.callback(self.record)
+        self.record = None
+
+    def add_records(self, records):
+        """
+            Adds the records which were collected in another process
+        """
+        for record in records:
+            self.records.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def to_json_lines(self):
+        return ''.join(json.dumps(record) + '\n' for record in self.records)
+
+    def to_prometheus(self):
+        """
+            Aggregates all records into Prometheus counters
+        """
+        strips = {}
+        stages = {}
+        counters = {}
+        for record in self.records:
+            strips[record['status']] = strips.get(record['status'], 0) + 1
+            for stage, seconds in record['stages'].items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+            for name, value in record['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+
+        lines = []
+        name = METRICS_PREFIX + 'strips_total'
+        lines.append('# HELP ' + name + ' Decoded strips by result')
+        lines.append('# TYPE ' + name + ' counter')
+        for status in sorted(strips):
+            lines.append(name + '{status="' + str(status) + '"} ' + str(strips[status]))
+        name = METRICS_PREFIX + 'stage_seconds_total'
+        lines.append('# HELP ' + name + ' Time spent in each stage of the decoding pipeline')
+        lines.append('# TYPE ' + name + ' counter')
+        for stage in sorted(stages):
+            lines.append(name + '{stage="' + stage + '"} ' + repr(stages[stage]))
+        for counter in sorted(counters):
+            name = METRICS_PREFIX + counter + '_total'
+            lines.append('# HELP ' + name + ' ' + COUNTERS.get(counter, counter))
+            lines.append('# TYPE ' + name + ' counter')
+            lines.append(name + ' ' + str(counters[counter]))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename, metrics_format=JSON_LINES_FORMAT):
+        if metrics_format == PROMETHEUS_FORMAT:
+            content = self.to_prometheus()
+        else:
+            content = self.to_json_lines()
+        with open(filename, 'w') as f:
+            f.write(content)
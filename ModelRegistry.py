@@ -0,0 +1,74 @@
+import pickle
+import threading
+
+
+class SharedModel:
+    """
+        A loaded Keras model which can be used by several decoders and
+        threads. TensorFlow graphs are bound to the thread which created
+        them, so every prediction runs in the graph of the model.
+        The predict function is built when the model is loaded and the
+        TensorFlow session runs concurrent predictions, so the threads
+        don't wait for each other.
+    """
+    def __init__(self, model, graph):
+        self.model = model
+        self.graph = graph
+
+    def predict(self, batch):
+        with self.graph.as_default():
+            return self.model.predict(batch)
+
+
+class ModelRegistry:
+    """
+        Process-wide registry of the CNNs. Each CNN (model, weights and
+        labels) is only loaded once and shared by all decoders and threads.
+    """
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def load(self, model_filename, weight_filename, label_filename):
+        """
+            Returns the model and the labels, the CNN is loaded
+            on the first call
+        """
+        key = (model_filename, weight_filename, label_filename)
+        # Fast path without locking once the CNN is loaded
+        cnn = self.models.get(key)
+        if cnn is None:
+            with self.lock:
+                cnn = self.models.get(key)
+                if cnn is None:
+                    cnn = self.read_cnn(model_filename, weight_filename, label_filename)
+                    self.models[key] = cnn
+        return cnn
+
+    def read_cnn(self, model_filename, weight_filename, label_filename):
+        """
+            Configures the CNN:
+            - Loads model
+            - Loads weights
+            - Loads labels
+        """
+        # Keras (and TensorFlow) is imported on demand, so the
+        # algorithmic pipeline runs without it
+        from keras import backend
+        from keras.models import model_from_json
+        with open(label_filename, 'rb') as f:
+            labels = pickle.load(f)
+        with open(model_filename, 'r') as f:
+            model = model_from_json(f.read())
+        model.load_weights(weight_filename)
+        # Builds the predict function now, it can't be created lazily
+        # by several threads at the same time
+        model._make_predict_function()
+        return SharedModel(model, backend.get_session().graph), labels
+
+    def clear(self):
+        with self.lock:
+            self.models = {}
+
+
+MODEL_REGISTRY = ModelRegistry()
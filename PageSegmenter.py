@@ -0,0 +1,275 @@
+import argparse
+import os
+import re
+import cv2
+import numpy as np
+
+from Binarization import binarize, OTSU_BINARIZATION
+from SoftstripDecoder import SoftstripDecoder, threshold_strip
+from SoftstripMatrix import SoftstripMatrix
+from HeaderExtractor import HeaderExtractor
+from AlgorithmicRowExtractor import AlgorithmicRowExtractor
+from AlgorithmicRowDecoder import AlgorithmicRowDecoder
+from DataExtractor import DataExtractor
+from DataFieldHelper import parse_strip_id
+
+# The dark areas are closed with a kernel of CLOSING_FRACTION of the page
+# width, so the bars of a strip merge into one region but neighbouring
+# strips and text lines stay separated
+CLOSING_FRACTION = 0.005
+MIN_CLOSING_SIZE = 9
+# The kernel also covers CLOSING_BAR_WIDTHS times the median bar width,
+# which bridges the widest space within a strip (before the rack)
+CLOSING_BAR_WIDTHS = 4
+MIN_STRIP_WIDTH_FRACTION = 0.03
+# Strips are at least MIN_ASPECT_RATIO times higher than wide
+MIN_ASPECT_RATIO = 1.0
+# Median number of black/white transitions per pixel line of a strip
+MIN_TRANSITIONS = 8
+# Fraction of the pixel lines whose start bar (rack) begins (ends)
+# in the same column
+MIN_ALIGNMENT = 0.8
+# The rows of a strip are decoded in chunks of HEADER_ROWS_CHUNK rows
+# until the strip id and the sequence number are found
+HEADER_ROWS_CHUNK = 8
+# Errors of the decoding pipeline on a crop which isn't a readable strip
+DECODE_ERRORS = (ValueError, IndexError, ZeroDivisionError)
+ALIGNMENT_TOLERANCE = 0.02
+# Strips with a smaller skew (degrees) are cropped without rotation
+MIN_SKEW = 0.1
+# Margin around a cropped strip relative to its width
+MARGIN_FRACTION = 0.03
+UNKNOWN_STRIP_ID = 'unknown'
+
+
+class PageSegmenter:
+    """
+        Finds all Softstrips on a scanned page, deskews and crops them.
+        Candidate regions are verified by the structure of a strip:
+        many bars per pixel line, a straight start bar on the left and
+        a straight rack on the right.
+    """
+    def __init__(self, page_img):
+        """
+            page_img: grayscale (or BGR) page scan
+        """
+        if page_img.ndim == 3:
+            page_img = cv2.cvtColor(page_img, cv2.COLOR_BGR2GRAY)
+        self.page_img = page_img
+
+    def segment(self):
+        """
+            Returns the grayscale images of all strips on the page
+            in reading order (left to right, top to bottom)
+        """
+        strips = []
+        for rect in self.find_candidates():
+            strip = self.crop_strip(rect)
+            if self.is_strip(strip):
+                strips.append((rect[0], strip))
+        strips.sort(key=lambda item: (item[0][0], item[0][1]))
+        return [strip for _, strip in strips]
+
+    def find_candidates(self):
+        """
+            Returns the rotated rectangles of all dark regions which
+            are large and tall enough for a strip
+        """
+        height, width = self.page_img.shape
+        dark = cv2.bitwise_not(binarize(self.page_img, OTSU_BINARIZATION))
+        size = max(MIN_CLOSING_SIZE, int(width * CLOSING_FRACTION),
+                   int(CLOSING_BAR_WIDTHS * self.determine_bar_width(dark)))
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+        closed = cv2.morphologyEx(dark, cv2.MORPH_CLOSE, kernel)
+        # [-2] works with the return values of OpenCV 3 and 4
+        contours = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        candidates = []
+        for contour in contours:
+            center, (rect_width, rect_height), angle = cv2.minAreaRect(contour)
+            short_side, long_side = sorted((rect_width, rect_height))
+            if short_side < width * MIN_STRIP_WIDTH_FRACTION or long_side < short_side * MIN_ASPECT_RATIO:
+                continue
+            candidates.append((center, (rect_width, rect_height), angle))
+        return candidates
+
+    def determine_bar_width(self, dark):
+        """
+            Returns the median length of the horizontal dark runs
+        """
+        padded = np.zeros((dark.shape[0], dark.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = dark > 0
+        changes = np.diff(padded.ravel())
+        lengths = np.flatnonzero(changes == -1) - np.flatnonzero(changes == 1)
+        if len(lengths) == 0:
+            return 0
+        return np.median(lengths)
+
+    def crop_strip(self, rect):
+        """
+            Deskews and crops the rotated rectangle with a white margin.
+            The strip keeps its scale, so the bars are only interpolated
+            if the strip has to be rotated.
+        """
+        center, _, _ = rect
+        skew, width, height = self.determine_skew(rect)
+        margin = width * MARGIN_FRACTION
+        width = int(round(width + 2 * margin))
+        height = int(round(height + 2 * margin))
+        if abs(skew) < MIN_SKEW:
+            left = int(round(center[0] - width / 2))
+            top = int(round(center[1] - height / 2))
+            matrix = np.float32([[1, 0, -left], [0, 1, -top]])
+            flags = cv2.INTER_NEAREST
+        else:
+            matrix = cv2.getRotationMatrix2D(center, skew, 1.0)
+            matrix[:, 2] += (width / 2 - center[0], height / 2 - center[1])
+            flags = cv2.INTER_LINEAR
+        return cv2.warpAffine(self.page_img, matrix, (width, height), flags=flags, borderValue=255)
+
+    def determine_skew(self, rect):
+        """
+            Returns the rotation (degrees, counter-clockwise) which aligns
+            the long side of the rectangle with the vertical, the width
+            and the height of the strip
+        """
+        corners = cv2.boxPoints(rect)
+        sides = [corners[1] - corners[0], corners[2] - corners[1]]
+        lengths = [np.hypot(*side) for side in sides]
+        long_side = sides[int(np.argmax(lengths))]
+        if long_side[1] < 0:
+            long_side = -long_side
+        skew = np.degrees(np.arctan2(-long_side[0], long_side[1]))
+        return skew, min(lengths), max(lengths)
+
+    def is_strip(self, strip):
+        """
+            Checks the structure of a strip: the pixel lines have many
+            bars, most of them start with the start bar and end with the
+            rack in the same columns
+        """
+        dark = binarize(strip, OTSU_BINARIZATION) == 0
+        lines = dark[dark.any(axis=1)]
+        if len(lines) == 0:
+            return False
+        transitions = np.count_nonzero(lines[:, 1:] != lines[:, :-1], axis=1)
+        if np.median(transitions) < MIN_TRANSITIONS:
+            return False
+        tolerance = max(1, strip.shape[1] * ALIGNMENT_TOLERANCE)
+        start_bar = np.argmax(lines, axis=1)
+        rack = lines.shape[1] - np.argmax(lines[:, ::-1], axis=1)
+        return self.is_aligned(start_bar, tolerance) and self.is_aligned(rack, tolerance)
+
+    def is_aligned(self, positions, tolerance):
+        return np.mean(np.abs(positions - np.median(positions)) <= tolerance) >= MIN_ALIGNMENT
+
+
+def read_strip_header(strip):
+    """
+        Decodes the first data rows of a strip with the algorithmic
+        pipeline and returns its strip id and sequence number (None if
+        they can't be decoded). The checksum is not verified.
+    """
+    try:
+        binary_img, gray_img = threshold_strip(strip)
+        softstrip_matrix = SoftstripMatrix(binary_img, gray_img)
+        header_extractor = HeaderExtractor(softstrip_matrix)
+        header_extractor.parse_header()
+        bits_count = header_extractor.get_bits_per_row()
+        grouped_matrix, _ = AlgorithmicRowExtractor(softstrip_matrix, bits_count).extract_rows()
+        # The data rows start with the vertical sync section, the rows
+        # of the horizontal sync section are skipped
+        grouped_matrix = [row for row in grouped_matrix
+                          if len(row) > 0 and row[0]['index'] >= header_extractor.vertical_sync_start]
+        rows = []
+        for start in range(0, len(grouped_matrix), HEADER_ROWS_CHUNK):
+            chunk = grouped_matrix[start:start + HEADER_ROWS_CHUNK]
+            rows += AlgorithmicRowDecoder(chunk, bits_count).decode_rows()
+            data_extractor = DataExtractor()
+            if data_extractor.extract_strip_header(rows):
+                return parse_strip_id(data_extractor.attributes['strip_id']), data_extractor.attributes['seq_no']
+    except DECODE_ERRORS:
+        return None
+    return None
+
+
+def group_strips(strips):
+    """
+        Groups the strips of one or more pages by their strip id and orders
+        each group by the sequence number. A repeated sequence number starts
+        a new file with the same strip id. Strips without a readable header
+        are returned as single strip groups.
+        Returns a list of (strip id, strips).
+    """
+    groups = []
+    for strip in strips:
+        header = read_strip_header(strip)
+        if header is None:
+            groups.append((UNKNOWN_STRIP_ID, {0: strip}))
+            continue
+        strip_id, seq_no = header
+        for group_id, group in groups:
+            if group_id == strip_id and seq_no not in group:
+                group[seq_no] = strip
+                break
+        else:
+            groups.append((strip_id, {seq_no: strip}))
+    return [(strip_id, [group[seq_no] for seq_no in sorted(group)]) for strip_id, group in groups]
+
+
+def segment_pages(paths):
+    """
+        Segments the page scans and returns the grouped strips of all pages
+    """
+    strips = []
+    for path in paths:
+        page_img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if page_img is None:
+            raise ValueError('Cannot read ' + path)
+        page_strips = PageSegmenter(page_img).segment()
+        print(path + ': ' + str(len(page_strips)) + ' strips')
+        strips += page_strips
+    return group_strips(strips)
+
+
+def threshold_strips(strip_id, strips):
+    """
+        Lazily thresholds the strips of a group for SoftstripDecoder
+    """
+    for seq_no, strip in enumerate(strips):
+        binary_img, gray_img = threshold_strip(strip)
+        yield strip_id + ' ' + str(seq_no + 1), binary_img, gray_img
+
+
+def save_groups(groups, output_dir):
+    """
+        Saves the strips as <strip id>_<n>_<sequence>.png, so the output
+        directory can be decoded with the batch mode of SoftstripDecoder
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for n, (strip_id, strips) in enumerate(groups):
+        name = re.sub(r'[^A-Za-z0-9]+', '', strip_id) or UNKNOWN_STRIP_ID
+        group_paths = []
+        for seq_no, strip in enumerate(strips):
+            path = os.path.join(output_dir, name + '_' + str(n + 1) + '_' + str(seq_no + 1) + '.png')
+            cv2.imwrite(path, strip)
+            group_paths.append(path)
+        paths.append(group_paths)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Softstrip Page Segmenter')
+    parser.add_argument('pages', nargs='+', help='scanned pages')
+    parser.add_argument('--output', default='strips', help='directory for the cropped strips')
+    parser.add_argument('--decode', metavar='DIR', help='decode the strips into this directory')
+    args = parser.parse_args()
+    groups = segment_pages(args.pages)
+    for group_paths in save_groups(groups, args.output):
+        print('SAVE: ' + ' '.join(group_paths))
+    if args.decode is not None:
+        for strip_id, strips in groups:
+            try:
+                SoftstripDecoder(threshold_strips(strip_id, strips), output_dir=args.decode)
+            except Exception as e:
+                print(e)
@@ -4,8 +4,10 @@ from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 import imutils
 import copy
+import yaml
 from SoftstripImage import SoftstripImage
-from SoftstripDecoder import SoftstripDecoder
+from SoftstripDecoder import SoftstripDecoder, CONFIG_FILENAME
+from Binarization import FIXED_BINARIZATION
 
 INCREASE = 1
 DECREASE = -1
@@ -15,6 +17,27 @@ IMG_RESIZE = 50
 PEN_SIZE = 10
 MINIATURE_WIDTH = 400
 DEGREE = 90
+WINDOW_TITLE = 'Cauzin Softstrip Reader'
+
+
+class DecodeThread(QThread):
+    """
+        Decodes the Softstrips outside of the UI thread. The progress
+        events of the decoder are forwarded as signal.
+    """
+    progress = pyqtSignal(dict)
+    decoded = pyqtSignal(str)
+
+    def __init__(self, strips):
+        super(DecodeThread, self).__init__()
+        self.strips = strips
+
+    def run(self):
+        try:
+            decoder = SoftstripDecoder(self.strips, progress=self.progress.emit)
+            self.decoded.emit(str(decoder.strip_meta_info))
+        except Exception as e:
+            self.decoded.emit(str(e))
 
 
 class SoftstripGui(QWidget):
@@ -146,7 +169,7 @@ class SoftstripGui(QWidget):
         v_layout.addLayout(h_softstrip_btn_layout)
 
         self.setLayout(v_layout)
-        self.setWindowTitle('Cauzin Softstrip Reader')
+        self.setWindowTitle(WINDOW_TITLE)
         self.showMaximized()
 
     def create_scroll_area(self):
@@ -322,14 +345,32 @@ class SoftstripGui(QWidget):
         msg.exec_()
 
     def extract_data(self, event):
-        self.softstrip_img.autocrop()
-        binary_imgs = [self.softstrip_img.binary_img]
-        paths = [self.softstrip_img.path]
-        gray_imgs = [self.softstrip_img.gray_img]
-        decoder = SoftstripDecoder(imgs=binary_imgs, paths=paths, gray_imgs=gray_imgs)
+        self.extract_btn.setEnabled(False)
+        # The image is cropped in the UI thread, the decode thread
+        # only receives copies of the arrays
+        self.softstrip_img.autocrop(self.load_binarization())
+        strips = [(self.softstrip_img.path, self.softstrip_img.binary_img.copy(), self.softstrip_img.gray_img.copy())]
+        self.decode_thread = DecodeThread(strips)
+        self.decode_thread.progress.connect(self.show_progress)
+        self.decode_thread.decoded.connect(self.show_decoding_result)
+        self.decode_thread.start()
+
+    def load_binarization(self):
+        with open(CONFIG_FILENAME, 'r') as f:
+            return yaml.load(f).get('binarization', FIXED_BINARIZATION)
+
+    def show_progress(self, event):
+        if event['event'] == 'rows_decoded':
+            self.setWindowTitle(WINDOW_TITLE + ' - ' + str(event['decoded']) + '/' + str(event['rows']) + ' rows decoded')
+        elif event['event'] == 'header':
+            self.setWindowTitle(WINDOW_TITLE + ' - header parsed')
+
+    def show_decoding_result(self, text):
         #self.softstrip_img.convert_to_grayscale()
+        self.setWindowTitle(WINDOW_TITLE)
+        self.extract_btn.setEnabled(True)
         self.update_canvas()
-        self.show_message_box(str(decoder.strip_meta_info), 'Decoding')
+        self.show_message_box(text, 'Decoding')
         
 
 app = QApplication(sys.argv)
@@ -0,0 +1,195 @@
+"""
+    On-disk cache of the decoding results in a SQLite database. The
+    entries are keyed by a hash of the strip pixels, the config options
+    which change the result and the versions of the CNN models.
+    The products of the stages are checkpoints as well: a decoding which
+    failed or timed out resumes after the last completed stage.
+"""
+import hashlib
+import io
+import os
+import pickle
+import sqlite3
+import time
+import numpy as np
+
+# Changes of the decoding pipeline which change the results
+# invalidate the cache by increasing CACHE_VERSION
+CACHE_VERSION = 2
+MODELS_DIR = 'nn/models'
+# Default maximum size of the cache in MB
+DEFAULT_CACHE_SIZE = 512
+# Seconds to wait for the database lock of another process
+LOCK_TIMEOUT = 30
+
+# Products of a strip which are cached
+HEADER_RESULT = 'header'
+GROUPED_ROWS_RESULT = 'grouped_rows'
+ROWS_RESULT = 'rows'
+DATA_RESULT = 'data'
+# Config options which change each product
+RESULT_OPTIONS = {
+    HEADER_RESULT: ['binarization'],
+    GROUPED_ROWS_RESULT: ['binarization', 'row_extractor'],
+    ROWS_RESULT: ['binarization', 'row_extractor', 'row_decoder'],
+    DATA_RESULT: ['binarization', 'row_extractor', 'row_decoder'],
+}
+
+
+def hash_pixels(gray_img):
+    """
+        Returns the content hash of a grayscale strip
+    """
+    digest = hashlib.sha256(str(gray_img.shape).encode('utf-8'))
+    digest.update(np.ascontiguousarray(gray_img).tobytes())
+    return digest.hexdigest()
+
+
+def encode_grouped_rows(grouped_matrix, gray_grouped_matrix, bits_count, vertical_sync_start):
+    """
+        Converts the output of a row extractor into arrays (see decode_grouped_rows):
+        the pixel lines of all rows, the number of lines per row and, for
+        the algorithmic row extractor, the pattern and the index of each line
+    """
+    binary_lines = [line['row'] if isinstance(line, dict) else line for row in grouped_matrix for line in row]
+    gray_lines = [line for row in gray_grouped_matrix for line in row]
+    line_info = [(line['pattern'], line['index']) for row in grouped_matrix for line in row
+                 if isinstance(line, dict)]
+    return {
+        'header': np.array([bits_count, vertical_sync_start], dtype=np.int64),
+        'binary_lines': np.array(binary_lines, dtype=np.uint8),
+        'gray_lines': np.array(gray_lines, dtype=np.uint8),
+        'row_lengths': np.array([len(row) for row in grouped_matrix], dtype=np.int32),
+        'gray_row_lengths': np.array([len(row) for row in gray_grouped_matrix], dtype=np.int32),
+        'line_info': np.array(line_info, dtype=np.int32).reshape(-1, 2),
+    }
+
+
+def decode_grouped_rows(arrays):
+    """
+        Rebuilds the output of a row extractor from encode_grouped_rows.
+        Returns the binary and the grayscale grouped matrix, the number
+        of bits per row and the start of the vertical sync.
+    """
+    binary_lines = arrays['binary_lines']
+    line_info = arrays['line_info'].tolist()
+    if len(line_info) > 0:
+        binary_lines = [{'pattern': pattern, 'index': index, 'row': binary_lines[i]}
+                        for i, (pattern, index) in enumerate(line_info)]
+    grouped_matrix = split_rows(binary_lines, arrays['row_lengths'])
+    gray_grouped_matrix = split_rows(arrays['gray_lines'], arrays['gray_row_lengths'])
+    bits_count, vertical_sync_start = arrays['header'].tolist()
+    return grouped_matrix, gray_grouped_matrix, int(bits_count), int(vertical_sync_start)
+
+
+def split_rows(lines, row_lengths):
+    ends = np.cumsum(row_lengths).tolist()
+    starts = [0] + ends[:-1]
+    return [lines[start:end] for start, end in zip(starts, ends)]
+
+
+def determine_model_version(models_dir=MODELS_DIR):
+    """
+        The size and the modification time of all model files. Retrained
+        models change the version and therefore the keys.
+    """
+    if not os.path.isdir(models_dir):
+        return ''
+    version = []
+    for filename in sorted(os.listdir(models_dir)):
+        stat = os.stat(os.path.join(models_dir, filename))
+        version.append(filename + ':' + str(stat.st_size) + ':' + str(int(stat.st_mtime)))
+    return ','.join(version)
+
+
+class ResultCache:
+    """
+        Stores the header, the grouped rows, the decoded rows and the
+        data of each strip.
+        The least recently used entries are evicted as soon as the cache
+        exceeds its maximum size. The database can be shared by several
+        processes (e.g. the workers of the batch mode).
+    """
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        """
+            path: SQLite database, it is created if it doesn't exist
+            max_size: maximum size of the cached values in MB
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_size = max_size * 1024 * 1024
+        self.model_version = determine_model_version()
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                    'key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+
+    def create_key(self, pixel_hash, config, result, first_strip=False):
+        """
+            Key of a product of the strip with the pixel_hash
+            (see hash_pixels) for the options of the config
+        """
+        parts = [str(CACHE_VERSION), result, pixel_hash]
+        parts += [option + '=' + str(config.get(option)) for option in RESULT_OPTIONS[result]]
+        if result != HEADER_RESULT:
+            parts.append(self.model_version)
+        if result == DATA_RESULT:
+            parts.append('first_strip=' + str(first_strip))
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+            Returns the cached value or None
+        """
+        with self.connection:
+            row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def get_arrays(self, key):
+        """
+            Returns the cached arrays (see put_arrays) or None
+        """
+        value = self.get(key)
+        if value is None:
+            return None
+        with np.load(io.BytesIO(value)) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def put_arrays(self, key, arrays):
+        """
+            Stores a dict of arrays in the compressed NPZ format
+        """
+        value = io.BytesIO()
+        np.savez_compressed(value, **arrays)
+        self.put(key, value.getvalue())
+
+    def put(self, key, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                    (key, value, len(value), time.time()))
+            self.evict()
+
+    def evict(self):
+        """
+            Removes the least recently used entries until the cache
+            fits into its maximum size
+        """
+        size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if size <= self.max_size:
+            return
+        evicted = []
+        for key, entry_size in self.connection.execute('SELECT key, size FROM results ORDER BY last_used'):
+            if size <= self.max_size:
+                break
+            evicted.append((key,))
+            size -= entry_size
+        self.connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+    def close(self):
+        self.connection.close()
@@ -1,24 +1,47 @@
+import numpy as np
+
+
 class RowComponents:
     """
         Collects information about all pixel lines which are necessary
-        for the header processing.
+        for the header processing. The color runs (components) of each
+        line are read from the RunLengthIndex of the Softstrip.
     """
-    def __init__(self, pixel_matrix):
+    def __init__(self, run_length_index):
         self.components = []
         self.all_min_sizes = []
         self.all_max_sizes = []
         self.all_avg_sizes = []
         self.all_counts = []
         self.last_element_sizes = []
-        self.process_pixel_matrix(pixel_matrix)
+        self.process_pixel_matrix(run_length_index)
 
-    def process_pixel_matrix(self, pixel_matrix):
-        last_component = {'index': -1, 'value': -1, 'size': 0}
-        for index, row in enumerate(pixel_matrix):
-            self.process_row(row, last_component, index)
-            last_component = {'value': -1, 'size': 0}
+    def process_pixel_matrix(self, run_length_index):
+        counts = run_length_index.run_counts()
+        min_sizes, max_sizes = self.determine_min_max_sizes(run_length_index, counts)
+        for index in np.flatnonzero(counts > 1):
+            self.process_row(run_length_index, index, int(counts[index]), min_sizes[index], max_sizes[index])
         self.normalize_meta_info()
 
+    def determine_min_max_sizes(self, run_length_index, counts):
+        """
+            Determines the minimum and maximum run length of each line.
+            The last run of a line is not part of the sizes, a line with
+            a single run has the minimum size len(row) and maximum size 0.
+        """
+        min_sizes = np.full(len(counts), run_length_index.width, np.int64)
+        max_sizes = np.zeros(len(counts), np.int64)
+        has_runs = counts > 0
+        if has_runs.any():
+            first_runs = run_length_index.offsets[:-1][has_runs]
+            last_runs = run_length_index.offsets[1:][has_runs] - 1
+            lengths = run_length_index.lengths.copy()
+            lengths[last_runs] = run_length_index.width
+            min_sizes[has_runs] = np.minimum.reduceat(lengths, first_runs)
+            lengths[last_runs] = 0
+            max_sizes[has_runs] = np.maximum.reduceat(lengths, first_runs)
+        return min_sizes.tolist(), max_sizes.tolist()
+
     def normalize_meta_info(self):
         max_max_size = max(self.all_max_sizes)
         min_max_size = min(self.all_max_sizes)
@@ -34,40 +57,33 @@ class RowComponents:
             row['avg_size'] = (row['avg_size'] - min_avg_size) / float((max_avg_size - min_avg_size))
             row['count'] = (row['count'] - min_count) / float((max_count - min_count))
 
-    def remove_overhead(self, row_components, components_count):
-        if row_components[0]['value'] == 0:
-            del row_components[0]
+    def remove_overhead(self, values, first, last, components_count):
+        """
+            Removes a leading white run, first..last-1 are the
+            remaining runs of the line
+        """
+        if values[first] == 0:
+            first += 1
             components_count -= 1
-        if len(row_components) > 1 and row_components[0]['value'] == 0:
-            del row_components[-1]
+        if last - first > 1 and values[first] == 0:
+            last -= 1
             components_count -= 1
-        return row_components, components_count
+        return first, last, components_count
 
-    def process_row(self, row, component, index):
-        components_count = 0
-        row_components = []
-        min_size = len(row)
-        max_size = 0
-        for item in row:
-            if item == component['value']:
-                component['size'] += 1
-            elif component['value'] == -1:
-                component['value'] = item
-                component['size'] = 1
-            else:
-                if component['size'] < min_size:
-                    min_size = component['size']
-                if component['size'] > max_size:
-                    max_size = component['size']
-                components_count += 1
-                row_components.append(component)
-                component = {'index': index,'value': item, 'size': 1}
-        components_count += 1
-        if components_count > 1:
-                row_components, components_count = self.remove_overhead(row_components, components_count)
-                self.all_min_sizes.append(min_size)
-                self.all_max_sizes.append(max_size)
-                self.all_counts.append(components_count)
-                self.all_avg_sizes.append(len(row)/float(components_count))
-                self.last_element_sizes.append(row_components[-1]['size'])
-                self.components.append({'max_size': max_size, 'min_size': min_size, 'avg_size': len(row)/float(components_count), 'count': components_count,'components': row_components})
+    def process_row(self, run_length_index, index, components_count, min_size, max_size):
+        """
+            Collects the runs of a line. The last run is never completed,
+            so it is not one of the row components.
+        """
+        first = run_length_index.offsets[index]
+        last = run_length_index.offsets[index + 1] - 1
+        values = run_length_index.values
+        first, last, components_count = self.remove_overhead(values, first, last, components_count)
+        avg_size = run_length_index.width / float(components_count)
+        self.all_min_sizes.append(min_size)
+        self.all_max_sizes.append(max_size)
+        self.all_counts.append(components_count)
+        self.all_avg_sizes.append(avg_size)
+        self.last_element_sizes.append(int(run_length_index.lengths[last - 1]))
+        self.components.append({'max_size': max_size, 'min_size': min_size, 'avg_size': avg_size,
+                                'count': components_count, 'values': values[first:last]})
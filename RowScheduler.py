@@ -0,0 +1,133 @@
+"""
+    Decodes the rows of a strip concurrently. The rows are independent
+    once the strip is grouped, so each row is a task of a thread or
+    process pool and the results are returned in row order.
+"""
+import os
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# Threads for work which releases the GIL (OpenCV, TensorFlow),
+# processes for the pure Python decoding
+THREAD_SCHEDULER = 'threads'
+PROCESS_SCHEDULER = 'processes'
+# Starting a pool only pays off if every worker decodes a few rows
+MIN_ROWS_PER_WORKER = 8
+# Every process worker receives about CHUNKS_PER_WORKER chunks of rows
+CHUNKS_PER_WORKER = 4
+# Seconds between two checks of the caller while it waits for a row
+CHECK_INTERVAL = 0.1
+
+# Row function of a process worker, it is passed once per worker
+# instead of once per row
+worker_function = None
+
+
+def set_worker_function(function):
+    global worker_function
+    worker_function = function
+
+
+def call_worker_function(chunk):
+    return [worker_function(row) for row in chunk]
+
+
+def skip_check():
+    pass
+
+
+def determine_workers(workers):
+    """
+        workers: number of workers, 0 or None uses one worker per CPU
+    """
+    if not workers:
+        return os.cpu_count() or 1
+    return workers
+
+
+class RowScheduler:
+    """
+        Runs a row function on all rows of a strip with a pool of
+        workers. With a single worker (or only a few rows) the rows are
+        decoded sequentially without a pool.
+    """
+    def __init__(self, workers=1, scheduler=THREAD_SCHEDULER):
+        """
+            workers: number of threads/processes, 0 uses one per CPU
+            scheduler: THREAD_SCHEDULER or PROCESS_SCHEDULER
+        """
+        if scheduler not in (THREAD_SCHEDULER, PROCESS_SCHEDULER):
+            raise ValueError('Unknown row scheduler: ' + str(scheduler))
+        self.workers = determine_workers(workers)
+        self.scheduler = scheduler
+
+    def map(self, function, rows, check=None):
+        """
+            Generator which yields function(row) for all rows in row order.
+            Closing the generator (e.g. on an early abort of the caller)
+            cancels the rows which were not started yet. An exception of a
+            row (e.g. StageTimeout) is raised when its result is reached.
+            check: optional function (e.g. Deadline.check) which is called
+                   while waiting for a row, an exception of it stops the
+                   workers. Worker processes don't see a cancel event of
+                   the caller, so they are terminated instead.
+        """
+        rows = list(rows)
+        workers = min(self.workers, len(rows) // MIN_ROWS_PER_WORKER)
+        if check is None:
+            check = skip_check
+        if workers <= 1:
+            for row in rows:
+                check()
+                yield function(row)
+        elif self.scheduler == PROCESS_SCHEDULER:
+            for result in self.map_processes(function, rows, workers, check):
+                yield result
+        else:
+            for result in self.map_threads(function, rows, workers, check):
+                yield result
+
+    def map_threads(self, function, rows, workers, check):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(function, row) for row in rows]
+            try:
+                for future in futures:
+                    while True:
+                        check()
+                        try:
+                            result = future.result(CHECK_INTERVAL)
+                            break
+                        except TimeoutError:
+                            pass
+                    yield result
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def map_processes(self, function, rows, workers, check):
+        """
+            The function (usually a bound method of the decoder) is
+            inherited by the workers, only the rows are sent per task
+        """
+        chunk_size = max(1, len(rows) // (workers * CHUNKS_PER_WORKER))
+        chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+        pool = multiprocessing.Pool(workers, set_worker_function, (function,))
+        try:
+            # The chunks are sent one by one, so the results can be
+            # awaited with a timeout
+            results = pool.imap(call_worker_function, chunks)
+            for _ in chunks:
+                while True:
+                    check()
+                    try:
+                        chunk_results = results.next(CHECK_INTERVAL)
+                        break
+                    except multiprocessing.TimeoutError:
+                        pass
+                for result in chunk_results:
+                    yield result
+        finally:
+            # Stops the rows which are still decoded after an exception,
+            # a cancellation or an early abort
+            pool.terminate()
+            pool.join()
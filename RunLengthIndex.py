@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class RunLengthIndex:
+    """
+        Run-length encoding of all pixel lines of a binary matrix.
+        The runs of all lines are stored in flat arrays (start, length,
+        value and line of each run), the runs of line i are
+        offsets[i]..offsets[i + 1] - 1.
+    """
+    def __init__(self, starts, lengths, values, lines, offsets, width):
+        self.starts = starts
+        self.lengths = lengths
+        self.values = values
+        self.lines = lines
+        self.offsets = offsets
+        self.width = width
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """
+            Creates the index of a 2-D matrix with a single pass
+        """
+        matrix = np.asarray(matrix)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        line_count, width = matrix.shape
+        if width == 0:
+            empty = np.zeros(0, np.int64)
+            return cls(empty, empty, empty, empty, np.zeros(line_count + 1, np.int64), width)
+        run_start = np.ones(matrix.shape, bool)
+        run_start[:, 1:] = matrix[:, 1:] != matrix[:, :-1]
+        lines, starts = np.nonzero(run_start)
+        # The next run starts at column 0 if the run is the last of its line
+        next_starts = np.append(starts[1:], 0)
+        lengths = np.where(next_starts == 0, width, next_starts) - starts
+        offsets = np.zeros(line_count + 1, np.int64)
+        np.cumsum(np.bincount(lines, minlength=line_count), out=offsets[1:])
+        return cls(starts, lengths, matrix[lines, starts], lines, offsets, width)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def slice(self, start, end=None):
+        """
+            Returns the index of the lines start..end-1,
+            the run arrays are shared
+        """
+        if end is None:
+            end = len(self)
+        first = self.offsets[start]
+        last = self.offsets[end]
+        return RunLengthIndex(self.starts[first:last], self.lengths[first:last], self.values[first:last],
+                              self.lines[first:last] - start, self.offsets[start:end + 1] - first, self.width)
+
+    def line_runs(self, index):
+        """
+            Returns the starts, lengths and values of all runs of a line
+        """
+        first = self.offsets[index]
+        last = self.offsets[index + 1]
+        return self.starts[first:last], self.lengths[first:last], self.values[first:last]
+
+    def run_counts(self):
+        return np.diff(self.offsets)
+
+    def nth_run_start(self, value, n):
+        """
+            Returns the start of the n-th (1 = first) run with the value
+            for each line, -1 if a line has less runs with this value
+        """
+        matches, rank, _ = self.rank_runs(value)
+        positions = np.full(len(self), -1, np.int64)
+        selected = matches & (rank == n)
+        positions[self.lines[selected]] = self.starts[selected]
+        return positions
+
+    def last_run_end(self, value):
+        """
+            Returns the last pixel of the last run with the value
+            for each line, -1 if a line has no run with this value
+        """
+        matches, rank, total = self.rank_runs(value)
+        positions = np.full(len(self), -1, np.int64)
+        selected = matches & (rank == total[self.lines])
+        positions[self.lines[selected]] = self.starts[selected] + self.lengths[selected] - 1
+        return positions
+
+    def rank_runs(self, value):
+        """
+            Numbers the runs with the value in each line (1, 2, ...).
+            Returns the matching runs, their rank and the number of
+            matching runs per line.
+        """
+        matches = self.values == value
+        counted = np.zeros(len(matches) + 1, np.int64)
+        np.cumsum(matches, out=counted[1:])
+        before_line = counted[self.offsets[:-1]]
+        total = counted[self.offsets[1:]] - before_line
+        rank = counted[1:] - before_line[self.lines]
+        return matches, rank, total
@@ -1,6 +1,6 @@
 import sys
 import cv2
-import datetime
+import numpy as np
 import yaml
 import argparse
 import os
@@ -8,115 +8,356 @@ import os
 from DataExtractor import DataExtractor
 from HeaderExtractor import HeaderExtractor
 from SoftstripMatrix import SoftstripMatrix
-from CnnRowExtractor import CnnRowExtractor
-from AlgorithmicRowExtractor import AlgorithmicRowExtractor
-from CnnRowDecoder import CnnRowDecoder
-from AlgorithmicRowDecoder import AlgorithmicRowDecoder
+from Backends import *
+from Binarization import binarize, FIXED_BINARIZATION
+from Deadline import *
+from Metrics import Metrics, FORMATS, JSON_LINES_FORMAT
+from ResultCache import *
 
 CONFIG_FILENAME = 'config.yaml'
-CNN_ROW_DECODER = 1
-ALGO_ROW_DECODER = 0
-CNN_ROW_EXTRACTOR = 1
-ALGO_ROW_EXTRACTOR = 0
+# Grayscale page caches, see cache_strips
+PAGE_CACHE_EXTENSION = '.npy'
 
 
 class SoftstripDecoder:
     """
         Starts the decoding pipeline
     """
-    def __init__(self, imgs, paths=[], gray_imgs=[]):
+    def __init__(self, strips, output_dir='', cancel_event=None, metrics=None, row_workers=None, progress=None):
         """
             Decodes the Cauzin Softstrip:
-            imgs: array with binary images
-            paths: paths for the images
-            gray_imgs: grayscale images
+            strips: iterable of (path, binary image, grayscale image),
+                    e.g. read_strips(paths). The strips are consumed one
+                    by one, so only a single strip is held in memory.
+                    With a binarization other than 'fixed' in the config,
+                    the binary image is created again from the grayscale image.
+            output_dir: directory for the decoded file
+            cancel_event: optional Event which aborts the decoding
+            metrics: optional Metrics which receives the stage timings
+                     and counters of each strip
+            row_workers: number of rows which are decoded at the same
+                         time, overrides row_workers of the config
+            progress: optional function which receives the progress
+                      events of each strip as dict (see report)
         """
         self.load_config()
-        self.data = []
-        self.start_time = datetime.datetime.now().replace(microsecond=0)
-        for i in range(len(imgs)):
-            path = paths.pop(0)
-            gray_img = gray_imgs.pop(0)
-            img = imgs.pop(0)
-            self.gray_img = gray_img
-            self.path = path
-            if i == 0:
-                self.decode(img, True)
-            else:
-                self.decode(img, False)
-        self.save_data()
+        # Number of decoded bytes, the data is written to the output
+        # file strip by strip
+        self.data_length = 0
+        self.output_file = None
+        self.valid = True
+        self.timeout = None
+        self.strip_meta_info = None
+        self.output_filename = None
+        self.output_dir = output_dir
+        self.deadline = Deadline(self.config['timeout'], cancel_event)
+        self.binarization = self.config.get('binarization', FIXED_BINARIZATION)
+        if row_workers is None:
+            row_workers = self.config.get('row_workers', 1)
+        self.row_workers = row_workers
+        self.cache = None
+        if self.config.get('result_cache'):
+            self.cache = ResultCache(self.config['result_cache'],
+                                     self.config.get('result_cache_size', DEFAULT_CACHE_SIZE))
+        self.metrics = metrics
+        self.progress = progress
+        self.path = None
+        try:
+            for i, (path, img, gray_img) in enumerate(strips):
+                self.path = path
+                self.report('strip_started', strip=i)
+                if self.metrics is not None:
+                    self.metrics.start_strip(path)
+                try:
+                    strip_valid = self.decode(img, gray_img, path, i == 0)
+                except StageTimeout as e:
+                    # Structured timeout result: e.stage, e.budget, e.cancelled
+                    self.valid = False
+                    self.timeout = e
+                    print('[TIMEOUT] ' + path + ': ' + str(e))
+                    if self.metrics is not None:
+                        self.metrics.finish_strip('timeout')
+                    self.report('strip_finished', status='cancelled' if e.cancelled else 'timeout', stage=e.stage)
+                    break
+                except Exception as e:
+                    # The failed strip is still recorded
+                    if self.metrics is not None:
+                        self.metrics.finish_strip('error', str(e))
+                    self.report('strip_finished', status='error', error=str(e))
+                    raise
+                if self.metrics is not None:
+                    self.metrics.finish_strip('valid' if strip_valid else 'invalid')
+                self.report('strip_finished', status='valid' if strip_valid else 'invalid')
+                # Release the strip before the next one is loaded
+                del img, gray_img
+        finally:
+            self.save_data()
+            if self.cache is not None:
+                self.cache.close()
 
     def load_config(self):
         self.config = open(CONFIG_FILENAME, 'r')
         self.config = yaml.load(self.config)
 
+    def write_data(self, data):
+        """
+            Appends the data of a strip to the output file. The file is
+            opened as soon as the first strip provides the filename,
+            without a valid file header the data is dropped.
+        """
+        self.data_length += len(data)
+        if self.output_file is None:
+            if self.strip_meta_info is None:
+                return
+            fn = os.path.join(self.output_dir, self.strip_meta_info.filename)
+            self.output_filename = fn
+            if "/" in fn:
+                os.makedirs(os.path.dirname(fn), exist_ok=True)
+            self.output_file = open(fn, mode='wb')
+        self.output_file.write(data)
+
     def save_data(self):
-        fn = self.strip_meta_info.filename
-        print("SAVE: " + str(len(self.data)) + " BYTES AS " + fn)
-        if "/" in fn:
-            os.makedirs(os.path.dirname(fn), exist_ok=True)
-        with open(self.strip_meta_info.filename, mode='wb') as f:
-            f.write(bytearray(self.data))
-
-    def decode(self, img, first_strip=False):
-        softstrip_matrix = SoftstripMatrix(img, self.gray_img)
-        header_extractor = HeaderExtractor(softstrip_matrix)
-        header_extractor.parse_header()
-        vertical_sync_start = header_extractor.vertical_sync_start
-        self.bits_count = header_extractor.get_bits_per_row()
-
-        if self.config['row_extractor'] == CNN_ROW_EXTRACTOR:
-            row_extractor = CnnRowExtractor(softstrip_matrix.grayscale_matrix, softstrip_matrix.binary_matrix, self.bits_count)
-            gray_grouped_matrix, grouped_matrix = row_extractor.extract_rows()
+        if self.output_file is None:
+            print('[ERROR] No valid file header found, nothing saved!')
+            return
+        self.output_file.close()
+        print("SAVE: " + str(self.data_length) + " BYTES AS " + self.output_filename)
+
+    def start_stage(self, stage):
+        self.deadline.start_stage(stage)
+        if self.metrics is not None:
+            self.metrics.start_stage(stage)
+
+    def count(self, name, value):
+        if self.metrics is not None:
+            self.metrics.count(name, value)
+
+    def report(self, event, **fields):
+        """
+            Sends a progress event of the current strip:
+            strip_started (strip), header (bits_per_row, vertical_sync_start),
+            rows_extracted (rows), rows_decoded (decoded, rows),
+            checksum (valid) and strip_finished (status)
+        """
+        if self.progress is not None:
+            fields['event'] = event
+            fields['path'] = self.path
+            self.progress(fields)
+
+    def report_decoded_rows(self, decoded, rows):
+        self.report('rows_decoded', decoded=decoded, rows=rows)
+
+    def decode(self, img, gray_img, path, first_strip=False):
+        """
+            Decodes a single strip and returns whether it is valid.
+            With a result cache, a strip which was already decoded with
+            the same config is only looked up.
+        """
+        self.start_stage(HEADER_STAGE)
+        pixel_hash = None
+        if self.cache is not None:
+            pixel_hash = hash_pixels(gray_img)
+            data_key = self.cache.create_key(pixel_hash, self.config, DATA_RESULT, first_strip)
+            result = self.cache.get(data_key)
+            if result is not None:
+                self.count('cache_hits', 1)
+                return self.apply_result(result, path, first_strip)
+
+        reduced_pixel_matrix = self.decode_rows(img, gray_img, pixel_hash)
+        if len(reduced_pixel_matrix) == 0:
+            result = {'valid': False, 'data': None, 'file_header': None}
         else:
-            row_extractor = AlgorithmicRowExtractor(softstrip_matrix, self.bits_count)
-            grouped_matrix, gray_grouped_matrix = row_extractor.extract_rows()
+            self.start_stage(CHECKSUM_SEARCH_STAGE)
+            data_extractor = DataExtractor(self.deadline)
+            data_extractor.extract_data(reduced_pixel_matrix, first_strip)
+            self.count('alternative_rows', len(data_extractor.alternative_rows))
+            self.count('combinations_tried', data_extractor.combinations_tried)
+            result = {'valid': data_extractor.valid, 'data': data_extractor.data,
+                      'file_header': data_extractor.file_header}
+        if self.cache is not None:
+            self.cache.put(data_key, result)
+        return self.apply_result(result, path, first_strip)
+
+    def decode_rows(self, img, gray_img, pixel_hash=None):
+        """
+            Runs the header extraction, the row extraction and the row
+            decoding and returns the decoded rows. If pixel_hash is passed,
+            the products of the stages are cached and the decoding resumes
+            after the last cached stage.
+        """
+        if pixel_hash is not None:
+            rows_key = self.cache.create_key(pixel_hash, self.config, ROWS_RESULT)
+            rows = self.cache.get(rows_key)
+            if rows is not None:
+                self.count('cache_hits', 1)
+                self.bits_count, reduced_pixel_matrix = rows
+                return reduced_pixel_matrix
 
-        if self.config['row_decoder'] == CNN_ROW_DECODER:
-            row_decoder = CnnRowDecoder(gray_grouped_matrix, self.start_time, self.bits_count, self.config['timeout'], vertical_sync_start)
-            reduced_pixel_matrix = row_decoder.decode_rows()
+        grouped_rows = None
+        if pixel_hash is not None:
+            grouped_key = self.cache.create_key(pixel_hash, self.config, GROUPED_ROWS_RESULT)
+            grouped_rows = self.cache.get_arrays(grouped_key)
+        if grouped_rows is None:
+            grouped_matrix, gray_grouped_matrix, vertical_sync_start = self.extract_grouped_rows(img, gray_img,
+                                                                                                 pixel_hash)
+            if pixel_hash is not None:
+                self.cache.put_arrays(grouped_key, encode_grouped_rows(grouped_matrix, gray_grouped_matrix,
+                                                                       self.bits_count, vertical_sync_start))
         else:
-            row_decoder = AlgorithmicRowDecoder(grouped_matrix, self.bits_count, self.start_time, self.config['timeout'])
-            reduced_pixel_matrix = row_decoder.decode_rows()
+            # Resumes at the row decoding
+            self.count('cache_hits', 1)
+            grouped_matrix, gray_grouped_matrix, self.bits_count, vertical_sync_start = \
+                decode_grouped_rows(grouped_rows)
+            self.report('header', bits_per_row=self.bits_count, vertical_sync_start=vertical_sync_start)
+            self.report('rows_extracted', rows=len(grouped_matrix))
 
-        if len(reduced_pixel_matrix) == 0:
-            print('[ERROR] ' + self.path + ' is invalid!')
+        self.start_stage(ROW_DECODING_STAGE)
+        row_decoder = create_row_decoder(self.config['row_decoder'], grouped_matrix, gray_grouped_matrix,
+                                         self.bits_count, vertical_sync_start, self.deadline, self.row_workers,
+                                         self.report_decoded_rows if self.progress is not None else None)
+        reduced_pixel_matrix = row_decoder.decode_rows()
+        self.count('cnn_calls', getattr(row_decoder, 'cnn_calls', 0))
+        self.count('bfs_nodes', getattr(row_decoder, 'bfs_nodes', 0))
+        self.count('decoded_rows', len(reduced_pixel_matrix))
+        if pixel_hash is not None:
+            self.cache.put(rows_key, (self.bits_count, reduced_pixel_matrix))
+        return reduced_pixel_matrix
+
+    def extract_grouped_rows(self, img, gray_img, pixel_hash=None):
+        """
+            Runs the header extraction and the row extraction and returns
+            the binary and the grayscale grouped matrix and the start of
+            the vertical sync
+        """
+        if self.binarization != FIXED_BINARIZATION:
+            img = binarize(gray_img, self.binarization)
+        softstrip_matrix = SoftstripMatrix(img, gray_img)
+        header = None
+        if pixel_hash is not None:
+            header_key = self.cache.create_key(pixel_hash, self.config, HEADER_RESULT)
+            header = self.cache.get(header_key)
+        if header is None:
+            header_extractor = HeaderExtractor(softstrip_matrix, self.deadline)
+            header_extractor.parse_header()
+            header = (header_extractor.get_bits_per_row(), header_extractor.vertical_sync_start)
+            if pixel_hash is not None:
+                self.cache.put(header_key, header)
         else:
-            data_extractor = DataExtractor(self.config['timeout'])
-            data_extractor.extract_data(reduced_pixel_matrix, first_strip, self.start_time)
+            self.count('cache_hits', 1)
+        self.bits_count, vertical_sync_start = header
+        self.report('header', bits_per_row=self.bits_count, vertical_sync_start=vertical_sync_start)
 
-            self.data += data_extractor.data
+        self.start_stage(ROW_EXTRACTION_STAGE)
+        # The backends are imported on demand, the CNNs (and Keras)
+        # are only loaded if the config selects them
+        row_extractor = create_row_extractor(self.config['row_extractor'], softstrip_matrix, self.bits_count, self.deadline)
+        grouped_matrix, gray_grouped_matrix = row_extractor.extract_grouped_rows()
+        self.count('cnn_calls', getattr(row_extractor, 'cnn_calls', 0))
+        self.count('rows', len(grouped_matrix))
+        self.report('rows_extracted', rows=len(grouped_matrix))
+        return grouped_matrix, gray_grouped_matrix, vertical_sync_start
+
+    def apply_result(self, result, path, first_strip):
+        """
+            Reports the result of a strip and writes its data
+        """
+        self.report('checksum', valid=result['valid'])
+        if result['data'] is None:
+            self.valid = False
+            print('[ERROR] ' + path + ' is invalid!')
+            return False
+        if result['valid']:
+            print('Checksum valid!')
+            if first_strip:
+                self.strip_meta_info = result['file_header']
+                print(self.strip_meta_info)
+        else:
+            self.valid = False
+            print('Checksum invalid!')
+        self.write_data(result['data'])
+        return result['valid']
+
+
+def read_strip(path):
+    """
+        Reads a Softstrip image and returns the binary and
+        the grayscale image. The image is read as grayscale,
+        page caches (.npy) are memory-mapped.
+    """
+    if path.lower().endswith(PAGE_CACHE_EXTENSION):
+        gray_img = np.load(path, mmap_mode='r')
+    else:
+        gray_img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray_img is None:
+        raise ValueError('Cannot read ' + path)
+    return threshold_strip(gray_img)
+
+
+def threshold_strip(img, binarization=FIXED_BINARIZATION):
+    """
+        Converts a grayscale (or BGR) Softstrip image to the binary and
+        the grayscale image. Both are single-channel uint8 images.
+        binarization: method of Binarization
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return binarize(img, binarization), img
+
+
+def cache_strips(paths, cache_dir):
+    """
+        Writes the grayscale images of the strips as page caches (.npy),
+        which are memory-mapped when they are decoded
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_paths = []
+    for path in paths:
+        _, gray_img = read_strip(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        cache_path = os.path.join(cache_dir, name + PAGE_CACHE_EXTENSION)
+        np.save(cache_path, np.ascontiguousarray(gray_img))
+        cache_paths.append(cache_path)
+    return cache_paths
+
+
+def read_strips(paths):
+    """
+        Lazily reads the Softstrip images. Each strip is only read
+        when the decoder requests it.
+    """
+    for path in paths:
+        # No local keeps the previous strip alive while the next one is read
+        yield (path,) + read_strip(path)
 
-            
-            if data_extractor.valid:
-                print('Checksum valid!')
-                if first_strip:
-                    self.strip_meta_info = data_extractor.file_header
-                    print(self.strip_meta_info)
-            else:
-                print('Checksum invalid!')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Softstrip Decoder')
-    parser.add_argument('paths', nargs='+')
-    if len(sys.argv) == 1:
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--batch', help='directory or manifest with the strips of many files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--output', default='', help='directory for the decoded files')
+    parser.add_argument('--metrics', help='file for the stage timings and counters')
+    parser.add_argument('--metrics-format', choices=FORMATS, default=JSON_LINES_FORMAT)
+    parser.add_argument('--cache', help='write grayscale page caches (.npy) of the strips to this directory')
+    args = parser.parse_args()
+    metrics = Metrics() if args.metrics is not None else None
+    if len(args.paths) == 0 and args.batch is None:
         parser.print_help(sys.stderr)
         sys.exit(1)
-    binary_imgs = []
-    gray_imgs = []
-    paths = []
-    strips = []
-    args = parser.parse_args()
-    for file in args.paths:
-        img = cv2.imread(file)
-        gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, binary_img = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY)
-
-        binary_imgs.append(binary_img)
-        gray_imgs.append(gray_img)
-        paths.append(file)
-    print(paths)
+    if args.cache is not None:
+        for cache_path in cache_strips(args.paths, args.cache):
+            print('CACHE: ' + cache_path)
+        sys.exit(0)
+    if args.batch is not None:
+        from BatchDecoder import BatchDecoder
+        BatchDecoder(args.batch, args.output, args.workers, metrics).run()
+        if metrics is not None:
+            metrics.save(args.metrics, args.metrics_format)
+        sys.exit(0)
+    print(args.paths)
     try:
-        decoder = SoftstripDecoder(imgs=binary_imgs, paths=paths, gray_imgs=gray_imgs)
+        decoder = SoftstripDecoder(read_strips(args.paths), output_dir=args.output, metrics=metrics)
     except Exception as e:
         print(e)
+    if metrics is not None:
+        metrics.save(args.metrics, args.metrics_format)
@@ -0,0 +1,209 @@
+import argparse
+import os
+import cv2
+import numpy as np
+
+from BitRow import BitRow
+
+# Size of a unit (half dibit) and of a row in inches
+UNIT_WIDTH = 0.008
+ROW_HEIGHT = 0.016
+HORIZONTAL_SYNC_HEIGHT = 0.05
+QUIET_ZONE = 0.03
+VERTICAL_SYNC_ROWS = 4
+STRIP_CAPACITY = 1024
+# Start bar, space, checkerboard and space, rack for both row patterns
+BLACK_WHITE_START = '11010'
+BLACK_WHITE_END = '00110'
+WHITE_BLACK_START = '11001'
+WHITE_BLACK_END = '00111'
+
+
+def calculate_checksum(data):
+    """
+        Same checksum as DataExtractor.calculate_checksum
+    """
+    c = 0
+    for byte in data:
+        c = ((c & 0xff) + byte + (c >> 8)) & 0x1ff
+    return (0x100 - ((c & 0xff) + (c >> 8))) & 0xff
+
+
+class SoftstripEncoder:
+    """
+        Renders Cauzin Softstrips from arbitrary payloads. The strips are
+        rendered as grayscale images and can be degraded with noise, skew
+        and blur to generate realistic test and benchmark data.
+    """
+    def __init__(self, nibbles=8, dpi=600, noise=0.0, skew=0.0, blur=0.0, seed=None,
+                 strip_capacity=STRIP_CAPACITY):
+        """
+            nibbles: number of nibbles per row (at least 3)
+            dpi: resolution of the rendered strips
+            noise: standard deviation of the gaussian noise in gray levels
+            skew: rotation of the strip in degrees
+            blur: sigma of the gaussian blur in pixels
+            seed: seed for the noise
+            strip_capacity: maximum number of payload bytes per strip
+        """
+        if nibbles < 3:
+            raise ValueError('At least 3 nibbles per row are required')
+        self.nibbles = nibbles
+        self.bits_per_row = 14 + nibbles * 8
+        self.dpi = dpi
+        self.noise = noise
+        self.skew = skew
+        self.blur = blur
+        self.random = np.random.RandomState(seed)
+        self.strip_capacity = strip_capacity
+
+    def encode(self, payload, filename, strip_id='CAUZIN', os_type=0x00, cauzin_filetype=0x00, os_filetype=0x00):
+        """
+            Splits the payload into strips and returns a list with
+            a grayscale image for each strip
+        """
+        payload = bytes(payload)
+        imgs = []
+        chunks = [payload[i:i + self.strip_capacity] for i in range(0, len(payload), self.strip_capacity)]
+        if len(chunks) == 0:
+            chunks = [b'']
+        for seq_no, chunk in enumerate(chunks):
+            first_strip = seq_no == 0
+            data = self.create_strip_bytes(chunk, filename, strip_id, seq_no + 1, first_strip,
+                                           len(payload), os_type, cauzin_filetype, os_filetype)
+            rows = self.create_rows(data)
+            imgs.append(self.render(rows))
+        return imgs
+
+    def create_strip_bytes(self, payload, filename, strip_id, seq_no, first_strip, file_length,
+                           os_type=0x00, cauzin_filetype=0x00, os_filetype=0x00):
+        """
+            Creates all bytes of a strip after the vertical
+            synchronization section:
+            data sync, expansion bytes, length, checksum, strip id,
+            sequence number, strip type, software expansion,
+            file header (first strip only) and the payload
+        """
+        strip_id = strip_id.encode('ascii')[:6].ljust(6, b' ')
+        body = list(strip_id) + [seq_no & 0xff, 0x00, 0x00, 0x00]
+        if first_strip:
+            body += [os_type, 1, cauzin_filetype, os_filetype]
+            body += list(file_length.to_bytes(3, 'little'))
+            body += list(filename.encode('ascii')) + [0x00, 0x00]
+        body += list(payload)
+        # The length includes the checksum byte
+        length = len(body) + 1
+        return [0x00, 0x00, 0x00] + list(length.to_bytes(2, 'little')) + [calculate_checksum(body)] + body
+
+    def create_rows(self, data):
+        """
+            Creates the rows (strings of units) for the vertical
+            synchronization section and the data bytes
+        """
+        data_bits_per_row = self.nibbles * 4
+        sync_bytes = [0xff] * (VERTICAL_SYNC_ROWS * data_bits_per_row // 8)
+        bits = []
+        for byte in sync_bytes + list(data):
+            for i in range(8):
+                bits.append((byte >> i) & 1)
+        bits += [0] * (-len(bits) % data_bits_per_row)
+
+        rows = []
+        for start in range(0, len(bits), data_bits_per_row):
+            # The first row after the horizontal sync section starts white-black
+            rows.append(self.create_row(bits[start:start + data_bits_per_row], len(rows) % 2 == 1))
+        return rows
+
+    def create_row(self, bits, black_white):
+        """
+            Creates a single row:
+            start bar, checkerboard, left parity, data, right parity, rack
+        """
+        left_parity = sum(bits[1::2]) % 2
+        right_parity = sum(bits[::2]) % 2
+        dibits = ''.join('01' if bit else '10' for bit in [left_parity] + bits + [right_parity])
+        if black_white:
+            row = BLACK_WHITE_START + dibits + BLACK_WHITE_END
+        else:
+            row = WHITE_BLACK_START + dibits + WHITE_BLACK_END
+        return BitRow.from_string(row)
+
+    def create_horizontal_sync(self):
+        """
+            The horizontal synchronization section encodes the number of
+            nibbles per row with 2 * nibbles - 5 dibit wide bars
+            (see HeaderExtractor.decode_nibbles)
+        """
+        bars = 2 * self.nibbles - 5
+        return ('110' + '1100' * bars).ljust(self.bits_per_row, '0')[:self.bits_per_row]
+
+    def render(self, rows):
+        """
+            Renders the horizontal synchronization section and all rows
+        """
+        unit_width = UNIT_WIDTH * self.dpi
+        row_height = ROW_HEIGHT * self.dpi
+        quiet_zone = int(round(QUIET_ZONE * self.dpi))
+        sync_height = int(round(HORIZONTAL_SYNC_HEIGHT * self.dpi))
+        edges = [int(round(quiet_zone + i * unit_width)) for i in range(self.bits_per_row + 1)]
+        row_edges = [int(round(sync_height + quiet_zone + i * row_height)) for i in range(len(rows) + 1)]
+        height = row_edges[-1] + quiet_zone
+        width = edges[-1] + quiet_zone
+        img = np.full((height, width), 255, np.uint8)
+
+        self.render_units(img, self.create_horizontal_sync(), quiet_zone, quiet_zone + sync_height, edges)
+        for i, row in enumerate(rows):
+            self.render_units(img, str(row), row_edges[i], row_edges[i + 1], edges)
+        return self.degrade(img)
+
+    def render_units(self, img, units, top, bottom, edges):
+        for i, unit in enumerate(units):
+            if unit == '1':
+                img[top:bottom, edges[i]:edges[i + 1]] = 0
+
+    def degrade(self, img):
+        """
+            Applies skew, blur and noise
+        """
+        if self.skew:
+            height, width = img.shape
+            matrix = cv2.getRotationMatrix2D((width / 2, height / 2), self.skew, 1.0)
+            img = cv2.warpAffine(img, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=255)
+        if self.blur:
+            img = cv2.GaussianBlur(img, (0, 0), self.blur)
+        if self.noise:
+            noisy = img.astype(np.float32) + self.random.normal(0, self.noise, img.shape)
+            img = np.clip(noisy, 0, 255).astype(np.uint8)
+        return img
+
+
+def save_strips(imgs, output_prefix):
+    """
+        Saves the strips as <output_prefix>1.png, <output_prefix>2.png, ...
+    """
+    paths = []
+    for i, img in enumerate(imgs):
+        path = output_prefix + str(i + 1) + '.png'
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Softstrip Encoder')
+    parser.add_argument('input', help='file which is encoded')
+    parser.add_argument('output_prefix', help='prefix of the generated strip images')
+    parser.add_argument('--nibbles', type=int, default=8)
+    parser.add_argument('--dpi', type=int, default=600)
+    parser.add_argument('--noise', type=float, default=0.0)
+    parser.add_argument('--skew', type=float, default=0.0)
+    parser.add_argument('--blur', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    with open(args.input, 'rb') as f:
+        payload = f.read()
+    encoder = SoftstripEncoder(args.nibbles, args.dpi, args.noise, args.skew, args.blur, args.seed)
+    strips = encoder.encode(payload, os.path.basename(args.input).upper())
+    print('\n'.join(save_strips(strips, args.output_prefix)))
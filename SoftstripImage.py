@@ -7,6 +7,7 @@ import numpy as np
 import imutils
 import copy
 from imutils import perspective
+from Binarization import binarize, FIXED_BINARIZATION
 
 
 INCREASE = 1
@@ -57,12 +58,15 @@ class SoftstripImage:
         self.cv2_img = imutils.rotate_bound(self.cv2_img, angle=angle)
         self._update_images()
 
-    def autocrop(self):
+    def autocrop(self, binarization=FIXED_BINARIZATION):
+        """
+            binarization: method of the binary image (see Binarization)
+        """
         gray_img = cv2.cvtColor(self.cv2_img, cv2.COLOR_BGR2GRAY)
         self.gray_img = gray_img
         blur = cv2.GaussianBlur(gray_img, (5,5), 0)
         ret, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-        _, self.binary_img = cv2.threshold(self.cv2_img, 127, 255, cv2.THRESH_BINARY)
+        self.binary_img = binarize(gray_img, binarization)
         thresh_not = cv2.bitwise_not(thresh)
         src, contours, hierarchy = cv2.findContours(thresh_not, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         while len(contours) > 1:
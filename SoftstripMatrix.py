@@ -1,5 +1,8 @@
 import cv2
-from collections import Counter
+import numpy as np
+
+from RunLengthIndex import RunLengthIndex
+
 
 class SoftstripMatrix:
     """
@@ -10,39 +13,50 @@ class SoftstripMatrix:
 
     def create_matrices(self, img, grayscale_img):
         """
-            Creates the following 2D matrices:
+            Creates the following 2D matrices (contiguous uint8 arrays):
             - binary
             - grayscale
+            and the run-length index of the binary matrix.
+            img is expected to be a thresholded (0/255) image.
         """
         # The dilated img has less noise in the start bar
         # so the binary matrix uses the start bar from the
         # dilated img instead of the original img
         dilated_img = self.create_dilated_img(img)
-        rows, columns, _ = img.shape
-        self.binary_matrix = []
-        self.grayscale_matrix = []
-        current_img = img
+        black = self.first_channel(img) == 0
+        dilated_black = self.first_channel(dilated_img) == 0
+        grayscale_img = np.asarray(grayscale_img)
+        rows, columns = black.shape
+        column_indices = np.arange(columns)
+
+        # Everything left of the first black pixel belongs to the quiet zone
+        has_black = dilated_black.any(axis=1)
+        start = np.argmax(dilated_black, axis=1)
+        # The start bar is taken from the dilated img up to (and including)
+        # its first white pixel, the rest of the line from the original img
+        after_start_bar = ~dilated_black & (column_indices >= start[:, None])
+        switch = np.where(after_start_bar.any(axis=1), np.argmax(after_start_bar, axis=1), columns)
+        line = np.where(column_indices < switch[:, None], True,
+                        np.where(column_indices == switch[:, None], False, black))
+        line &= column_indices >= start[:, None]
+
+        start = start[has_black]
+        line = line[has_black]
         last_black_pixel_position = 0
+        if len(line) > 0:
+            last_black_column = columns - 1 - np.argmax(line[:, ::-1], axis=1)
+            last_black_pixel_position = int(np.max(last_black_column - start))
+        self.normalize_matrices(line, grayscale_img[has_black], start, last_black_pixel_position)
+        self.run_length_index = RunLengthIndex.from_matrix(self.binary_matrix)
 
-        for row in range(rows):
-            current_img = dilated_img
-            binary_row = []
-            grayscale_row = []
-            for column in range(columns):
-                pixel = current_img[row, column]
-                if pixel[0] == 0:
-                    binary_row.append(1) # I know...a black pixel is supposed to be a 0
-                    grayscale_row.append(grayscale_img[row, column])
-                    if (len(binary_row) - 1) > last_black_pixel_position:
-                        last_black_pixel_position = len(binary_row) - 1
-                elif pixel[0] == 255:
-                    if len(binary_row) > 0: # Don't append pixels from the quiet zone
-                        current_img = img
-                        binary_row.append(0) # ... and white pixels are supposed to be 1s
-                        grayscale_row.append(grayscale_img[row, column])
-            self.binary_matrix.append(binary_row)
-            self.grayscale_matrix.append(grayscale_row)
-        self.normalize_matrices(last_black_pixel_position)
+    def first_channel(self, img):
+        """
+            Returns the first color channel of a (binary) image
+        """
+        img = np.asarray(img)
+        if img.ndim == 3:
+            return img[:, :, 0]
+        return img
 
     def create_dilated_img(self, img):
         """
@@ -54,37 +68,25 @@ class SoftstripMatrix:
         inverted_dilated = cv2.dilate(inverted, (5,5), iterations=3)
         dilated = cv2.bitwise_not(inverted_dilated)
         return dilated
-    
-    def normalize_matrices(self, last_black_pixel_position):
+
+    def normalize_matrices(self, line, grayscale_img, start, last_black_pixel_position):
         """
             Normalizes all rows so that they have all the same size
         """
-        # Remove all pixels after the last black pixel position
-        # If a row is too small, repeat the last pixel
-        avg_row_len = 0
-        for index, row in enumerate(self.binary_matrix):
-            if len(row) > 0:
-                del self.binary_matrix[index][(last_black_pixel_position + 1):]
-                del self.grayscale_matrix[index][(last_black_pixel_position + 1):]
-                while len(self.binary_matrix[index]) < (last_black_pixel_position + 1):
-                    self.binary_matrix[index].append(self.binary_matrix[index][-1])
-                    self.grayscale_matrix[index].append(self.grayscale_matrix[index][-1])
-                avg_row_len += len(self.binary_matrix[index])
-        avg_row_len /= len(self.binary_matrix)
-        # Remove all rows < average row length
-        remove = list()
-        for index, row in enumerate(self.binary_matrix):
-            if len(row) < avg_row_len:
-                remove.append(index)
-        for i in reversed(remove):
-            del self.binary_matrix[i]
-            del self.grayscale_matrix[i]
+        # Every line starts at its first black pixel and ends at the last
+        # black pixel position. If a line is too small, its last pixel is
+        # repeated.
+        columns = line.shape[1]
+        offsets = np.arange(last_black_pixel_position + 1)
+        indices = np.minimum(start[:, None] + offsets, columns - 1)
+        self.binary_matrix = np.ascontiguousarray(np.take_along_axis(line, indices, axis=1), dtype=np.uint8)
+        self.grayscale_matrix = np.ascontiguousarray(np.take_along_axis(grayscale_img, indices, axis=1), dtype=np.uint8)
 
     def print_pixel_matrix(self):
-        for row in self.pixel_matrix:
+        for row in self.binary_matrix:
             row_string = ''.join(map(str, row))
             print(row_string)
-    
+
     def print_gray_pixel_matrix(self):
-        for row in self.gray_matrix:
-            print(row)
\ No newline at end of file
+        for row in self.grayscale_matrix:
+            print(row)
@@ -0,0 +1,70 @@
+import importlib.util
+import unittest
+import numpy as np
+from Deadline import Deadline
+
+SCIPY_INSTALLED = importlib.util.find_spec('scipy') is not None
+if SCIPY_INSTALLED:
+    from CnnRowExtractor import CnnRowExtractor
+
+LINES = 100
+ROW_HEIGHT = 10
+
+
+class Labels:
+    classes_ = np.array([8, 10, 12, 20])
+
+
+def create_extractor():
+    # Only the dynamic program is tested, so the CNN is not loaded
+    extractor = CnnRowExtractor.__new__(CnnRowExtractor)
+    extractor.labels = Labels()
+    extractor.deadline = Deadline()
+    return extractor
+
+
+def create_log_probabilities():
+    """
+        Rows of 10 lines, the window at the start of a row predicts
+        a split point of 10 (0.55) or of 20 lines (0.45, two merged rows)
+    """
+    probabilities = np.full((LINES, len(Labels.classes_)), 0.001)
+    for start in range(0, LINES, ROW_HEIGHT):
+        probabilities[start] = [0.0, 0.55, 0.0, 0.45]
+    return np.log(np.maximum(probabilities, 1e-12))
+
+
+def follow_split_points(split_points, has_content):
+    rows = []
+    start = 0
+    while start < len(has_content) and has_content[start] and split_points[start] > 0:
+        rows.append(int(split_points[start]))
+        start += split_points[start]
+    return rows
+
+
+@unittest.skipUnless(SCIPY_INSTALLED, 'scipy is not installed')
+class SplitPointTest(unittest.TestCase):
+    def test_rows_are_not_merged(self):
+        has_content = np.ones(LINES, dtype=bool)
+        has_content[-1] = False
+        split_points = create_extractor().determine_split_points(create_log_probabilities(), has_content)
+        self.assertEqual(follow_split_points(split_points, has_content), [ROW_HEIGHT] * 10)
+
+    def test_end_along_path(self):
+        # An empty window between two row starts doesn't end the strip
+        has_content = np.ones(LINES, dtype=bool)
+        has_content[-1] = False
+        has_content[55] = False
+        split_points = create_extractor().determine_split_points(create_log_probabilities(), has_content)
+        self.assertEqual(follow_split_points(split_points, has_content), [ROW_HEIGHT] * 10)
+
+    def test_end_at_empty_row_start(self):
+        has_content = np.ones(LINES, dtype=bool)
+        has_content[60:] = False
+        split_points = create_extractor().determine_split_points(create_log_probabilities(), has_content)
+        self.assertEqual(follow_split_points(split_points, has_content), [ROW_HEIGHT] * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from DataExtractor import DataExtractor
+from SoftstripEncoder import SoftstripEncoder, VERTICAL_SYNC_ROWS
+
+PAYLOAD = bytes(range(64))
+# The first data row holds the sync bytes and the low byte of the length
+LENGTH_ROW = VERTICAL_SYNC_ROWS
+
+
+def create_rows(payload=PAYLOAD):
+    encoder = SoftstripEncoder()
+    data = encoder.create_strip_bytes(payload, 'TEST', 'CAUZIN', 1, True, len(payload))
+    # The row decoders return the candidates of each row
+    return encoder, data, [[row] for row in encoder.create_rows(data)]
+
+
+class DataExtractorTest(unittest.TestCase):
+    def test_extract_data(self):
+        _, _, rows = create_rows()
+        extractor = DataExtractor()
+        extractor.extract_data(rows, True)
+        self.assertTrue(extractor.valid)
+        self.assertEqual(bytes(extractor.data), PAYLOAD)
+
+    def test_alternative_payload_row(self):
+        encoder, data, rows = create_rows()
+        corrupted = list(data)
+        corrupted[20] ^= 0xff
+        corrupted_rows = encoder.create_rows(corrupted)
+        raw_data = list(rows)
+        raw_data[9] = [corrupted_rows[9], rows[9][0]]
+        extractor = DataExtractor()
+        extractor.extract_data(raw_data, True)
+        self.assertTrue(extractor.valid)
+        self.assertEqual(bytes(extractor.data), PAYLOAD)
+
+    def test_corrupted_length_field(self):
+        encoder, data, rows = create_rows()
+        corrupted = list(data)
+        corrupted[3:5] = [0x00, 0x00]
+        corrupted_rows = encoder.create_rows(corrupted)
+        raw_data = list(rows)
+        # The first candidates zero the length field
+        raw_data[LENGTH_ROW] = [corrupted_rows[LENGTH_ROW], rows[LENGTH_ROW][0]]
+        raw_data[9] = rows[9] * 2
+        extractor = DataExtractor()
+        extractor.extract_data(raw_data, True)
+        self.assertTrue(extractor.valid)
+        self.assertEqual(bytes(extractor.data), PAYLOAD)
+
+    def test_strip_header(self):
+        _, _, rows = create_rows()
+        extractor = DataExtractor()
+        self.assertTrue(extractor.extract_strip_header(rows[:LENGTH_ROW + 4]))
+        self.assertEqual(bytes(extractor.attributes['strip_id']), b'CAUZIN')
+        self.assertEqual(extractor.attributes['seq_no'], 1)
+
+    def test_strip_header_in_vertical_sync(self):
+        _, _, rows = create_rows()
+        for end in range(LENGTH_ROW + 4):
+            self.assertFalse(DataExtractor().extract_strip_header(rows[:end]))
+
+    def test_search_checksum_with_corrupted_length(self):
+        _, _, rows = create_rows()
+        raw_data = list(rows)
+        raw_data[9] = rows[9] * 2
+        extractor = DataExtractor()
+        extractor.extract_all_data_bits(raw_data)
+        data = extractor.parse_up_to_checksum()
+        extractor.attributes['length'] = [0x00, 0x00]
+        self.assertIsNone(extractor.search_checksum(raw_data, {}, [0], data))
+
+
+if __name__ == '__main__':
+    unittest.main()
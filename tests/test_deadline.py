@@ -0,0 +1,44 @@
+import unittest
+from SoftstripEncoder import SoftstripEncoder
+from SoftstripDecoder import threshold_strip
+from SoftstripMatrix import SoftstripMatrix
+from HeaderExtractor import HeaderExtractor
+from Backends import create_row_extractor, ALGO_ROW_EXTRACTOR
+from Deadline import Deadline, StageTimeout, HEADER_STAGE, ROW_EXTRACTION_STAGE
+
+
+def create_softstrip_matrix():
+    binary_img, gray_img = threshold_strip(SoftstripEncoder(seed=0).encode(bytes(512), 'TEST.BIN')[0])
+    return SoftstripMatrix(binary_img, gray_img)
+
+
+def create_expired_deadline(stage):
+    deadline = Deadline({stage: 0})
+    deadline.start_stage(stage)
+    return deadline
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_header_stage_is_aborted(self):
+        header_extractor = HeaderExtractor(create_softstrip_matrix(), create_expired_deadline(HEADER_STAGE))
+        with self.assertRaises(StageTimeout) as context:
+            header_extractor.parse_header()
+        self.assertEqual(context.exception.stage, HEADER_STAGE)
+
+    def test_row_extraction_stage_is_aborted(self):
+        softstrip_matrix = create_softstrip_matrix()
+        header_extractor = HeaderExtractor(softstrip_matrix)
+        header_extractor.parse_header()
+        deadline = Deadline()
+        deadline.start_stage(ROW_EXTRACTION_STAGE)
+        deadline.cancel()
+        row_extractor = create_row_extractor(ALGO_ROW_EXTRACTOR, softstrip_matrix,
+                                             header_extractor.get_bits_per_row(), deadline)
+        with self.assertRaises(StageTimeout) as context:
+            row_extractor.extract_grouped_rows()
+        self.assertTrue(context.exception.cancelled)
+        self.assertEqual(context.exception.stage, ROW_EXTRACTION_STAGE)
+
+
+if __name__ == '__main__':
+    unittest.main()
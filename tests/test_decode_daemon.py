@@ -0,0 +1,41 @@
+import os
+import tempfile
+import threading
+import unittest
+from DecodeDaemon import DecodeDaemon, send_request, validate_request
+
+
+class ValidateRequestTest(unittest.TestCase):
+    def test_valid_requests(self):
+        self.assertIsNone(validate_request({'paths': ['strip1.png', 'strip2.png'], 'output': 'decoded'}))
+        self.assertIsNone(validate_request({'paths': ['strip1.png']}))
+        self.assertIsNone(validate_request({'shutdown': True}))
+
+    def test_malformed_requests(self):
+        for request in [['strip1.png'], {}, {'path': 'strip1.png'}, {'paths': 'strip1.png'}, {'paths': []},
+                        {'paths': [1]}, {'paths': ['strip1.png'], 'output': 1}]:
+            self.assertIsNotNone(validate_request(request), request)
+
+
+class DecodeDaemonTest(unittest.TestCase):
+    def test_malformed_request_response(self):
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, 'decoder.sock')
+            daemon = DecodeDaemon(socket_path)
+            thread = threading.Thread(target=daemon.serve_forever, kwargs={'poll_interval': 0.05})
+            thread.start()
+            try:
+                response = send_request({'output': 'decoded'}, socket_path)
+                self.assertIn('error', response)
+                response = send_request(['strip1.png'], socket_path)
+                self.assertIn('error', response)
+                self.assertEqual(send_request({'shutdown': True}, socket_path), {'shutdown': True})
+            finally:
+                thread.join(5)
+                if thread.is_alive():
+                    daemon.shutdown()
+                daemon.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
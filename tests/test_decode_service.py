@@ -0,0 +1,131 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+import cv2
+import numpy as np
+from SoftstripEncoder import SoftstripEncoder
+from SoftstripDecoder import SoftstripDecoder
+from Backends import ALGO_ROW_DECODER, ALGO_ROW_EXTRACTOR
+from Binarization import FIXED_BINARIZATION
+from DecodeService import DecodeJob, DecodeService, MAX_QUEUED_PROGRESS_EVENTS, CANCELLED_STATE, FINISHED_STATE
+
+FILENAME = 'TEST.BIN'
+# The CNNs are not needed for the algorithmic pipeline
+CONFIG = {'row_decoder': ALGO_ROW_DECODER, 'row_extractor': ALGO_ROW_EXTRACTOR,
+          'binarization': FIXED_BINARIZATION, 'row_workers': 1, 'result_cache': '', 'timeout': {}}
+
+
+def load_config(decoder):
+    decoder.config = dict(CONFIG)
+
+
+class DecodeJobTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_rows_decoded_events_are_dropped(self):
+        job = DecodeJob(1, ['strip.png'], '', self.loop)
+        rows = 10 * MAX_QUEUED_PROGRESS_EVENTS
+        job.publish({'event': 'strip_started', 'strip': 0})
+        job.publish({'event': 'header', 'bits_per_row': 78})
+        for decoded in range(rows):
+            job.publish({'event': 'rows_decoded', 'decoded': decoded + 1, 'rows': rows})
+        job.publish({'event': 'checksum', 'valid': True})
+        job.publish({'event': 'finished', 'state': FINISHED_STATE, 'result': None})
+
+        async def read_events():
+            return [event async for event in job.stream()]
+        events = self.loop.run_until_complete(read_events())
+        self.assertLessEqual(len(events), MAX_QUEUED_PROGRESS_EVENTS + 3)
+        names = [event['event'] for event in events]
+        self.assertEqual(names[:2], ['strip_started', 'header'])
+        self.assertEqual(names[-2:], ['checksum', 'finished'])
+        # The last row of the strip is always reported
+        self.assertEqual(events[-3]['decoded'], rows)
+        self.assertEqual(events[-1]['job'], 1)
+
+
+@mock.patch.object(SoftstripDecoder, 'load_config', load_config)
+class DecodeServiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        payload = np.random.RandomState(0).randint(0, 256, 6 * 512).astype(np.uint8).tobytes()
+        cls.payload = payload
+        cls.paths = []
+        for i, img in enumerate(SoftstripEncoder(seed=0, strip_capacity=512).encode(payload, FILENAME)):
+            path = os.path.join(cls.directory.name, 'strip' + str(i + 1) + '.png')
+            cv2.imwrite(path, img)
+            cls.paths.append(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_serve(self):
+        output_dir = os.path.join(self.directory.name, 'serve')
+
+        async def serve():
+            service = DecodeService(workers=1)
+            requests = asyncio.Queue()
+            events = asyncio.Queue()
+            requests.put_nowait({'paths': self.paths, 'output': output_dir})
+            requests.put_nowait(None)
+            await service.serve(requests, events)
+            service.close()
+            return [events.get_nowait() for _ in range(events.qsize())]
+        events = self.loop.run_until_complete(serve())
+        names = [event['event'] for event in events]
+        self.assertEqual(names[0], 'started')
+        for name in ['strip_started', 'header', 'rows_extracted', 'rows_decoded', 'checksum', 'strip_finished']:
+            self.assertEqual(names.count(name) > 0, True, name)
+        self.assertEqual(names.count('strip_finished'), len(self.paths))
+        self.assertEqual(events[-1]['event'], 'finished')
+        self.assertEqual(events[-1]['state'], FINISHED_STATE)
+        self.assertTrue(events[-1]['result']['valid'])
+        with open(os.path.join(output_dir, FILENAME), 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+
+    def test_cancel(self):
+        output_dir = os.path.join(self.directory.name, 'cancel')
+
+        async def decode():
+            service = DecodeService(workers=1)
+            running = service.submit(self.paths, output_dir)
+            queued = service.submit(self.paths, output_dir)
+            # The queued job is cancelled before it starts
+            queued.cancel()
+            states = {}
+            async for event in running.stream():
+                if event['event'] == 'strip_started' and event['strip'] == 0:
+                    running.cancel()
+                if event['event'] == 'finished':
+                    states['running'] = (event['state'], event['result'])
+            await queued.wait()
+            states['queued'] = (queued.state, queued.result)
+            service.close()
+            return states
+        states = self.loop.run_until_complete(decode())
+        state, result = states['running']
+        self.assertEqual(state, CANCELLED_STATE)
+        self.assertTrue(result['timeout']['cancelled'])
+        self.assertEqual(states['queued'], (CANCELLED_STATE, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
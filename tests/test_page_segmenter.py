@@ -0,0 +1,41 @@
+import os
+import unittest
+import cv2
+import numpy as np
+from SoftstripEncoder import SoftstripEncoder
+from PageSegmenter import read_strip_header, group_strips, UNKNOWN_STRIP_ID
+
+PAYLOAD = bytes(range(256)) * 6
+SAMPLE_STRIP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'Softstrips', 'icons', 'glyphicons-1-glass.png')
+
+
+class PageSegmenterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.strips = SoftstripEncoder(seed=0, strip_capacity=512).encode(PAYLOAD, 'TEST.BIN', 'SEGM')
+
+    def test_read_strip_header(self):
+        for seq_no, strip in enumerate(self.strips, 1):
+            self.assertEqual(read_strip_header(strip), ('SEGM  ', seq_no))
+
+    def test_read_sample_strip_header(self):
+        # The vertical sync section of a scanned strip spans several chunks of rows
+        strip = cv2.imread(SAMPLE_STRIP, cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(read_strip_header(strip), ('TICKET', 1))
+
+    def test_unreadable_crop(self):
+        noise = np.random.RandomState(0).randint(0, 256, (200, 100)).astype(np.uint8)
+        self.assertIsNone(read_strip_header(noise))
+        self.assertIsNone(read_strip_header(np.full((200, 100), 255, np.uint8)))
+
+    def test_group_strips(self):
+        noise = np.random.RandomState(0).randint(0, 256, (200, 100)).astype(np.uint8)
+        strips = [self.strips[2], noise, self.strips[0], self.strips[1]]
+        groups = group_strips(strips)
+        self.assertEqual([strip_id for strip_id, _ in groups], ['SEGM  ', UNKNOWN_STRIP_ID])
+        self.assertEqual([id(strip) for strip in groups[0][1]], [id(strip) for strip in self.strips])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+from SoftstripEncoder import SoftstripEncoder
+from SoftstripDecoder import SoftstripDecoder, threshold_strip
+from SoftstripMatrix import SoftstripMatrix
+from HeaderExtractor import HeaderExtractor
+from Backends import create_row_extractor, ALGO_ROW_EXTRACTOR, ALGO_ROW_DECODER
+from Binarization import FIXED_BINARIZATION
+from Deadline import ROW_DECODING_STAGE
+from Metrics import Metrics
+from ResultCache import ResultCache, encode_grouped_rows, decode_grouped_rows, hash_pixels, DATA_RESULT, ROWS_RESULT
+
+# The algorithmic row extractor needs a few segments of rows
+PAYLOAD = bytes(range(256)) * 2
+
+
+def extract_grouped_rows():
+    binary_img, gray_img = threshold_strip(SoftstripEncoder(seed=0).encode(PAYLOAD, 'TEST')[0])
+    softstrip_matrix = SoftstripMatrix(binary_img, gray_img)
+    header_extractor = HeaderExtractor(softstrip_matrix)
+    header_extractor.parse_header()
+    bits_count = header_extractor.get_bits_per_row()
+    grouped_matrix, gray_grouped_matrix = create_row_extractor(ALGO_ROW_EXTRACTOR, softstrip_matrix,
+                                                               bits_count, None).extract_grouped_rows()
+    return grouped_matrix, gray_grouped_matrix, bits_count, header_extractor.vertical_sync_start
+
+
+class GroupedRowsTest(unittest.TestCase):
+    def test_round_trip(self):
+        grouped_matrix, gray_grouped_matrix, bits_count, vertical_sync_start = extract_grouped_rows()
+        result = decode_grouped_rows(encode_grouped_rows(grouped_matrix, gray_grouped_matrix,
+                                                         bits_count, vertical_sync_start))
+        new_grouped_matrix, new_gray_grouped_matrix, new_bits_count, new_vertical_sync_start = result
+
+        self.assertIs(type(new_bits_count), int)
+        self.assertEqual(new_bits_count, bits_count)
+        self.assertIs(type(new_vertical_sync_start), int)
+        self.assertEqual(new_vertical_sync_start, vertical_sync_start)
+        self.assertEqual(len(new_grouped_matrix), len(grouped_matrix))
+        for row, new_row in zip(grouped_matrix, new_grouped_matrix):
+            self.assertEqual(len(row), len(new_row))
+            for line, new_line in zip(row, new_row):
+                self.assertEqual((line['pattern'], line['index']), (new_line['pattern'], new_line['index']))
+                np.testing.assert_array_equal(line['row'], new_line['row'])
+        for row, new_row in zip(gray_grouped_matrix, new_gray_grouped_matrix):
+            np.testing.assert_array_equal(np.array(row).reshape(len(new_row), -1), new_row)
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'results.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_get(self):
+        cache = ResultCache(self.path)
+        key = cache.create_key(hash_pixels(np.zeros((4, 4), np.uint8)), {}, DATA_RESULT, True)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, {'data': b'abc'})
+        self.assertEqual(cache.get(key), {'data': b'abc'})
+        cache.put_arrays(key, {'lines': np.arange(6).reshape(2, 3)})
+        np.testing.assert_array_equal(cache.get_arrays(key)['lines'], np.arange(6).reshape(2, 3))
+        cache.close()
+
+    def test_keys(self):
+        cache = ResultCache(self.path)
+        pixel_hash = hash_pixels(np.zeros((4, 4), np.uint8))
+        key = cache.create_key(pixel_hash, {'row_decoder': 0}, ROWS_RESULT)
+        self.assertNotEqual(key, cache.create_key(pixel_hash, {'row_decoder': 1}, ROWS_RESULT))
+        self.assertNotEqual(key, cache.create_key(hash_pixels(np.ones((4, 4), np.uint8)),
+                                                  {'row_decoder': 0}, ROWS_RESULT))
+        cache.close()
+
+    def test_evict_least_recently_used(self):
+        cache = ResultCache(self.path)
+        # The maximum size is given in MB
+        cache.max_size = 2500
+        cache.put('first', bytes(1000))
+        time.sleep(0.01)
+        cache.put('second', bytes(1000))
+        time.sleep(0.01)
+        cache.get('first')
+        cache.put('third', bytes(1000))
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('third'))
+        cache.close()
+
+
+class CachedDecoder(SoftstripDecoder):
+    """
+        Decodes with the algorithmic pipeline and a result cache
+        instead of the options of config.yaml
+    """
+    def __init__(self, strips, output_dir, cache_path, timeout):
+        self.cache_path = cache_path
+        self.timeout_budgets = timeout
+        self.collected_metrics = Metrics()
+        super(CachedDecoder, self).__init__(strips, output_dir, metrics=self.collected_metrics)
+
+    def load_config(self):
+        self.config = {'row_decoder': ALGO_ROW_DECODER, 'row_extractor': ALGO_ROW_EXTRACTOR,
+                       'binarization': FIXED_BINARIZATION, 'row_workers': 1,
+                       'result_cache': self.cache_path, 'timeout': self.timeout_budgets}
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_resume_at_row_decoding(self):
+        binary_img, gray_img = threshold_strip(SoftstripEncoder(seed=0).encode(PAYLOAD, 'TEST.BIN')[0])
+        strips = [('strip.png', binary_img, gray_img)]
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, 'results.db')
+            decoder = CachedDecoder(strips, directory, cache_path, {ROW_DECODING_STAGE: 0})
+            self.assertIsNotNone(decoder.timeout)
+            self.assertEqual(decoder.timeout.stage, ROW_DECODING_STAGE)
+
+            decoder = CachedDecoder(strips, directory, cache_path, {})
+            self.assertTrue(decoder.valid)
+            self.assertIs(type(decoder.bits_count), int)
+            counters = decoder.collected_metrics.records[0]['counters']
+            # The grouped rows are read from the cache, the rows aren't extracted again
+            self.assertEqual(counters['cache_hits'], 1)
+            self.assertNotIn('rows', counters)
+            with open(os.path.join(directory, 'TEST.BIN'), 'rb') as f:
+                self.assertEqual(f.read(), PAYLOAD)
+
+
+if __name__ == '__main__':
+    unittest.main()
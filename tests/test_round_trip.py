@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from SoftstripEncoder import SoftstripEncoder
+from SoftstripDecoder import SoftstripDecoder, threshold_strip
+from SoftstripMatrix import SoftstripMatrix
+from HeaderExtractor import HeaderExtractor
+from Backends import create_row_extractor, create_row_decoder, ALGO_ROW_EXTRACTOR, ALGO_ROW_DECODER
+from DataExtractor import DataExtractor
+from Binarization import FIXED_BINARIZATION
+
+FILENAME = 'TEST.BIN'
+# The payloads fill at least 512 bytes per strip, the algorithmic
+# row extractor needs a few segments of rows
+# The CNNs are not needed for the algorithmic pipeline
+CONFIG = {'row_decoder': ALGO_ROW_DECODER, 'row_extractor': ALGO_ROW_EXTRACTOR,
+          'binarization': FIXED_BINARIZATION, 'row_workers': 1, 'result_cache': '', 'timeout': {}}
+
+
+def create_payload(size, seed=0):
+    return np.random.RandomState(seed).randint(0, 256, size).astype(np.uint8).tobytes()
+
+
+def decode_strip(img, first_strip):
+    """
+        Decodes a single strip with the algorithmic pipeline
+    """
+    binary_img, gray_img = threshold_strip(img)
+    softstrip_matrix = SoftstripMatrix(binary_img, gray_img)
+    header_extractor = HeaderExtractor(softstrip_matrix)
+    header_extractor.parse_header()
+    bits_count = header_extractor.get_bits_per_row()
+    grouped_matrix, gray_grouped_matrix = create_row_extractor(ALGO_ROW_EXTRACTOR, softstrip_matrix,
+                                                               bits_count, None).extract_grouped_rows()
+    rows = create_row_decoder(ALGO_ROW_DECODER, grouped_matrix, gray_grouped_matrix, bits_count,
+                              header_extractor.vertical_sync_start, None).decode_rows()
+    data_extractor = DataExtractor()
+    data_extractor.extract_data(rows, first_strip)
+    return data_extractor
+
+
+class ConfiguredDecoder(SoftstripDecoder):
+    """
+        Uses the config of the test instead of config.yaml
+    """
+    config_overrides = {}
+
+    def load_config(self):
+        self.config = dict(CONFIG, **self.config_overrides)
+
+
+class RoundTripTest(unittest.TestCase):
+    def assert_round_trip(self, payload, encoder):
+        imgs = encoder.encode(payload, FILENAME)
+        data = b''
+        for i, img in enumerate(imgs):
+            data_extractor = decode_strip(img, i == 0)
+            self.assertTrue(data_extractor.valid)
+            self.assertEqual(data_extractor.file_header.seq_num, i + 1)
+            if i == 0:
+                self.assertEqual(data_extractor.file_header.filename, FILENAME)
+                self.assertEqual(data_extractor.file_header.file_length, len(payload))
+            data += bytes(data_extractor.data)
+        self.assertEqual(data, payload)
+
+    def test_single_strip(self):
+        for seed in range(3):
+            self.assert_round_trip(create_payload(512, seed), SoftstripEncoder(seed=seed))
+
+    def test_multiple_strips(self):
+        self.assert_round_trip(create_payload(1536), SoftstripEncoder(seed=0, strip_capacity=512))
+
+    def test_nibbles(self):
+        self.assert_round_trip(create_payload(768), SoftstripEncoder(nibbles=6, seed=0))
+
+    def test_degraded_strip(self):
+        self.assert_round_trip(create_payload(512), SoftstripEncoder(noise=8, blur=0.5, seed=0))
+
+    def test_softstrip_decoder(self):
+        payload = create_payload(1536)
+        imgs = SoftstripEncoder(seed=0, strip_capacity=512).encode(payload, FILENAME)
+        strips = [('strip' + str(i + 1) + '.png',) + threshold_strip(img) for i, img in enumerate(imgs)]
+        with tempfile.TemporaryDirectory() as output_dir:
+            decoder = ConfiguredDecoder(strips, output_dir)
+            self.assertTrue(decoder.valid)
+            with open(os.path.join(output_dir, FILENAME), 'rb') as f:
+                self.assertEqual(f.read(), payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import threading
+import time
+import unittest
+from Deadline import Deadline, StageTimeout, ROW_DECODING_STAGE
+from RowScheduler import RowScheduler, THREAD_SCHEDULER, PROCESS_SCHEDULER, MIN_ROWS_PER_WORKER
+
+
+def square(row):
+    return row * row
+
+
+def sleep_row(row):
+    time.sleep(60)
+    return row
+
+
+class RowSchedulerTest(unittest.TestCase):
+    def test_row_order(self):
+        rows = list(range(4 * MIN_ROWS_PER_WORKER))
+        for scheduler in (THREAD_SCHEDULER, PROCESS_SCHEDULER):
+            for workers in (1, 4):
+                results = list(RowScheduler(workers, scheduler).map(square, rows))
+                self.assertEqual(results, [row * row for row in rows])
+
+    def test_cancel_process_workers(self):
+        cancel_event = threading.Event()
+        deadline = Deadline(cancel_event=cancel_event)
+        deadline.start_stage(ROW_DECODING_STAGE)
+        threading.Timer(0.5, cancel_event.set).start()
+        rows = list(range(2 * MIN_ROWS_PER_WORKER))
+        start = time.monotonic()
+        with self.assertRaises(StageTimeout) as context:
+            list(RowScheduler(2, PROCESS_SCHEDULER).map(sleep_row, rows, deadline.check))
+        self.assertTrue(context.exception.cancelled)
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_process_workers_timeout(self):
+        deadline = Deadline({ROW_DECODING_STAGE: 0.5})
+        deadline.start_stage(ROW_DECODING_STAGE)
+        rows = list(range(2 * MIN_ROWS_PER_WORKER))
+        with self.assertRaises(StageTimeout) as context:
+            list(RowScheduler(2, PROCESS_SCHEDULER).map(sleep_row, rows, deadline.check))
+        self.assertEqual(context.exception.stage, ROW_DECODING_STAGE)
+
+
+if __name__ == '__main__':
+    unittest.main()
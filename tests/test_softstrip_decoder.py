@@ -0,0 +1,60 @@
+import gc
+import os
+import tempfile
+import unittest
+import weakref
+import cv2
+from SoftstripEncoder import SoftstripEncoder
+from SoftstripDecoder import SoftstripDecoder, read_strips, threshold_strip
+from Backends import ALGO_ROW_DECODER, ALGO_ROW_EXTRACTOR
+from Binarization import FIXED_BINARIZATION
+from Metrics import Metrics
+
+
+class ConfiguredDecoder(SoftstripDecoder):
+    """
+        Uses the algorithmic pipeline instead of the options of config.yaml
+    """
+    def load_config(self):
+        self.config = {'row_decoder': ALGO_ROW_DECODER, 'row_extractor': ALGO_ROW_EXTRACTOR,
+                       'binarization': FIXED_BINARIZATION, 'row_workers': 1, 'result_cache': '', 'timeout': {}}
+
+
+class ReadStripsTest(unittest.TestCase):
+    def test_previous_strip_is_released(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for i, img in enumerate(SoftstripEncoder(seed=0, strip_capacity=512).encode(bytes(1024), 'TEST.BIN')):
+                paths.append(os.path.join(directory, 'strip' + str(i + 1) + '.png'))
+                cv2.imwrite(paths[-1], img)
+            strips = read_strips(paths)
+            path, binary_img, gray_img = next(strips)
+            self.assertEqual(path, paths[0])
+            references = [weakref.ref(binary_img), weakref.ref(gray_img)]
+            del binary_img, gray_img
+            gc.collect()
+            # Only the decoder holds the current strip
+            self.assertEqual([reference() for reference in references], [None, None])
+            self.assertEqual(next(strips)[0], paths[1])
+
+
+class FailedStripTest(unittest.TestCase):
+    def test_failed_strip_is_recorded(self):
+        # The algorithmic row extractor fails on a strip with a few rows
+        img = SoftstripEncoder(seed=0).encode(bytes(16), 'TEST.BIN')[0]
+        strips = [('strip1.png',) + threshold_strip(img)]
+        metrics = Metrics()
+        events = []
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError):
+                ConfiguredDecoder(strips, directory, metrics=metrics, progress=events.append)
+        self.assertEqual(len(metrics.records), 1)
+        self.assertEqual(metrics.records[0]['status'], 'error')
+        self.assertIn('error', metrics.records[0])
+        self.assertEqual(events[-1]['event'], 'strip_finished')
+        self.assertEqual(events[-1]['status'], 'error')
+        self.assertIn('strips_total{status="error"} 1', metrics.to_prometheus())
+
+
+if __name__ == '__main__':
+    unittest.main()